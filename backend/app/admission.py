@@ -0,0 +1,227 @@
+import asyncio
+import ipaddress
+import json
+import math
+import re
+import time
+from collections import deque
+
+from . import metrics
+
+# POST endpoints that hold a worker thread for the length of one or more model calls.
+LLM_BOUND_PATH_RE = re.compile(r"^/session/([^/]+)/(prompt|lock|end|build-narrative)$")
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency caps and a bounded FIFO wait queue for LLM-bound requests.
+
+    A request is refused with 429 when its session or client already has its
+    cap of requests running or queued, and with 503 when the queue is full, when
+    the expected wait (queue position x EWMA latency / concurrency) exceeds the
+    queue deadline, or when the deadline passes while waiting. Every refusal
+    carries a Retry-After estimated from the same numbers. Runs on the event
+    loop, so plain counters need no locking.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 32,
+        max_queue: int = 64,
+        queue_timeout: float = 10.0,
+        max_per_session: int = 1,
+        max_per_client: int = 8,
+        initial_latency: float = 2.0,
+        alpha: float = 0.2,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_per_session = max_per_session
+        self.max_per_client = max_per_client
+        self.alpha = alpha
+        self.ewma_latency = initial_latency
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._per_session: dict[str, int] = {}
+        self._per_client: dict[str, int] = {}
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.ewma_latency * (len(self._waiters) + 1) / self.max_concurrent))
+
+    def _reject(self, status_code: int, reason: str) -> Rejected:
+        metrics.increment(f"admission.rejected.{reason}")
+        return Rejected(status_code, reason, self.retry_after())
+
+    async def acquire(self, session_id: str, client_id: str) -> None:
+        if self._per_session.get(session_id, 0) >= self.max_per_session:
+            raise self._reject(429, "session_busy")
+        if self._per_client.get(client_id, 0) >= self.max_per_client:
+            raise self._reject(429, "client_busy")
+
+        if self.in_flight >= self.max_concurrent or self._waiters:
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject(503, "queue_full")
+            if (len(self._waiters) + 1) * self.ewma_latency / self.max_concurrent > self.queue_timeout:
+                raise self._reject(503, "overloaded")
+
+        self._per_session[session_id] = self._per_session.get(session_id, 0) + 1
+        self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+        try:
+            if self.in_flight >= self.max_concurrent or self._waiters:
+                await self._wait()
+            else:
+                self.in_flight += 1
+        except BaseException:
+            self._forget(session_id, client_id)
+            raise
+        metrics.increment("admission.admitted")
+
+    async def _wait(self) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.increment("admission.queued")
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as the deadline hit or the client went away; give it back.
+                self._release_slot()
+            else:
+                waiter.cancel()
+            if isinstance(exc, asyncio.TimeoutError):
+                raise self._reject(503, "queue_timeout") from None
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _forget(self, session_id: str, client_id: str) -> None:
+        for counts, key in ((self._per_session, session_id), (self._per_client, client_id)):
+            counts[key] -= 1
+            if counts[key] <= 0:
+                del counts[key]
+
+    def _release_slot(self) -> None:
+        # Hand the slot straight to the oldest live waiter, so in_flight never dips and lets a newcomer jump the queue.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def release(self, session_id: str, client_id: str, elapsed: float) -> None:
+        self.ewma_latency = self.alpha * elapsed + (1 - self.alpha) * self.ewma_latency
+        self._forget(session_id, client_id)
+        self._release_slot()
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "ewma_latency_seconds": round(self.ewma_latency, 4),
+            "max_concurrent": self.max_concurrent,
+        }
+
+
+Networks = tuple[ipaddress.IPv4Network | ipaddress.IPv6Network, ...]
+
+
+def parse_networks(entries: list[str]) -> Networks:
+    """Addresses or CIDR ranges, e.g. ["10.0.0.0/8", "127.0.0.1"]."""
+    return tuple(ipaddress.ip_network(entry.strip(), strict=False) for entry in entries)
+
+
+def _is_trusted(address: str, trusted: Networks) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted)
+
+
+def _client_id(scope, trusted_proxies: Networks = ()) -> str:
+    """The peer address; behind trusted proxies, the nearest X-Forwarded-For hop that is not one of them.
+
+    X-Forwarded-For is client-controlled up to the first trusted proxy, so it
+    is read right to left and only while each hop is a trusted proxy.
+    """
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    if not _is_trusted(address, trusted_proxies):
+        return address
+    hops = [
+        hop.strip()
+        for key, value in scope["headers"]
+        if key == b"x-forwarded-for"
+        for hop in value.decode("latin-1").split(",")
+    ]
+    for hop in reversed(hops):
+        if not hop:
+            continue
+        address = hop
+        if not _is_trusted(hop, trusted_proxies):
+            break
+    return address
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware applying an AdmissionController to LLM-bound POSTs; other requests pass through."""
+
+    def __init__(self, app, controller: AdmissionController, trusted_proxies: list[str] | None = None):
+        self.app = app
+        self.controller = controller
+        self.trusted_proxies = parse_networks(trusted_proxies or [])
+
+    async def __call__(self, scope, receive, send):
+        match = LLM_BOUND_PATH_RE.match(scope.get("path", "")) if scope["type"] == "http" else None
+        if match is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        session_id, client_id = match.group(1), _client_id(scope, self.trusted_proxies)
+        try:
+            await self.controller.acquire(session_id, client_id)
+        except Rejected as rejected:
+            body = json.dumps({"detail": f"Server busy ({rejected.reason}); retry later"}).encode("utf-8")
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": rejected.status_code,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(rejected.retry_after).encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(session_id, client_id, time.monotonic() - started)
+
+
+def controller_from_settings() -> AdmissionController | None:
+    from .config import settings
+
+    if not settings.admission_enabled:
+        return None
+    return AdmissionController(
+        max_concurrent=settings.admission_max_concurrent,
+        max_queue=settings.admission_max_queue,
+        queue_timeout=settings.admission_queue_timeout_seconds,
+        max_per_session=settings.admission_max_per_session,
+        max_per_client=settings.admission_max_per_client,
+    )
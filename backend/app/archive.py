@@ -0,0 +1,121 @@
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from . import queries
+from .config import settings
+from .models import Event, EventChunk, LLMArtifact, MemoryBlock, NarrativeDraft, SearchDocument, Session as SessionModel, SessionState
+from .rows import row_from_dict, row_to_dict
+from .search import index_packed_events
+
+# Hot tables whose rows move into the per-session archive blob; the sessions and tab1_inputs rows stay as the stub.
+ARCHIVED_TABLES = [Event, EventChunk, MemoryBlock, NarrativeDraft, LLMArtifact]
+
+
+def archive_path(session_id: str) -> Path:
+    return Path(settings.archive_dir) / f"{session_id}.json.gz"
+
+
+def read_archive(session_id: str) -> dict[str, list[dict]]:
+    """Rows of an archived session keyed by table name, in row_to_dict form."""
+    with gzip.open(archive_path(session_id), "rt", encoding="utf-8") as fh:
+        return json.load(fh)["tables"]
+
+
+def archive_session(db: Session, session: SessionModel) -> bool:
+    """Move an ENDED session's hot rows into a compressed blob, leaving the session row as a stub.
+
+    The blob is written before rows are deleted, so a failed commit only leaves
+    a stale blob that the next run overwrites. The caller commits. Returns False,
+    archiving nothing, unless the session re-read under a row lock is ENDED and
+    not yet archived: a narrative build or another archiver may have got there
+    after the caller read it.
+    """
+    session = db.execute(
+        select(SessionModel)
+        .where(SessionModel.session_id == session.session_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalar_one()
+    if session.state != SessionState.ENDED or session.archived_at is not None:
+        return False
+
+    blob = {"session_id": session.session_id, "tables": {}}
+    for model in ARCHIVED_TABLES:
+        rows = db.execute(select(model).where(model.session_id == session.session_id)).scalars().all()
+        blob["tables"][model.__tablename__] = [row_to_dict(r) for r in rows]
+
+    path = archive_path(session.session_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as fh:
+        json.dump(blob, fh, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+    for model in ARCHIVED_TABLES:
+        db.execute(delete(model).where(model.session_id == session.session_id))
+    # Search documents are derived, so they are dropped rather than archived and rebuilt on rehydrate.
+    db.execute(delete(SearchDocument).where(SearchDocument.session_id == session.session_id))
+    session.archived_at = datetime.utcnow()
+    return True
+
+
+def archive_ended_sessions(db: Session, older_than_days: int | None = None, limit: int | None = None) -> int:
+    days = settings.archive_after_days if older_than_days is None else older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    query = queries.archivable_sessions(cutoff)
+    if limit:
+        query = query.limit(limit)
+
+    archived = 0
+    for session in db.execute(query).scalars().all():
+        archived += archive_session(db, session)
+        db.commit()
+    return archived
+
+
+def rehydrate_session(db: Session, session: SessionModel) -> None:
+    """Restore an archived session's rows into the hot tables. Commits; no-op if not archived."""
+    if session.archived_at is None:
+        return
+    # Re-read under a row lock so concurrent first accesses restore the rows only once.
+    session = db.execute(
+        select(SessionModel)
+        .where(SessionModel.session_id == session.session_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalar_one()
+    if session.archived_at is None:
+        return
+
+    tables = read_archive(session.session_id)
+    for model in ARCHIVED_TABLES:
+        db.add_all(row_from_dict(model, row) for row in tables.get(model.__tablename__, []))
+    # Restored rows are indexed as they flush; events inside packed chunks are not rows, so index them here.
+    index_packed_events(db, tables.get(EventChunk.__tablename__, []))
+    session.archived_at = None
+    db.commit()
+    archive_path(session.session_id).unlink(missing_ok=True)
+
+
+def main() -> None:
+    from .db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Archive ENDED sessions into compressed per-session blobs.")
+    parser.add_argument("--older-than-days", type=int, default=None, help=f"default: ARCHIVE_AFTER_DAYS ({settings.archive_after_days})")
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        count = archive_ended_sessions(db, args.older_than_days, args.limit)
+    print(f"archived {count} session(s) to {settings.archive_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import metrics, queries
+from .config import settings
+from .eventstore import compact_session_by_id
+from .llm import LLMProvider, MockLLMProvider, chat_messages, generate, log_artifact
+from .models import MemoryBlock, MemoryBlockType, SummaryJob, SummaryJobStatus
+from .routing import Endpoint, build_endpoints
+
+# Batch statuses that mean "not finished yet" (OpenAI batch API).
+_RUNNING_BATCH_STATUSES = {"validating", "in_progress", "finalizing", "cancelling"}
+
+# A CLAIMED or SUBMITTING job older than this was left by a worker that died mid-call; another worker takes it over.
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def summary_block(session_id: str, agent_id: str, payload: dict, output: str, created_at: datetime | None = None) -> MemoryBlock:
+    """The memory block an agent0 (lock) or agent8 (chunk) summary produces."""
+    if agent_id == "agent0":
+        block = MemoryBlock(
+            session_id=session_id,
+            type=MemoryBlockType.WORLD_CHAPTER_LOCK,
+            from_prompt_index=0,
+            to_prompt_index=0,
+            json_payload={
+                "summary": output,
+                "world_text": payload["world_text"],
+                "chapter_text": payload["chapter_text"],
+                "selected_agent_slots": payload["selected_agent_slots"],
+                "agent_names": payload["agent_names"],
+            },
+        )
+    else:
+        block = MemoryBlock(
+            session_id=session_id,
+            type=MemoryBlockType.TURN_DELTA,
+            from_prompt_index=payload["from_prompt_index"],
+            to_prompt_index=payload["to_prompt_index"],
+            json_payload={"summary": output, "event_count": len(payload["events"])},
+        )
+    if created_at is not None:
+        # Keep memory order = request order, however late the batch completes.
+        block.created_at = created_at
+    return block
+
+
+def should_batch(agent_id: str) -> bool:
+    return settings.summary_batching and agent_id in settings.summary_batch_agents
+
+
+def enqueue_summary(db: Session, session_id: str, agent_id: str, model: str, payload: dict) -> SummaryJob:
+    """Queue a summary for the batch worker instead of calling the model now. The caller commits."""
+    job = SummaryJob(session_id=session_id, agent_id=agent_id, model=model, payload=payload, status=SummaryJobStatus.PENDING)
+    db.add(job)
+    metrics.increment("batching.enqueued")
+    return job
+
+
+def _apply(db: Session, job: SummaryJob, output: str, provider_name: str) -> MemoryBlock:
+    log_artifact(db, job.session_id, job.agent_id, job.model, job.payload, output, provider_name)
+    block = summary_block(job.session_id, job.agent_id, job.payload, output, created_at=job.created_at)
+    db.add(block)
+    db.delete(job)
+    return block
+
+
+def _lock_jobs(db: Session, job_ids: list[str], *status: SummaryJobStatus) -> list[SummaryJob]:
+    """Re-read the jobs still queued (optionally only in ``status``) under row locks."""
+    query = select(SummaryJob).where(SummaryJob.job_id.in_(job_ids))
+    if status:
+        query = query.where(SummaryJob.status.in_(status))
+    return db.execute(query.with_for_update().execution_options(populate_existing=True)).scalars().all()
+
+
+def flush_session_jobs(db: Session, session_id: str, provider: LLMProvider) -> int:
+    """Run a session's outstanding jobs as direct calls, e.g. before end_chapter. The caller commits.
+
+    The model calls run before any job row is locked; jobs are then re-read
+    under a lock and only those still queued are applied, so one the worker
+    finished meanwhile keeps the worker's result. Jobs submitted to a batch or
+    claimed by the worker are taken too; the worker then finds them gone and
+    drops its results.
+    """
+    jobs = db.execute(queries.session_summary_jobs(session_id)).scalars().all()
+    outputs = {job.job_id: generate(provider, job.agent_id, job.model, job.payload) for job in jobs}
+    applied = 0
+    for job in _lock_jobs(db, list(outputs)):
+        _apply(db, job, outputs[job.job_id], provider.provider_name)
+        applied += 1
+    metrics.increment("batching.flushed", applied)
+    return applied
+
+
+class BatchClient:
+    provider_name = "batch"
+
+    def submit(self, jobs: list[SummaryJob]) -> str:
+        """Submit jobs as one batch and return its id."""
+        raise NotImplementedError
+
+    def poll(self, batch_id: str) -> dict[str, str] | None:
+        """None while the batch runs; then outputs by job_id (failed requests are missing)."""
+        raise NotImplementedError
+
+
+class LocalBatchClient(BatchClient):
+    """In-process stand-in for a batch endpoint: answers every request at submit time."""
+
+    provider_name = "batch-local"
+
+    def __init__(self, provider: LLMProvider | None = None):
+        self.provider = provider or MockLLMProvider()
+        self._batches: dict[str, dict[str, str]] = {}
+
+    def submit(self, jobs: list[SummaryJob]) -> str:
+        batch_id = f"local_{uuid.uuid4().hex}"
+        self._batches[batch_id] = {job.job_id: self.provider.generate(job.agent_id, job.model, job.payload) for job in jobs}
+        return batch_id
+
+    def poll(self, batch_id: str) -> dict[str, str] | None:
+        return self._batches.pop(batch_id, {})
+
+
+class OpenAIBatchClient(BatchClient):
+    """OpenAI-compatible Batch API: upload a JSONL of chat completions, create a batch, download results."""
+
+    provider_name = "openai-batch"
+
+    def __init__(self, endpoint: Endpoint):
+        self.endpoint = endpoint
+        self.base_url = endpoint.base_url.rstrip("/")
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.endpoint.api_key}"}
+
+    def submit(self, jobs: list[SummaryJob]) -> str:
+        import httpx
+
+        lines = "".join(
+            json.dumps(
+                {
+                    "custom_id": job.job_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.endpoint.model_for(job.agent_id, job.model),
+                        "messages": chat_messages(job.agent_id, job.payload),
+                        "temperature": 0.4,
+                    },
+                }
+            )
+            + "\n"
+            for job in jobs
+        )
+        with httpx.Client(timeout=90.0) as client:
+            upload = client.post(
+                f"{self.base_url}/files",
+                headers=self._headers(),
+                data={"purpose": "batch"},
+                files={"file": ("summaries.jsonl", lines.encode("utf-8"), "application/jsonl")},
+            )
+            upload.raise_for_status()
+            batch = client.post(
+                f"{self.base_url}/batches",
+                headers=self._headers(),
+                json={"input_file_id": upload.json()["id"], "endpoint": "/v1/chat/completions", "completion_window": "24h"},
+            )
+            batch.raise_for_status()
+            return batch.json()["id"]
+
+    def poll(self, batch_id: str) -> dict[str, str] | None:
+        import httpx
+
+        with httpx.Client(timeout=90.0) as client:
+            response = client.get(f"{self.base_url}/batches/{batch_id}", headers=self._headers())
+            response.raise_for_status()
+            batch = response.json()
+            if batch["status"] in _RUNNING_BATCH_STATUSES:
+                return None
+            if batch["status"] != "completed" or not batch.get("output_file_id"):
+                return {}
+            content = client.get(f"{self.base_url}/files/{batch['output_file_id']}/content", headers=self._headers())
+            content.raise_for_status()
+
+        outputs = {}
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response_body = (record.get("response") or {}).get("body") or {}
+            if (record.get("response") or {}).get("status_code") == 200 and response_body.get("choices"):
+                outputs[record["custom_id"]] = response_body["choices"][0]["message"]["content"].strip()
+        return outputs
+
+
+def batch_endpoint() -> Endpoint:
+    """The endpoint batches go to: SUMMARY_BATCH_ENDPOINT (or the first) of OPENAI_ENDPOINTS, else OPENAI_BASE_URL."""
+    if not settings.openai_endpoints:
+        if not settings.openai_api_key:
+            raise RuntimeError("OPENAI_API_KEY is required when LLM_PROVIDER=openai")
+        return Endpoint(name="default", base_url=settings.openai_base_url, api_key=settings.openai_api_key)
+    endpoints = build_endpoints(settings.openai_endpoints, settings.openai_api_key)
+    if not settings.summary_batch_endpoint:
+        return endpoints[0]
+    for endpoint in endpoints:
+        if endpoint.name == settings.summary_batch_endpoint:
+            return endpoint
+    raise RuntimeError(f"SUMMARY_BATCH_ENDPOINT={settings.summary_batch_endpoint} is not in OPENAI_ENDPOINTS")
+
+
+def get_batch_client() -> BatchClient:
+    if settings.llm_provider == "openai":
+        if not settings.llm_external_enabled:
+            raise RuntimeError("LLM provider is openai but LLM_EXTERNAL_ENABLED is false")
+        return OpenAIBatchClient(batch_endpoint())
+    return LocalBatchClient()
+
+
+def _call_claimed(db: Session, job_ids: list[str], provider: LLMProvider) -> tuple[int, set[str]]:
+    """Direct calls for jobs this worker has claimed and committed; no row is locked during a call.
+
+    Returns the jobs applied and the sessions that got a TURN_DELTA block.
+    """
+    applied, summarized = 0, set()
+    for job_id in job_ids:
+        job = db.get(SummaryJob, job_id)
+        if job is None:
+            continue
+        agent_id, model, payload = job.agent_id, job.model, job.payload
+        db.rollback()  # ends the read transaction, so nothing is held during the call
+        output = generate(provider, agent_id, model, payload)
+        # end_chapter may have flushed the job while the model ran; its result stands.
+        for locked in _lock_jobs(db, [job_id], SummaryJobStatus.CLAIMED):
+            if _apply(db, locked, output, provider.provider_name).type == MemoryBlockType.TURN_DELTA:
+                summarized.add(locked.session_id)
+            applied += 1
+        db.commit()
+    return applied, summarized
+
+
+def _submit_pending(db: Session, client: BatchClient) -> int:
+    """Claim pending jobs, upload them with no transaction open, then record the batch id.
+
+    Jobs are marked SUBMITTING and committed before the upload, so other
+    workers skip them and end_chapter can flush them meanwhile; only jobs
+    still SUBMITTING afterwards are moved to the batch. A failed upload puts
+    its jobs back to PENDING.
+    """
+    pending = db.execute(queries.pending_summary_jobs(settings.summary_batch_max_jobs).with_for_update(skip_locked=True)).scalars().all()
+    if not pending:
+        db.commit()
+        return 0
+    for job in pending:
+        job.status = SummaryJobStatus.SUBMITTING
+        job.updated_at = datetime.utcnow()
+    db.flush()
+    job_ids = [job.job_id for job in pending]
+    # Detached, the claimed rows keep their loaded values and the upload reads no more rows.
+    for job in pending:
+        db.expunge(job)
+    db.commit()
+
+    try:
+        batch_id = client.submit(pending)
+    except Exception:
+        for job in _lock_jobs(db, job_ids, SummaryJobStatus.SUBMITTING):
+            job.status = SummaryJobStatus.PENDING
+        db.commit()
+        raise
+
+    submitted = _lock_jobs(db, job_ids, SummaryJobStatus.SUBMITTING)
+    for job in submitted:
+        job.status = SummaryJobStatus.SUBMITTED
+        job.batch_id = batch_id
+    db.commit()
+    metrics.increment("batching.submitted", len(submitted))
+    return len(submitted)
+
+
+def run_batch_cycle(db: Session, client: BatchClient, provider: LLMProvider) -> dict[str, int]:
+    """Submit pending jobs as one batch, then apply every finished batch.
+
+    No job row stays locked while a batch uploads or a model runs: jobs are
+    claimed and committed first. Requests a batch could not answer fall back
+    to a direct call through ``provider``. Commits after each step. Sessions
+    that got a TURN_DELTA block are compacted afterwards when
+    pack_summarized_events is on.
+    """
+    counts = {"submitted": 0, "completed": 0, "fallback": 0}
+    summarized: set[str] = set()
+
+    # Uploads a dead worker left half done go out again; its batch, if any, matches no job and is ignored.
+    cutoff = datetime.utcnow() - CLAIM_TIMEOUT
+    stale_uploads = queries.stale_claimed_summary_jobs(cutoff, SummaryJobStatus.SUBMITTING)
+    for job in db.execute(stale_uploads.with_for_update(skip_locked=True)).scalars().all():
+        job.status = SummaryJobStatus.PENDING
+    db.commit()
+    counts["submitted"] = _submit_pending(db, client)
+
+    batch_ids = db.execute(
+        select(SummaryJob.batch_id).where(SummaryJob.status == SummaryJobStatus.SUBMITTED).distinct()
+    ).scalars().all()
+    claimed: list[str] = []
+    for batch_id in batch_ids:
+        outputs = client.poll(batch_id)
+        if outputs is None:
+            continue
+        # Jobs flushed by end_chapter meanwhile are gone; their results are dropped.
+        for job in db.execute(queries.batch_summary_jobs(batch_id).with_for_update()).scalars().all():
+            if job.status != SummaryJobStatus.SUBMITTED:
+                continue
+            if job.job_id in outputs:
+                if _apply(db, job, outputs[job.job_id], client.provider_name).type == MemoryBlockType.TURN_DELTA:
+                    summarized.add(job.session_id)
+                counts["completed"] += 1
+            else:
+                job.status = SummaryJobStatus.CLAIMED
+                job.updated_at = datetime.utcnow()
+                claimed.append(job.job_id)
+        db.commit()
+
+    stale = db.execute(queries.stale_claimed_summary_jobs(cutoff).with_for_update(skip_locked=True)).scalars().all()
+    for job in stale:
+        job.updated_at = datetime.utcnow()
+        claimed.append(job.job_id)
+    db.commit()
+
+    counts["fallback"], fallback_summarized = _call_claimed(db, claimed, provider)
+    summarized |= fallback_summarized
+    if settings.pack_summarized_events:
+        # Summarized ranges only get packed once their TURN_DELTA block exists, which for batched ones is now.
+        for session_id in sorted(summarized):
+            compact_session_by_id(session_id)
+    metrics.increment("batching.completed", counts["completed"])
+    metrics.increment("batching.fallback", counts["fallback"])
+    return counts
+
+
+def main() -> None:
+    from .db import SessionLocal
+    from .llm import get_provider
+
+    parser = argparse.ArgumentParser(description="Submit queued summaries through the batch API and write their memory blocks.")
+    parser.add_argument("--once", action="store_true", help="run one submit/poll cycle and exit")
+    parser.add_argument("--interval", type=float, default=settings.summary_batch_poll_seconds)
+    args = parser.parse_args()
+
+    client = get_batch_client()
+    provider = get_provider()
+    while True:
+        with SessionLocal() as db:
+            counts = run_batch_cycle(db, client, provider)
+        print(json.dumps(counts), flush=True)
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,59 @@ class Settings(BaseSettings):
     llm_external_enabled: bool = False
     openai_api_key: str = ""
     openai_base_url: str = "https://api.openai.com/v1"
+    # JSON list of {"name", "base_url", "api_key", "weight", "models"}; overrides openai_base_url when set.
+    openai_endpoints: list[dict] = []
+    llm_routing_strategy: str = "ewma"
+    llm_endpoint_cooldown_seconds: float = 30.0
+    # A summary covers at most chunk_size_prompts prompts; it comes earlier once summary_budget_chars of
+    # text has built up over at least summary_min_prompts prompts (budget 0 = prompt count only).
     chunk_size_prompts: int = 7
+    summary_min_prompts: int = 3
+    summary_budget_chars: int = 12000
+    recent_context_budget_chars: int = 8000
+    llm_coalesce_inflight: bool = True
+    prompt_cache_entries: int = 1024
+    retrieval_enabled: bool = True
+    retrieval_top_k: int = 4
+    retrieval_budget_chars: int = 1500
+    retrieval_max_sessions: int = 256
+    speculative_payloads: bool = False
+    speculative_max_entries: int = 2048
+    pack_summarized_events: bool = False
+    summary_batching: bool = False
+    # Agents whose summaries go through the batch worker; agent0 delays the world/chapter lock block until its batch completes.
+    summary_batch_agents: list[str] = ["agent8"]
+    summary_batch_max_jobs: int = 500
+    # Name of the OPENAI_ENDPOINTS entry that runs batches (a batch lives on one endpoint); empty = the first one.
+    summary_batch_endpoint: str = ""
+    summary_batch_poll_seconds: float = 30.0
+    # Admission control for /prompt, /lock, /end and /build-narrative (429/503 with Retry-After when full).
+    admission_enabled: bool = True
+    admission_max_concurrent: int = 32
+    admission_max_queue: int = 64
+    admission_queue_timeout_seconds: float = 10.0
+    admission_max_per_session: int = 1
+    admission_max_per_client: int = 8
+    # Peers (addresses or CIDR ranges) whose X-Forwarded-For is believed when identifying the client: the
+    # load balancer and, when sharding, the other API nodes. Everyone else is identified by their own address.
+    trusted_proxies: list[str] = []
+    # LLM-bound endpoints check for a gone client this often; its model calls are then cut short and rolled back.
+    cancel_on_disconnect: bool = True
+    disconnect_poll_seconds: float = 0.5
+    # Session-affinity routing: base URLs of all API nodes (or a file listing them) and this node's own URL.
+    shard_nodes: list[str] = []
+    shard_membership_file: str = ""
+    shard_membership_refresh_seconds: float = 5.0
+    shard_self_url: str = ""
+    db_auto_migrate: bool = False
+    # SQLite only, opt-in: WAL + synchronous=NORMAL + the pragmas below, one writer at a time. No throughput gain
+    # (benchmarks/sqlite_throughput.py is within noise); it makes SELECT ... FOR UPDATE exclude other writers.
+    sqlite_tuned: bool = False
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size_bytes: int = 268435456
+    sqlite_cache_size_kib: int = 65536
+    archive_dir: str = "./archive"
+    archive_after_days: int = 30
 
     model_config = SettingsConfigDict(env_file=".env")
 
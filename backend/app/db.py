@@ -1,4 +1,6 @@
-﻿from sqlalchemy import create_engine
+﻿import threading
+
+from sqlalchemy import Engine, event, create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 from .config import settings
@@ -13,6 +15,73 @@ SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, futu
 Base = declarative_base()
 
 
+def sqlite_pragmas() -> list[str]:
+    return [
+        "PRAGMA journal_mode=WAL",
+        # With WAL, NORMAL only fsyncs at checkpoints; a power cut can lose the last commits but not corrupt the file.
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}",
+        f"PRAGMA mmap_size={settings.sqlite_mmap_size_bytes}",
+        f"PRAGMA cache_size=-{settings.sqlite_cache_size_kib}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def tune_sqlite(engine: Engine, session_factory: sessionmaker) -> None:
+    """Apply sqlite_pragmas() on every new connection and let one session at a time write.
+
+    WAL lets readers run alongside the writer, but SQLite still allows a single
+    writer, and pysqlite's deferred transactions fail with "database is locked"
+    when two of them try to upgrade at once. A session takes the process-wide
+    writer lock before its first flush, DML statement or SELECT ... FOR UPDATE
+    and holds it until its transaction ends, so writers queue here instead.
+    busy_timeout covers other processes on the same file.
+
+    This buys correctness, not speed: writes are serialized, and
+    benchmarks/sqlite_throughput.py shows turns/s within noise of pysqlite's
+    defaults. What it adds is that FOR UPDATE re-reads (compaction, job
+    claims, archiving) exclude concurrent writers as they do on Postgres.
+    """
+    writer = threading.Lock()
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in sqlite_pragmas():
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    def _acquire(session) -> None:
+        if session.info.get("sqlite_writer"):
+            return
+        if not writer.acquire(timeout=settings.sqlite_busy_timeout_ms / 1000):
+            raise TimeoutError("Timed out waiting for the SQLite writer lock")
+        session.info["sqlite_writer"] = True
+
+    @event.listens_for(session_factory, "before_flush")
+    def _before_flush(session, flush_context, instances):
+        _acquire(session)
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def _before_execute(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            _acquire(orm_execute_state.session)
+        elif orm_execute_state.is_select and orm_execute_state.statement._for_update_arg is not None:
+            # SQLite has no row locks; SELECT ... FOR UPDATE takes the writer lock so it still serializes.
+            _acquire(orm_execute_state.session)
+
+    @event.listens_for(session_factory, "after_transaction_end")
+    def _after_transaction_end(session, transaction):
+        if transaction.parent is None and session.info.pop("sqlite_writer", False):
+            writer.release()
+
+
+if engine.dialect.name == "sqlite" and settings.sqlite_tuned:
+    tune_sqlite(engine, SessionLocal)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,161 @@
+import argparse
+import gzip
+import json
+from datetime import datetime
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from . import queries
+from .models import Event, EventChunk, MemoryBlock, MemoryBlockType, Session as SessionModel
+from .rows import row_from_dict, row_to_dict, row_values
+
+
+def pack_payload(events: list[Event]) -> bytes:
+    return gzip.compress(json.dumps([row_to_dict(ev) for ev in events], separators=(",", ":")).encode("utf-8"))
+
+
+def unpack_payload(payload: bytes) -> list[dict]:
+    """Event rows of a chunk in row_to_dict form, in prompt order."""
+    return json.loads(gzip.decompress(payload))
+
+
+def unpack_chunk_row(chunk: dict) -> list[dict]:
+    """Same as unpack_payload for an event_chunks row in row_to_dict form (archive blobs, exports)."""
+    return unpack_payload(row_values(EventChunk, chunk)["payload"])
+
+
+def pack_events(db: Session, session_id: str, from_prompt: int, to_prompt: int) -> EventChunk | None:
+    """Replace the event rows of a closed prompt range with one EventChunk. The caller commits.
+
+    Only ranges already covered by a TURN_DELTA block should be packed: their
+    events are never written again and only read back in bulk.
+    """
+    events = db.execute(queries.events_in_prompt_range(session_id, from_prompt, to_prompt)).scalars().all()
+    if not events:
+        return None
+    chunk = EventChunk(
+        session_id=session_id,
+        from_prompt_index=from_prompt,
+        to_prompt_index=to_prompt,
+        event_count=len(events),
+        payload=pack_payload(events),
+    )
+    db.add(chunk)
+    db.execute(
+        delete(Event).where(
+            Event.session_id == session_id,
+            Event.prompt_index >= from_prompt,
+            Event.prompt_index <= to_prompt,
+        )
+    )
+    return chunk
+
+
+def compact_session(db: Session, session: SessionModel) -> int:
+    """Pack every summarized prompt range that still has loose event rows; returns chunks written.
+
+    The session row is re-read under a row lock first, so compactions of one
+    session run one at a time and each sees what the previous one packed.
+    """
+    session = db.execute(
+        select(SessionModel)
+        .where(SessionModel.session_id == session.session_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalar_one()
+    if session.archived_at is not None:
+        return 0
+    packed = set(
+        db.execute(
+            queries.session_event_chunks(session.session_id).with_only_columns(EventChunk.from_prompt_index, EventChunk.to_prompt_index)
+        ).tuples()
+    )
+    blocks = db.execute(
+        queries.session_memory_blocks(session.session_id).where(
+            MemoryBlock.type == MemoryBlockType.TURN_DELTA,
+            MemoryBlock.to_prompt_index <= session.last_summarized_prompt_index,
+        )
+    ).scalars().all()
+    return sum(
+        pack_events(db, session.session_id, mb.from_prompt_index, mb.to_prompt_index) is not None
+        for mb in blocks
+        if (mb.from_prompt_index, mb.to_prompt_index) not in packed
+    )
+
+
+def compact_session_by_id(session_id: str) -> int:
+    """compact_session on its own DB session, for use as a background task after a response is sent."""
+    from .db import SessionLocal
+
+    with SessionLocal() as db:
+        session = db.get(SessionModel, session_id)
+        if session is None:
+            return 0
+        chunks = compact_session(db, session)
+        db.commit()
+    return chunks
+
+
+def load_events(db: Session, session_id: str, from_prompt: int | None = None, to_prompt: int | None = None) -> list[Event]:
+    """Events of a session (optionally a prompt range) in (prompt_index, created_at) order.
+
+    Loose rows and packed chunks are merged; events from chunks are transient
+    Event objects that are not attached to ``db``.
+    """
+    if from_prompt is None and to_prompt is None:
+        rows = db.execute(queries.session_events(session_id)).scalars().all()
+    else:
+        rows = db.execute(
+            queries.events_in_prompt_range(session_id, from_prompt or 1, to_prompt if to_prompt is not None else 2**31 - 1)
+        ).scalars().all()
+
+    chunks = db.execute(queries.session_event_chunks(session_id, from_prompt, to_prompt)).scalars().all()
+    if not chunks:
+        return list(rows)
+
+    packed = [
+        row_from_dict(Event, data)
+        for chunk in chunks
+        for data in unpack_payload(chunk.payload)
+        if (from_prompt is None or data["prompt_index"] >= from_prompt) and (to_prompt is None or data["prompt_index"] <= to_prompt)
+    ]
+    return sorted([*rows, *packed], key=lambda ev: (ev.prompt_index, ev.created_at))
+
+
+def load_event_views(db: Session, session_id: str) -> list[dict]:
+    """A session's events as dicts of queries.EVENT_VIEW_COLUMNS, merged from rows and chunks, in order."""
+    views = [dict(row) for row in db.execute(queries.session_event_views(session_id)).mappings()]
+    chunks = db.execute(queries.session_event_chunks(session_id)).scalars().all()
+    if not chunks:
+        return views
+
+    keys = [column.key for column in queries.EVENT_VIEW_COLUMNS]
+    for chunk in chunks:
+        for data in unpack_payload(chunk.payload):
+            view = {key: data[key] for key in keys}
+            view["created_at"] = datetime.fromisoformat(view["created_at"])
+            views.append(view)
+    return sorted(views, key=lambda ev: (ev["prompt_index"], ev["created_at"]))
+
+
+def main() -> None:
+    from .db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Pack summarized event ranges into compressed chunks.")
+    parser.add_argument("--session-id", action="append", dest="session_ids")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        query = select(SessionModel).where(SessionModel.archived_at.is_(None), SessionModel.last_summarized_prompt_index > 0)
+        if args.session_ids:
+            query = query.where(SessionModel.session_id.in_(args.session_ids))
+        chunks = 0
+        for session in db.execute(query).scalars().all():
+            chunks += compact_session(db, session)
+            db.commit()
+    print(f"packed {chunks} chunk(s)")
+
+
+if __name__ == "__main__":
+    main()
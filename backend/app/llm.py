@@ -1,11 +1,61 @@
 import hashlib
 import json
+import socket
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 
-import httpx
 from sqlalchemy.orm import Session
 
+from . import metrics
 from .config import settings
 from .models import LLMArtifact
+from .prompts import PromptRenderer
+from .routing import EndpointPool, build_endpoints
+
+# HTTP statuses that say "this endpoint is unhealthy right now" rather than "the request is bad".
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+prompt_renderer = PromptRenderer(settings.prompt_cache_entries)
+metrics.register_collector("prompt_cache", prompt_renderer.stats)
+
+
+def chat_messages(agent_id: str, payload: dict) -> list[dict]:
+    rendered = prompt_renderer.render(agent_id, payload)
+    # Only prompts actually sent upstream count; compare with llm.cached_prompt_tokens.
+    metrics.increment("llm.prompt_chars", len(rendered.system) + len(rendered.user))
+    metrics.increment("llm.cacheable_prefix_chars", rendered.cacheable_prefix_chars)
+    return [
+        {"role": "system", "content": rendered.system},
+        {"role": "user", "content": rendered.user},
+    ]
+
+
+class GenerationCancelled(Exception):
+    """The request a generation was for has been cancelled (its client disconnected)."""
+
+
+_cancel_event: ContextVar[threading.Event | None] = ContextVar("cancel_event", default=None)
+
+
+@contextmanager
+def cancel_on(event: threading.Event):
+    """Make model calls inside the block stop with GenerationCancelled once ``event`` is set."""
+    token = _cancel_event.set(event)
+    try:
+        yield event
+    finally:
+        _cancel_event.reset(token)
+
+
+def cancellable() -> bool:
+    return _cancel_event.get() is not None
+
+
+def raise_if_cancelled() -> None:
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise GenerationCancelled()
 
 
 class LLMProvider:
@@ -45,93 +95,267 @@ class OpenAIProvider(LLMProvider):
         self.base_url = base_url.rstrip("/")
 
     def generate(self, agent_id: str, model: str, payload: dict) -> str:
-        system_prompt = self._system_prompt(agent_id)
-        user_prompt = self._user_prompt(agent_id, payload)
+        return self._chat_completion(self.base_url, self.api_key, model, self._messages(agent_id, payload))
+
+    def _messages(self, agent_id: str, payload: dict) -> list[dict]:
+        return chat_messages(agent_id, payload)
 
+    def _chat_completion(self, base_url: str, api_key: str, model: str, messages: list[dict]) -> str:
+        import httpx
+
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        body = {
+            "model": model,
+            "messages": messages,
+            "temperature": 0.4,
+        }
         with httpx.Client(timeout=90.0) as client:
-            response = client.post(
-                f"{self.base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": model,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    "temperature": 0.4,
-                },
-            )
+            if cancellable():
+                return self._stream_completion(client, f"{base_url}/chat/completions", headers, body)
+            response = client.post(f"{base_url}/chat/completions", headers=headers, json=body)
             response.raise_for_status()
             data = response.json()
+            self._record_usage(data.get("usage") or {})
             return data["choices"][0]["message"]["content"].strip()
 
-    def _system_prompt(self, agent_id: str) -> str:
-        if agent_id == "agent0":
-            return "Summarize Tab1 world/chapter setup into compact structured narrative memory."
-        if agent_id == "agent8":
-            return "Summarize the prompt chunk into concise structured memory delta with only new information."
-        if agent_id == "agent9":
-            return "Write a cohesive chapter draft using structured memory as canon and transcript as detail."
-        return (
-            "You are a character roleplay agent. Follow your character identity exactly, including gender and voice. "
-            "Never contradict structured memory. Use recent context to stay scene-accurate. "
-            "Respond only as your character and do not narrate other characters' internal thoughts as facts."
-        )
-
-    def _user_prompt(self, agent_id: str, payload: dict) -> str:
-        if agent_id != "agent_character":
-            return json.dumps(payload, ensure_ascii=True)
-
-        identity = payload.get("agent_identity", {})
-        memory = payload.get("structured_memory", [])
-        recent = payload.get("recent_context", [])
-        user_prompt = payload.get("user_prompt", "")
-
-        recent_lines = []
-        for ev in recent:
-            if ev.get("role") == "user":
-                recent_lines.append(f"{ev.get('prompt_index')}) {ev.get('text')}")
-            elif ev.get("role") == "agent":
-                name = ev.get("agent_name") or f"Agent {ev.get('agent_slot')}"
-                recent_lines.append(f"{name}: {ev.get('text')}")
+    def _stream_completion(self, client, url: str, headers: dict, body: dict) -> str:
+        """Streamed call for cancellable requests: leaving the stream closes the connection, which stops generation upstream."""
+        import httpx
+
+        cancel = _cancel_event.get()
+        parts = []
+        body = {**body, "stream": True, "stream_options": {"include_usage": True}}
+        with client.stream("POST", url, headers=headers, json=body) as response:
+            response.raise_for_status()
+            finished = threading.Event()
+            threading.Thread(target=_shut_down_on_cancel, args=(response, cancel, finished), daemon=True).start()
+            try:
+                for line in response.iter_lines():
+                    if cancel.is_set():
+                        break
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    chunk = json.loads(line[len("data: ") :])
+                    if chunk.get("usage"):
+                        self._record_usage(chunk["usage"])
+                    for choice in chunk.get("choices") or []:
+                        parts.append((choice.get("delta") or {}).get("content") or "")
+            except httpx.HTTPError:
+                if not cancel.is_set():
+                    raise
+            finally:
+                finished.set()
+            if cancel.is_set():
+                metrics.increment("llm.cancelled_upstream")
+                raise GenerationCancelled()
+        return "".join(parts).strip()
+
+    def _record_usage(self, usage: dict) -> None:
+        metrics.increment("llm.prompt_tokens", usage.get("prompt_tokens", 0))
+        metrics.increment("llm.cached_prompt_tokens", (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0))
+
+
+def _shut_down_on_cancel(response, cancel: threading.Event, finished: threading.Event) -> None:
+    """Shut the stream's socket down once ``cancel`` is set, so a read blocked on a stalled upstream returns.
+
+    Closing the response from another thread is not enough: close() does not wake a
+    blocked recv(), which would then hold the request thread until the read timeout.
+    """
+    while not finished.is_set():
+        if cancel.wait(settings.disconnect_poll_seconds):
+            stream = response.extensions.get("network_stream")
+            sock = stream.get_extra_info("socket") if stream is not None else None
+            if sock is not None and not finished.is_set():
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            return
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: str | None = None
+        self.error: BaseException | None = None
+
+
+def _copy_error(error: BaseException) -> BaseException:
+    """A same-type copy of the leader's exception for one follower to raise.
+
+    Raising the leader's instance in several threads would have them all write
+    its __traceback__ and __context__ at once. __init__ is skipped, since
+    exceptions like httpx.HTTPStatusError take required keyword arguments.
+    """
+    copied = type(error).__new__(type(error), *error.args)
+    copied.args = error.args
+    copied.__dict__.update(error.__dict__)
+    return copied
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-flight call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[tuple, _Call] = {}
+
+    def do(self, key: tuple, fn) -> str:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            metrics.increment("llm.singleflight.shared")
+            # Wake up now and then so a follower whose own request is cancelled stops waiting.
+            while not call.done.wait(0.1):
+                raise_if_cancelled()
+            if isinstance(call.error, GenerationCancelled):
+                # The leader's client left, not ours: run the call ourselves.
+                return self.do(key, fn)
+            if call.error is not None:
+                raise _copy_error(call.error) from call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+_inflight = SingleFlight()
+
+
+class RoutedOpenAIProvider(OpenAIProvider):
+    """Spreads calls over several OpenAI-compatible endpoints, failing over on endpoint errors."""
+
+    def __init__(self, pool: EndpointPool):
+        self.pool = pool
+
+    def generate(self, agent_id: str, model: str, payload: dict) -> str:
+        import httpx
+
+        messages = self._messages(agent_id, payload)
+        last_error: Exception | None = None
+        for endpoint in self.pool.ranked():
+            started = self.pool.acquire(endpoint)
+            try:
+                text = self._chat_completion(endpoint.base_url, endpoint.api_key, endpoint.model_for(agent_id, model), messages)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.pool.release(endpoint, started, ok=True)
+                    raise
+                self.pool.release(endpoint, started, ok=False)
+                metrics.increment(f"llm.endpoint.{endpoint.name}.failover")
+                last_error = e
+            except httpx.HTTPError as e:
+                self.pool.release(endpoint, started, ok=False)
+                metrics.increment(f"llm.endpoint.{endpoint.name}.failover")
+                last_error = e
+            except GenerationCancelled:
+                self.pool.abandon(endpoint)
+                raise
             else:
-                recent_lines.append(f"system: {ev.get('text')}")
+                self.pool.release(endpoint, started, ok=True)
+                return text
+        raise last_error or RuntimeError("No LLM endpoints configured")
 
-        return (
-            "[Agent Identity]\n"
-            f"{json.dumps(identity, ensure_ascii=True)}\n\n"
-            "[Structured Memory]\n"
-            f"{json.dumps(memory, ensure_ascii=True)}\n\n"
-            "[Current Context: last seven user prompts and agent replies]\n"
-            f"{'\n'.join(recent_lines)}\n\n"
-            "[User Prompt]\n"
-            f"{user_prompt}"
-        )
+
+_endpoint_pool: EndpointPool | None = None
+_endpoint_pool_lock = threading.Lock()
+
+
+def get_endpoint_pool() -> EndpointPool:
+    global _endpoint_pool
+    with _endpoint_pool_lock:
+        if _endpoint_pool is None:
+            _endpoint_pool = EndpointPool(
+                build_endpoints(settings.openai_endpoints, settings.openai_api_key),
+                strategy=settings.llm_routing_strategy,
+                cooldown_seconds=settings.llm_endpoint_cooldown_seconds,
+            )
+            metrics.register_collector("llm_endpoints", _endpoint_pool.snapshot)
+        return _endpoint_pool
+
+
+_provider_override: ContextVar[LLMProvider | None] = ContextVar("provider_override", default=None)
+
+
+@contextmanager
+def use_provider(provider: LLMProvider):
+    """Make get_provider() return ``provider`` inside the block (used by the replay harness)."""
+    token = _provider_override.set(provider)
+    try:
+        yield provider
+    finally:
+        _provider_override.reset(token)
 
 
 def get_provider() -> LLMProvider:
+    override = _provider_override.get()
+    if override is not None:
+        return override
     if settings.llm_provider == "openai":
         if not settings.llm_external_enabled:
             raise RuntimeError("LLM provider is openai but LLM_EXTERNAL_ENABLED is false")
+        if settings.openai_endpoints:
+            return RoutedOpenAIProvider(get_endpoint_pool())
         if not settings.openai_api_key:
             raise RuntimeError("OPENAI_API_KEY is required when LLM_PROVIDER=openai")
         return OpenAIProvider(settings.openai_api_key, settings.openai_base_url)
     return MockLLMProvider()
 
 
+def payload_text(payload: dict) -> str:
+    return json.dumps(payload, sort_keys=True)
+
+
+def payload_hash(payload: dict) -> str:
+    return hashlib.sha256(payload_text(payload).encode("utf-8")).hexdigest()
+
+
+def generate(provider: LLMProvider, agent_id: str, model: str, payload: dict) -> str:
+    """Call the provider, coalescing concurrent requests with an identical (agent_id, model, input_hash).
+
+    Inside cancel_on(), raises GenerationCancelled if the request is cancelled
+    before or during the call; the caller rolls back instead of saving output.
+    """
+    raise_if_cancelled()
+    if not settings.llm_coalesce_inflight:
+        output = provider.generate(agent_id, model, payload)
+    else:
+        key = (agent_id, model, payload_hash(payload))
+        output = _inflight.do(key, lambda: provider.generate(agent_id, model, payload))
+    # Providers that cannot stop mid-call still finish; their output is dropped.
+    raise_if_cancelled()
+    return output
+
+
 def log_artifact(db: Session, session_id: str, agent_id: str, model: str, payload: dict, output: str, provider_name: str) -> None:
-    payload_text = json.dumps(payload, sort_keys=True)
+    text = payload_text(payload)
     artifact = LLMArtifact(
         session_id=session_id,
         agent_id=agent_id,
         provider=provider_name,
         model=model,
-        input_hash=hashlib.sha256(payload_text.encode("utf-8")).hexdigest(),
-        token_counts={"input_chars": len(payload_text), "output_chars": len(output)},
-        raw_input_ref=payload_text,
+        input_hash=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        token_counts={
+            "input_chars": len(text),
+            "output_chars": len(output),
+        },
+        raw_input_ref=text,
         raw_output_ref=output,
     )
     db.add(artifact)
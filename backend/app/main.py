@@ -1,13 +1,28 @@
-﻿from fastapi import Depends, FastAPI, HTTPException
+﻿import asyncio
+import threading
+from typing import Callable, TypeVar
+
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
-from .db import Base, engine, get_db
+from . import metrics, serializers
+from .admission import AdmissionMiddleware, controller_from_settings
+from .config import settings
+from .db import SessionLocal, engine, get_db
+from .eventstore import compact_session_by_id
+from .llm import GenerationCancelled, cancel_on
+from .migrate import migrate, verify_schema
+from .models import SessionState
+from .sharding import ShardRouterMiddleware, membership_from_settings
 from .schemas import (
     NarrativeAgentRequest,
     NarrativeBuildResponse,
     PromptRequest,
     PromptResponse,
+    SearchResponse,
     SessionCreateResponse,
     SessionDetailResponse,
     SessionSummary,
@@ -19,15 +34,26 @@ from .services import (
     create_session,
     end_chapter,
     get_session_detail,
+    get_tab1,
     lock_tab1,
+    precompute_next_payloads,
     prompt_agent,
     reset_session,
+    retain_session_state,
     save_narrative_agent,
     save_tab1,
+    search_session,
 )
 
-app = FastAPI(title="Story Engine MVP", version="1.0.0")
+# Handlers return ORJSONResponse bodies from serializers.py; response_model only documents them.
+app = FastAPI(title="Story Engine MVP", version="1.0.0", default_response_class=ORJSONResponse)
+
+admission_controller = controller_from_settings()
+if admission_controller is not None:
+    app.add_middleware(AdmissionMiddleware, controller=admission_controller, trusted_proxies=settings.trusted_proxies)
+    metrics.register_collector("admission", admission_controller.snapshot)
 
+# Added after admission control so it wraps it: 429/503 refusals carry CORS headers too.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -36,10 +62,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+shard_membership = membership_from_settings()
+if shard_membership is not None:
+    # Added last so it is the outermost layer: misrouted requests leave before any local work.
+    app.add_middleware(ShardRouterMiddleware, membership=shard_membership)
+    shard_membership.on_change(lambda ring: retain_session_state(lambda sid: ring.owner(sid) == shard_membership.self_url))
+    metrics.register_collector("shard", shard_membership.snapshot)
+
+
+# Non-standard status (from nginx) for a request whose client went away; only logs and metrics see it.
+CLIENT_CLOSED_REQUEST = 499
+
+T = TypeVar("T")
+
+
+@app.exception_handler(GenerationCancelled)
+def generation_cancelled_handler(request: Request, exc: GenerationCancelled):
+    return ORJSONResponse({"detail": "Client disconnected"}, status_code=CLIENT_CLOSED_REQUEST)
+
+
+async def run_cancellable(request: Request, db: Session, name: str, fn: Callable[[], T]) -> T:
+    """Run an LLM-bound service call in the threadpool, cancelling it if the client disconnects.
+
+    While it runs, the connection is checked every disconnect_poll_seconds. On
+    disconnect its model calls stop with GenerationCancelled (streamed OpenAI
+    calls close the upstream connection), the transaction is rolled back and
+    the cancellation is counted under cancelled.<name>.
+    """
+    if not settings.cancel_on_disconnect:
+        return await run_in_threadpool(fn)
+
+    cancel = threading.Event()
+
+    def call() -> T:
+        with cancel_on(cancel):
+            return fn()
+
+    task = asyncio.ensure_future(run_in_threadpool(call))
+    while not task.done():
+        await asyncio.wait({task}, timeout=settings.disconnect_poll_seconds)
+        if not task.done() and await request.is_disconnected():
+            cancel.set()
+            break
+    try:
+        # Wait for the worker even when cancelled: it still holds the request's DB session.
+        return await task
+    except GenerationCancelled:
+        await run_in_threadpool(db.rollback)
+        metrics.increment(f"cancelled.{name}")
+        raise
+
 
 @app.on_event("startup")
 def startup() -> None:
-    Base.metadata.create_all(bind=engine)
+    # Migrations normally run once per deploy (python -m app.migrate); workers only check the version.
+    if settings.db_auto_migrate:
+        migrate(engine)
+    else:
+        verify_schema(engine)
 
 
 @app.get("/health")
@@ -47,24 +127,38 @@ def health() -> dict:
     return {"ok": True}
 
 
+@app.get("/metrics")
+def metrics_endpoint() -> dict:
+    return metrics.snapshot()
+
+
+@app.get("/sessions/export")
+def export_sessions_endpoint(
+    session_id: list[str] | None = Query(default=None),
+    state: SessionState | None = None,
+    include_artifacts: bool = False,
+):
+    from .transfer import export_ndjson
+
+    def stream():
+        # The request-scoped session from get_db is closed before a streaming body is sent, so use our own.
+        with SessionLocal() as db:
+            yield from export_ndjson(db, session_id, state, include_artifacts)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 @app.post("/session", response_model=SessionCreateResponse)
 def create_session_endpoint(db: Session = Depends(get_db)):
     session = create_session(db)
-    return SessionCreateResponse(session_id=session.session_id, state=session.state)
+    return ORJSONResponse({"session_id": session.session_id, "state": session.state})
 
 
 @app.put("/session/{session_id}/tab1", response_model=Tab1InputResponse)
 def save_tab1_endpoint(session_id: str, payload: Tab1InputPayload, db: Session = Depends(get_db)):
     try:
         session, tab1 = save_tab1(db, session_id, payload.model_dump())
-        return Tab1InputResponse(
-            world_text=tab1.world_text,
-            chapter_text=tab1.chapter_text,
-            selected_agent_slots=session.selected_agent_slots,
-            agent_names={int(k): v for k, v in session.agent_names.items()},
-            agent_identity_text_by_slot={int(k): v for k, v in tab1.agent_identity_text_by_slot.items()},
-            tab1_locked=session.tab1_locked,
-        )
+        return ORJSONResponse(serializers.tab1_view(session, tab1))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
@@ -72,67 +166,46 @@ def save_tab1_endpoint(session_id: str, payload: Tab1InputPayload, db: Session =
 @app.get("/session/{session_id}/tab1", response_model=Tab1InputResponse)
 def get_tab1_endpoint(session_id: str, db: Session = Depends(get_db)):
     try:
-        data = get_session_detail(db, session_id)
-        session = data["session"]
-        tab1 = data["tab1"]
-        return Tab1InputResponse(
-            world_text=tab1.world_text,
-            chapter_text=tab1.chapter_text,
-            selected_agent_slots=session.selected_agent_slots,
-            agent_names={int(k): v for k, v in session.agent_names.items()},
-            agent_identity_text_by_slot={int(k): v for k, v in tab1.agent_identity_text_by_slot.items()},
-            tab1_locked=session.tab1_locked,
-        )
+        session, tab1 = get_tab1(db, session_id)
+        return ORJSONResponse(serializers.tab1_view(session, tab1))
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e)) from e
 
 
 @app.post("/session/{session_id}/lock", response_model=SessionSummary)
-def lock_session_endpoint(session_id: str, db: Session = Depends(get_db)):
+async def lock_session_endpoint(session_id: str, request: Request, db: Session = Depends(get_db)):
     try:
-        session = lock_tab1(db, session_id)
-        return SessionSummary(
-            session_id=session.session_id,
-            state=session.state,
-            prompt_index=session.prompt_index,
-            last_summarized_prompt_index=session.last_summarized_prompt_index,
-            tab1_locked=session.tab1_locked,
-        )
+        body = await run_cancellable(request, db, "lock", lambda: serializers.session_summary(lock_tab1(db, session_id)))
+        return ORJSONResponse(body)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
 
 @app.post("/session/{session_id}/prompt", response_model=PromptResponse)
-def prompt_endpoint(session_id: str, payload: PromptRequest, db: Session = Depends(get_db)):
+async def prompt_endpoint(
+    session_id: str, payload: PromptRequest, request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)
+):
+    def run() -> dict:
+        return serializers.prompt_view(*prompt_agent(db, session_id, payload.agent_slot, payload.user_text))
+
     try:
-        session, user_event, agent_event, summary_triggered = prompt_agent(db, session_id, payload.agent_slot, payload.user_text)
-        return PromptResponse(
-            session=SessionSummary(
-                session_id=session.session_id,
-                state=session.state,
-                prompt_index=session.prompt_index,
-                last_summarized_prompt_index=session.last_summarized_prompt_index,
-                tab1_locked=session.tab1_locked,
-            ),
-            user_event=user_event,
-            agent_event=agent_event,
-            summary_triggered=summary_triggered,
-        )
+        body = await run_cancellable(request, db, "prompt", run)
+        if settings.speculative_payloads:
+            background_tasks.add_task(precompute_next_payloads, session_id)
+        if body["summary_triggered"] and settings.pack_summarized_events:
+            background_tasks.add_task(compact_session_by_id, session_id)
+        return ORJSONResponse(body)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
 
 @app.post("/session/{session_id}/end", response_model=SessionSummary)
-def end_chapter_endpoint(session_id: str, db: Session = Depends(get_db)):
+async def end_chapter_endpoint(session_id: str, request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     try:
-        session = end_chapter(db, session_id)
-        return SessionSummary(
-            session_id=session.session_id,
-            state=session.state,
-            prompt_index=session.prompt_index,
-            last_summarized_prompt_index=session.last_summarized_prompt_index,
-            tab1_locked=session.tab1_locked,
-        )
+        body = await run_cancellable(request, db, "end", lambda: serializers.session_summary(end_chapter(db, session_id)))
+        if settings.pack_summarized_events:
+            background_tasks.add_task(compact_session_by_id, session_id)
+        return ORJSONResponse(body)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
@@ -141,22 +214,19 @@ def end_chapter_endpoint(session_id: str, db: Session = Depends(get_db)):
 def save_narrative_agent_endpoint(session_id: str, payload: NarrativeAgentRequest, db: Session = Depends(get_db)):
     try:
         session = save_narrative_agent(db, session_id, payload.narrative_agent_definition_text)
-        return SessionSummary(
-            session_id=session.session_id,
-            state=session.state,
-            prompt_index=session.prompt_index,
-            last_summarized_prompt_index=session.last_summarized_prompt_index,
-            tab1_locked=session.tab1_locked,
-        )
+        return ORJSONResponse(serializers.session_summary(session))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
 
 @app.post("/session/{session_id}/build-narrative", response_model=NarrativeBuildResponse)
-def build_narrative_endpoint(session_id: str, db: Session = Depends(get_db)):
-    try:
+async def build_narrative_endpoint(session_id: str, request: Request, db: Session = Depends(get_db)):
+    def run() -> dict:
         draft = build_narrative(db, session_id)
-        return NarrativeBuildResponse(draft_id=draft.draft_id, chapter_text=draft.chapter_text)
+        return {"draft_id": draft.draft_id, "chapter_text": draft.chapter_text}
+
+    try:
+        return ORJSONResponse(await run_cancellable(request, db, "build_narrative", run))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
@@ -165,13 +235,7 @@ def build_narrative_endpoint(session_id: str, db: Session = Depends(get_db)):
 def reset_endpoint(session_id: str, db: Session = Depends(get_db)):
     try:
         session = reset_session(db, session_id)
-        return SessionSummary(
-            session_id=session.session_id,
-            state=session.state,
-            prompt_index=session.prompt_index,
-            last_summarized_prompt_index=session.last_summarized_prompt_index,
-            tab1_locked=session.tab1_locked,
-        )
+        return ORJSONResponse(serializers.session_summary(session))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
@@ -179,30 +243,21 @@ def reset_endpoint(session_id: str, db: Session = Depends(get_db)):
 @app.get("/session/{session_id}", response_model=SessionDetailResponse)
 def get_session_endpoint(session_id: str, db: Session = Depends(get_db)):
     try:
-        data = get_session_detail(db, session_id)
-        session = data["session"]
-        tab1 = data["tab1"]
-        return SessionDetailResponse(
-            session=SessionSummary(
-                session_id=session.session_id,
-                state=session.state,
-                prompt_index=session.prompt_index,
-                last_summarized_prompt_index=session.last_summarized_prompt_index,
-                tab1_locked=session.tab1_locked,
-            ),
-            tab1=Tab1InputResponse(
-                world_text=tab1.world_text,
-                chapter_text=tab1.chapter_text,
-                selected_agent_slots=session.selected_agent_slots,
-                agent_names={int(k): v for k, v in session.agent_names.items()},
-                agent_identity_text_by_slot={int(k): v for k, v in tab1.agent_identity_text_by_slot.items()},
-                tab1_locked=session.tab1_locked,
-            ),
-            events=data["events"],
-            memory_blocks=data["memory_blocks"],
-            narrative_drafts=[
-                NarrativeBuildResponse(draft_id=d.draft_id, chapter_text=d.chapter_text) for d in data["narrative_drafts"]
-            ],
-        )
+        return ORJSONResponse(serializers.session_detail_view(get_session_detail(db, session_id)))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e)) from e
+
+
+@app.get("/session/{session_id}/search", response_model=SearchResponse)
+def search_session_endpoint(
+    session_id: str,
+    q: str = Query(min_length=1, max_length=500),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+    db: Session = Depends(get_db),
+):
+    try:
+        hits, has_more = search_session(db, session_id, q, limit, offset)
+        return ORJSONResponse(serializers.search_view(q, hits, limit, offset, has_more))
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e)) from e
@@ -0,0 +1,29 @@
+import threading
+from collections import defaultdict
+from typing import Callable
+
+_lock = threading.Lock()
+_counters: dict[str, int] = defaultdict(int)
+_collectors: dict[str, Callable[[], object]] = {}
+
+
+def increment(name: str, value: int = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def register_collector(name: str, collector: Callable[[], object]) -> None:
+    with _lock:
+        _collectors[name] = collector
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        collectors = dict(_collectors)
+    return {"counters": counters, **{name: collector() for name, collector in collectors.items()}}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,135 @@
+import argparse
+from pathlib import Path
+
+from sqlalchemy import Connection, Engine, inspect, text
+from sqlalchemy.exc import DBAPIError
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+
+# Arbitrary constant shared by every node so only one of them applies migrations at a time.
+ADVISORY_LOCK_KEY = 7_307_001
+
+_CREATE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+  version VARCHAR(32) PRIMARY KEY,
+  applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+)
+"""
+
+
+def available_migrations() -> list[tuple[str, Path]]:
+    """(version, path) for every migrations/NNN_name.sql, in version order."""
+    return sorted((path.name.split("_", 1)[0], path) for path in MIGRATIONS_DIR.glob("*.sql"))
+
+
+def latest_version() -> str | None:
+    migrations = available_migrations()
+    return migrations[-1][0] if migrations else None
+
+
+def current_version(engine: Engine) -> str | None:
+    with engine.connect() as conn:
+        try:
+            return conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar()
+        except DBAPIError:
+            # No schema_migrations table yet.
+            return None
+
+
+def _add_missing_columns(conn: Connection, metadata) -> None:
+    """ALTER TABLE ADD COLUMN (and create indexes) for ORM columns an existing table lacks.
+
+    create_all skips tables that already exist, so without this an older SQLite
+    database would be stamped past e.g. 002 (archived_at) without the column.
+    """
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+            if not column.nullable:
+                if column.default is None or not column.default.is_scalar:
+                    raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} without a scalar default")
+                ddl += f" NOT NULL DEFAULT {column.type.literal_processor(conn.dialect)(column.default.arg)}"
+            conn.exec_driver_sql(ddl)
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def migrate(engine: Engine) -> list[str]:
+    """Apply pending migrations and return the versions applied.
+
+    On Postgres each SQL file runs in its own transaction while holding a
+    session-level advisory lock, so concurrent deploys apply each version once.
+    The SQL files are written for Postgres; other databases (SQLite for local
+    and test runs) get the ORM schema from create_all plus any columns older
+    tables lack, and are stamped at the latest version.
+    """
+    if engine.dialect.name != "postgresql":
+        from . import models
+
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            _add_missing_columns(conn, models.Base.metadata)
+            applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+            pending = [version for version, _ in available_migrations() if version not in applied]
+            for version in pending:
+                conn.execute(text("INSERT INTO schema_migrations (version, applied_at) VALUES (:v, CURRENT_TIMESTAMP)"), {"v": version})
+        return pending
+
+    applied_now = []
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        conn.commit()
+        try:
+            conn.execute(text(_CREATE_VERSION_TABLE))
+            conn.commit()
+            applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+            conn.commit()
+            for version, path in available_migrations():
+                if version in applied:
+                    continue
+                sql = path.read_text(encoding="utf-8-sig")
+                with conn.begin():
+                    # Raw driver cursor without parameters, so a file may hold several statements.
+                    cursor = conn.connection.cursor()
+                    try:
+                        cursor.execute(sql)
+                    finally:
+                        cursor.close()
+                    conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version})
+                applied_now.append(version)
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            conn.commit()
+    return applied_now
+
+
+def verify_schema(engine: Engine) -> None:
+    """Fail fast if the database is not at the latest migration. One query; no reflection."""
+    current = current_version(engine)
+    latest = latest_version()
+    if current != latest:
+        raise RuntimeError(f"Database schema is at {current or 'no version'}, expected {latest}; run `python -m app.migrate`")
+
+
+def main() -> None:
+    from .db import engine
+
+    parser = argparse.ArgumentParser(description="Apply pending SQL migrations.")
+    parser.add_argument("--check", action="store_true", help="only verify the schema version")
+    args = parser.parse_args()
+
+    if args.check:
+        verify_schema(engine)
+        print(f"schema at {latest_version()}")
+        return
+    applied = migrate(engine)
+    print(f"applied {', '.join(applied)}" if applied else f"schema already at {latest_version()}")
+
+
+if __name__ == "__main__":
+    main()
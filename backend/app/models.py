@@ -2,7 +2,7 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import Boolean, DateTime, Enum, ForeignKey, Integer, String, Text
+from sqlalchemy import DDL, BigInteger, Boolean, DateTime, Enum, ForeignKey, Index, Integer, LargeBinary, String, Text, event, insert, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.types import JSON
 from sqlalchemy.orm import Mapped, mapped_column
@@ -35,17 +35,41 @@ class MemoryBlockType(str, enum.Enum):
     TURN_DELTA = "turn_delta"
 
 
+class SummaryJobStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    # Taken by the worker while it uploads the batch; no row lock is held during the upload.
+    SUBMITTING = "SUBMITTING"
+    SUBMITTED = "SUBMITTED"
+    # Taken by the worker for a direct model call after its batch left it unanswered.
+    CLAIMED = "CLAIMED"
+
+
 class Session(Base):
     __tablename__ = "sessions"
+    # Partial, because Postgres cannot walk (state, archived_at, updated_at) in updated_at order under "archived_at IS NULL".
+    __table_args__ = (
+        Index(
+            "idx_sessions_unarchived_state_updated",
+            "state",
+            "updated_at",
+            postgresql_where=text("archived_at IS NULL"),
+            sqlite_where=text("archived_at IS NULL"),
+        ),
+    )
 
     session_id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    state: Mapped[SessionState] = mapped_column(Enum(SessionState), default=SessionState.DRAFT_TAB1, nullable=False)
+    state: Mapped[SessionState] = mapped_column(
+        Enum(SessionState, native_enum=False, length=32), default=SessionState.DRAFT_TAB1, nullable=False
+    )
     prompt_index: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     selected_agent_slots: Mapped[list] = mapped_column(json_type(), default=list, nullable=False)
     agent_names: Mapped[dict] = mapped_column(json_type(), default=dict, nullable=False)
     tab1_locked: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     last_summarized_prompt_index: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Characters of user and agent text since the last summary; drives the adaptive summary trigger.
+    unsummarized_chars: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
     narrative_agent_definition_text: Mapped[str] = mapped_column(Text, default="", nullable=False)
+    archived_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
@@ -62,22 +86,40 @@ class Tab1Inputs(Base):
 
 class Event(Base):
     __tablename__ = "events"
+    __table_args__ = (Index("idx_events_session_prompt_created", "session_id", "prompt_index", "created_at"),)
 
     event_id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False, index=True)
-    prompt_index: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
-    role: Mapped[EventRole] = mapped_column(Enum(EventRole), nullable=False)
+    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False)
+    prompt_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    role: Mapped[EventRole] = mapped_column(Enum(EventRole, native_enum=False, length=16), nullable=False)
     agent_slot: Mapped[int | None] = mapped_column(Integer, nullable=True)
     text: Mapped[str] = mapped_column(Text, nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class EventChunk(Base):
+    """Events of a summarized prompt range packed into one gzip'd JSON row (see eventstore.py)."""
+
+    __tablename__ = "event_chunks"
+    # Unique so that two compactions racing on one session cannot both pack a range.
+    __table_args__ = (Index("idx_event_chunks_session_range", "session_id", "from_prompt_index", "to_prompt_index", unique=True),)
+
+    chunk_id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False)
+    from_prompt_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    to_prompt_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    event_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    payload: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
 
 
 class MemoryBlock(Base):
     __tablename__ = "memory_blocks"
+    __table_args__ = (Index("idx_memory_blocks_session_created", "session_id", "created_at"),)
 
     block_id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False, index=True)
-    type: Mapped[MemoryBlockType] = mapped_column(Enum(MemoryBlockType), nullable=False)
+    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False)
+    type: Mapped[MemoryBlockType] = mapped_column(Enum(MemoryBlockType, native_enum=False, length=32), nullable=False)
     from_prompt_index: Mapped[int] = mapped_column(Integer, nullable=False)
     to_prompt_index: Mapped[int] = mapped_column(Integer, nullable=False)
     json_payload: Mapped[dict] = mapped_column(json_type(), nullable=False)
@@ -86,9 +128,10 @@ class MemoryBlock(Base):
 
 class NarrativeDraft(Base):
     __tablename__ = "narrative_drafts"
+    __table_args__ = (Index("idx_narrative_drafts_session_created", "session_id", "created_at"),)
 
     draft_id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False, index=True)
+    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False)
     narrative_agent_definition_text: Mapped[str] = mapped_column(Text, nullable=False)
     source_snapshot: Mapped[dict] = mapped_column(json_type(), nullable=False)
     chapter_text: Mapped[str] = mapped_column(Text, nullable=False)
@@ -97,9 +140,10 @@ class NarrativeDraft(Base):
 
 class LLMArtifact(Base):
     __tablename__ = "llm_artifacts"
+    __table_args__ = (Index("idx_llm_artifacts_session_created", "session_id", "created_at"),)
 
     artifact_id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False, index=True)
+    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False)
     agent_id: Mapped[str] = mapped_column(String(32), nullable=False)
     provider: Mapped[str] = mapped_column(String(64), nullable=False)
     model: Mapped[str] = mapped_column(String(128), nullable=False)
@@ -108,3 +152,96 @@ class LLMArtifact(Base):
     raw_input_ref: Mapped[str] = mapped_column(Text, nullable=False)
     raw_output_ref: Mapped[str] = mapped_column(Text, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class SummaryJob(Base):
+    """A summary call waiting for the batch worker (see batching.py); deleted once its memory block is written."""
+
+    __tablename__ = "summary_jobs"
+    __table_args__ = (
+        Index("idx_summary_jobs_status_created", "status", "created_at"),
+        Index("idx_summary_jobs_session_created", "session_id", "created_at"),
+        Index("idx_summary_jobs_batch", "batch_id"),
+    )
+
+    job_id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False)
+    agent_id: Mapped[str] = mapped_column(String(32), nullable=False)
+    model: Mapped[str] = mapped_column(String(128), nullable=False)
+    payload: Mapped[dict] = mapped_column(json_type(), nullable=False)
+    status: Mapped[SummaryJobStatus] = mapped_column(
+        Enum(SummaryJobStatus, native_enum=False, length=16), default=SummaryJobStatus.PENDING, nullable=False
+    )
+    batch_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class SearchDocument(Base):
+    """Searchable text of one event, memory summary or narrative draft (see queries.session_search).
+
+    Written by the after_insert listeners below, so it outlives event packing.
+    Postgres matches against a generated tsvector column with a GIN index
+    (migrations/008); SQLite against the search_documents_fts FTS5 table,
+    kept in sync by triggers.
+    """
+
+    __tablename__ = "search_documents"
+    __table_args__ = (Index("idx_search_documents_session_prompt", "session_id", "prompt_index"),)
+
+    # Integer key so it can be the FTS5 rowid; sessions move between databases without it (search.index_session).
+    doc_id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    session_id: Mapped[str] = mapped_column(String(36), ForeignKey("sessions.session_id", ondelete="CASCADE"), nullable=False)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)
+    source_id: Mapped[str] = mapped_column(String(36), nullable=False)
+    prompt_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+def search_document_values(obj) -> dict | None:
+    """search_documents row for an Event, MemoryBlock or NarrativeDraft; None if it has no text to index."""
+    if isinstance(obj, Event):
+        values = {"kind": "event", "source_id": obj.event_id, "prompt_index": obj.prompt_index, "text": obj.text}
+    elif isinstance(obj, MemoryBlock):
+        text = obj.json_payload.get("summary") or ""
+        values = {"kind": "memory", "source_id": obj.block_id, "prompt_index": obj.to_prompt_index, "text": text}
+    elif isinstance(obj, NarrativeDraft):
+        prompt_index = obj.source_snapshot.get("max_prompt_index_used", 0)
+        values = {"kind": "draft", "source_id": obj.draft_id, "prompt_index": prompt_index, "text": obj.chapter_text}
+    else:
+        return None
+    if not values["text"]:
+        return None
+    return {**values, "session_id": obj.session_id, "created_at": obj.created_at}
+
+
+def _index_inserted(mapper, connection, target) -> None:
+    values = search_document_values(target)
+    if values is not None:
+        connection.execute(insert(SearchDocument.__table__).values(**values))
+
+
+for _model in (Event, MemoryBlock, NarrativeDraft):
+    event.listen(_model, "after_insert", _index_inserted)
+
+# Local SQLite mode: an external-content FTS5 index over search_documents.text, maintained by triggers.
+for _ddl in (
+    "CREATE VIRTUAL TABLE search_documents_fts USING fts5("
+    "text, content='search_documents', content_rowid='doc_id', tokenize='porter unicode61')",
+    "CREATE TRIGGER search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(rowid, text) VALUES (new.doc_id, new.text); END",
+    "CREATE TRIGGER search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, text) VALUES ('delete', old.doc_id, old.text); END",
+):
+    event.listen(SearchDocument.__table__, "after_create", DDL(_ddl).execute_if(dialect="sqlite"))
+event.listen(
+    SearchDocument.__table__, "before_drop", DDL("DROP TABLE IF EXISTS search_documents_fts").execute_if(dialect="sqlite")
+)
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    version: Mapped[str] = mapped_column(String(32), primary_key=True)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,131 @@
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+SYSTEM_PROMPTS = {
+    "agent0": "Summarize Tab1 world/chapter setup into compact structured narrative memory.",
+    "agent8": "Summarize the prompt chunk into concise structured memory delta with only new information.",
+    "agent9": "Write a cohesive chapter draft using structured memory as canon and transcript as detail.",
+}
+
+CHARACTER_SYSTEM_PROMPT = (
+    "You are a character roleplay agent. Follow your character identity exactly, including gender and voice. "
+    "Never contradict structured memory. Use recent context to stay scene-accurate. "
+    "Respond only as your character and do not narrate other characters' internal thoughts as facts."
+)
+
+
+def system_prompt(agent_id: str) -> str:
+    return SYSTEM_PROMPTS.get(agent_id, CHARACTER_SYSTEM_PROMPT)
+
+
+def _dumps(value) -> str:
+    # Byte-stable: same input always renders to the same bytes, whatever dict insertion order it arrived in.
+    return json.dumps(value, ensure_ascii=True, sort_keys=True, separators=(",", ":"))
+
+
+@dataclass
+class RenderedPrompt:
+    system: str
+    user: str
+    # Leading characters (system + user message) identical across turns until memory changes.
+    cacheable_prefix_chars: int
+
+
+class PromptRenderer:
+    """Renders agent prompts with static content first so upstream prompt caches can reuse the prefix.
+
+    For character agents the identity and structured memory are rendered once per
+    (session, slot, memory_version) and kept in a small LRU; only the recent
+    context and user prompt are rendered per turn. Memory blocks are rendered one
+    per line with the world/chapter lock first, so appending a block extends the
+    previous prefix rather than replacing it.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._static: OrderedDict[tuple, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, agent_id: str, payload: dict) -> RenderedPrompt:
+        system = system_prompt(agent_id)
+        if agent_id != "agent_character":
+            return RenderedPrompt(system=system, user=_dumps(payload), cacheable_prefix_chars=len(system))
+
+        static = self._static_section(payload)
+        user = static + self._dynamic_section(payload)
+        return RenderedPrompt(system=system, user=user, cacheable_prefix_chars=len(system) + len(static))
+
+    def _static_section(self, payload: dict) -> str:
+        meta = payload.get("meta", {})
+        identity = payload.get("agent_identity", {})
+        memory_version = meta.get("memory_version")
+        if not memory_version:
+            return self._render_static(payload)
+
+        key = (meta.get("session_id"), identity.get("slot"), memory_version)
+        with self._lock:
+            cached = self._static.get(key)
+            if cached is not None:
+                self._static.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        rendered = self._render_static(payload)
+        with self._lock:
+            self._static[key] = rendered
+            self._static.move_to_end(key)
+            while len(self._static) > self.max_entries:
+                self._static.popitem(last=False)
+        return rendered
+
+    def _render_static(self, payload: dict) -> str:
+        memory = sorted(
+            payload.get("structured_memory", []),
+            key=lambda mb: (mb.get("type") != "world_chapter_lock", mb.get("from_prompt_index", 0)),
+        )
+        memory_lines = "\n".join(_dumps(mb) for mb in memory)
+        return (
+            "[Agent Identity]\n"
+            f"{_dumps(payload.get('agent_identity', {}))}\n\n"
+            "[Structured Memory]\n"
+            f"{memory_lines}\n\n"
+        )
+
+    def _dynamic_section(self, payload: dict) -> str:
+        recalled_lines = []
+        for snippet in payload.get("recalled_context", []):
+            if snippet.get("role") == "agent":
+                name = snippet.get("agent_name") or f"Agent {snippet.get('agent_slot')}"
+                recalled_lines.append(f"{snippet.get('prompt_index')}) {name}: {snippet.get('text')}")
+            else:
+                recalled_lines.append(f"{snippet.get('prompt_index')}) {snippet.get('text')}")
+        recalled = ""
+        if recalled_lines:
+            recalled = "[Recalled Context: earlier moments relevant to this prompt]\n" + "\n".join(recalled_lines) + "\n\n"
+
+        recent_lines = []
+        for ev in payload.get("recent_context", []):
+            if ev.get("role") == "user":
+                recent_lines.append(f"{ev.get('prompt_index')}) {ev.get('text')}")
+            elif ev.get("role") == "agent":
+                name = ev.get("agent_name") or f"Agent {ev.get('agent_slot')}"
+                recent_lines.append(f"{name}: {ev.get('text')}")
+            else:
+                recent_lines.append(f"system: {ev.get('text')}")
+
+        return (
+            f"{recalled}"
+            "[Current Context: most recent user prompts and agent replies]\n"
+            f"{'\n'.join(recent_lines)}\n\n"
+            "[User Prompt]\n"
+            f"{payload.get('user_prompt', '')}"
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._static), "hits": self.hits, "misses": self.misses}
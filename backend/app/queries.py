@@ -0,0 +1,283 @@
+import argparse
+import json
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import Connection, Select, column, func, literal_column, select, table
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from .models import (
+    Event,
+    EventChunk,
+    LLMArtifact,
+    MemoryBlock,
+    NarrativeDraft,
+    SearchDocument,
+    Session as SessionModel,
+    SessionState,
+    SummaryJob,
+    SummaryJobStatus,
+)
+
+# Hot queries: everything the request path and the maintenance jobs run per
+# session or per turn. Each has a matching index in models.py and the
+# migrations; tests/test_query_plans.py EXPLAINs every entry in HOT_QUERIES.
+
+
+def session_events(session_id: str) -> Select:
+    """Full transcript in prompt order (session detail, narrative build). idx_events_session_prompt_created."""
+    return (
+        select(Event)
+        .where(Event.session_id == session_id)
+        .order_by(Event.prompt_index.asc(), Event.created_at.asc())
+    )
+
+
+def events_in_prompt_range(session_id: str, from_prompt: int, to_prompt: int) -> Select:
+    """Recent-context window, summarization chunk, retrieval catch-up. idx_events_session_prompt_created."""
+    return (
+        select(Event)
+        .where(
+            Event.session_id == session_id,
+            Event.prompt_index >= from_prompt,
+            Event.prompt_index <= to_prompt,
+        )
+        .order_by(Event.prompt_index.asc(), Event.created_at.asc())
+    )
+
+
+def session_event_chunks(session_id: str, from_prompt: int | None = None, to_prompt: int | None = None) -> Select:
+    """Packed event chunks overlapping a prompt range, in prompt order. idx_event_chunks_session_range."""
+    query = select(EventChunk).where(EventChunk.session_id == session_id)
+    if to_prompt is not None:
+        query = query.where(EventChunk.from_prompt_index <= to_prompt)
+    if from_prompt is not None:
+        query = query.where(EventChunk.to_prompt_index >= from_prompt)
+    return query.order_by(EventChunk.from_prompt_index.asc())
+
+
+# Columns the API returns; projecting them skips building ORM objects for read-only views.
+EVENT_VIEW_COLUMNS = (Event.event_id, Event.prompt_index, Event.role, Event.agent_slot, Event.text, Event.created_at)
+MEMORY_BLOCK_VIEW_COLUMNS = (
+    MemoryBlock.block_id,
+    MemoryBlock.type,
+    MemoryBlock.from_prompt_index,
+    MemoryBlock.to_prompt_index,
+    MemoryBlock.json_payload,
+    MemoryBlock.created_at,
+)
+DRAFT_VIEW_COLUMNS = (NarrativeDraft.draft_id, NarrativeDraft.chapter_text)
+
+
+def session_event_views(session_id: str) -> Select:
+    """session_events projected to EVENT_VIEW_COLUMNS. idx_events_session_prompt_created."""
+    return session_events(session_id).with_only_columns(*EVENT_VIEW_COLUMNS)
+
+
+def session_memory_block_views(session_id: str) -> Select:
+    """session_memory_blocks projected to MEMORY_BLOCK_VIEW_COLUMNS. idx_memory_blocks_session_created."""
+    return session_memory_blocks(session_id).with_only_columns(*MEMORY_BLOCK_VIEW_COLUMNS)
+
+
+def session_draft_views(session_id: str) -> Select:
+    """session_drafts projected to DRAFT_VIEW_COLUMNS. idx_narrative_drafts_session_created."""
+    return session_drafts(session_id).with_only_columns(*DRAFT_VIEW_COLUMNS)
+
+
+def session_memory_blocks(session_id: str) -> Select:
+    """Structured memory in creation order. idx_memory_blocks_session_created."""
+    return select(MemoryBlock).where(MemoryBlock.session_id == session_id).order_by(MemoryBlock.created_at.asc())
+
+
+def memory_stamp(session_id: str) -> Select:
+    """(count, newest created_at) of a session's memory blocks. idx_memory_blocks_session_created."""
+    return select(func.count(MemoryBlock.block_id), func.max(MemoryBlock.created_at)).where(
+        MemoryBlock.session_id == session_id
+    )
+
+
+def session_drafts(session_id: str) -> Select:
+    """Narrative drafts in creation order. idx_narrative_drafts_session_created."""
+    return select(NarrativeDraft).where(NarrativeDraft.session_id == session_id).order_by(NarrativeDraft.created_at.asc())
+
+
+def session_artifacts(session_id: str) -> Select:
+    """LLM artifacts in call order (replay, export). idx_llm_artifacts_session_created."""
+    return select(LLMArtifact).where(LLMArtifact.session_id == session_id).order_by(LLMArtifact.created_at.asc())
+
+
+def archivable_sessions(cutoff: datetime) -> Select:
+    """Oldest ENDED, not yet archived sessions. idx_sessions_unarchived_state_updated."""
+    return (
+        select(SessionModel)
+        .where(
+            SessionModel.state == SessionState.ENDED,
+            SessionModel.archived_at.is_(None),
+            SessionModel.updated_at < cutoff,
+        )
+        .order_by(SessionModel.updated_at.asc())
+    )
+
+
+def pending_summary_jobs(limit: int) -> Select:
+    """Oldest jobs not yet submitted to a batch. idx_summary_jobs_status_created."""
+    return (
+        select(SummaryJob)
+        .where(SummaryJob.status == SummaryJobStatus.PENDING)
+        .order_by(SummaryJob.created_at.asc())
+        .limit(limit)
+    )
+
+
+def stale_claimed_summary_jobs(cutoff: datetime, status: SummaryJobStatus = SummaryJobStatus.CLAIMED) -> Select:
+    """Jobs a worker claimed (CLAIMED for a direct call, SUBMITTING for an upload) before ``cutoff``: it died mid-call.
+
+    idx_summary_jobs_status_created.
+    """
+    return (
+        select(SummaryJob)
+        .where(SummaryJob.status == status, SummaryJob.updated_at < cutoff)
+        .order_by(SummaryJob.created_at.asc())
+    )
+
+
+def batch_summary_jobs(batch_id: str) -> Select:
+    """Jobs of one submitted batch. idx_summary_jobs_batch."""
+    return select(SummaryJob).where(SummaryJob.batch_id == batch_id)
+
+
+def session_summary_jobs(session_id: str) -> Select:
+    """A session's outstanding jobs in creation order. idx_summary_jobs_session_created."""
+    return select(SummaryJob).where(SummaryJob.session_id == session_id).order_by(SummaryJob.created_at.asc())
+
+
+# Ranked search has to order its matches by relevance, so it is not in HOT_QUERIES;
+# tests/test_search.py checks that it reads through the full-text index instead.
+SEARCH_RESULT_COLUMNS = (
+    SearchDocument.kind,
+    SearchDocument.source_id,
+    SearchDocument.prompt_index,
+    SearchDocument.text,
+    SearchDocument.created_at,
+)
+_TSV = literal_column("search_documents.tsv")  # Postgres only: generated column from migrations/008.
+_FTS = table("search_documents_fts", column("rowid"))  # SQLite only: FTS5 table from models.py.
+
+
+def fts5_query(terms: str) -> str:
+    """User text as an FTS5 query that ANDs its words, each quoted so operators and punctuation are literal."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in terms.split())
+
+
+def session_search(session_id: str, terms: str, dialect: str) -> Select:
+    """Documents of one session matching ``terms``, best first, with a "rank" column (higher is better).
+
+    Postgres: plainto_tsquery (words ANDed, no operators) against idx_search_documents_session_tsv.
+    SQLite: FTS5 MATCH with bm25, joined back on doc_id.
+    """
+    if dialect == "postgresql":
+        tsquery = func.plainto_tsquery("english", terms)
+        rank = func.ts_rank_cd(_TSV, tsquery)
+        return (
+            select(*SEARCH_RESULT_COLUMNS, rank.label("rank"))
+            .where(SearchDocument.session_id == session_id, _TSV.op("@@")(tsquery))
+            .order_by(rank.desc(), SearchDocument.doc_id.asc())
+        )
+    # bm25() is lower-is-better; negate it so both dialects rank the same way round.
+    rank = -func.bm25(literal_column(_FTS.name))
+    return (
+        select(*SEARCH_RESULT_COLUMNS, rank.label("rank"))
+        .select_from(SearchDocument)
+        .join(_FTS, _FTS.c.rowid == SearchDocument.doc_id)
+        .where(SearchDocument.session_id == session_id, literal_column(_FTS.name).op("MATCH")(fts5_query(terms)))
+        .order_by(rank.desc(), SearchDocument.doc_id.asc())
+    )
+
+
+_SAMPLE_SESSION_ID = "00000000-0000-0000-0000-000000000000"
+
+HOT_QUERIES: dict[str, Callable[[], Select]] = {
+    "session_events": lambda: session_events(_SAMPLE_SESSION_ID),
+    "events_in_prompt_range": lambda: events_in_prompt_range(_SAMPLE_SESSION_ID, 1, 7),
+    "session_event_chunks": lambda: session_event_chunks(_SAMPLE_SESSION_ID, 1, 7),
+    "session_memory_blocks": lambda: session_memory_blocks(_SAMPLE_SESSION_ID),
+    "session_event_views": lambda: session_event_views(_SAMPLE_SESSION_ID),
+    "session_memory_block_views": lambda: session_memory_block_views(_SAMPLE_SESSION_ID),
+    "session_draft_views": lambda: session_draft_views(_SAMPLE_SESSION_ID),
+    "memory_stamp": lambda: memory_stamp(_SAMPLE_SESSION_ID),
+    "session_drafts": lambda: session_drafts(_SAMPLE_SESSION_ID),
+    "session_artifacts": lambda: session_artifacts(_SAMPLE_SESSION_ID),
+    "archivable_sessions": lambda: archivable_sessions(datetime(2000, 1, 1)),
+    "pending_summary_jobs": lambda: pending_summary_jobs(100),
+    "stale_claimed_summary_jobs": lambda: stale_claimed_summary_jobs(datetime(2000, 1, 1)),
+    "batch_summary_jobs": lambda: batch_summary_jobs("batch_sample"),
+    "session_summary_jobs": lambda: session_summary_jobs(_SAMPLE_SESSION_ID),
+}
+
+
+class _Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement: Select):
+        self.statement = statement
+
+
+@compiles(_Explain)
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN QUERY PLAN " + compiler.process(element.statement, **kw)
+
+
+@compiles(_Explain, "postgresql")
+def _compile_explain_postgresql(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def _postgres_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _postgres_nodes(child)
+
+
+def plan_problems(conn: Connection, statement: Select) -> list[str]:
+    """Plan steps that read a whole table or sort rows instead of walking an index.
+
+    On Postgres seq scans and sorts are disabled for the EXPLAIN, so on small
+    tables the planner still picks an index whenever one can serve the query; a
+    Seq Scan or Sort in the plan means no index can. SQLite's planner always
+    prefers a usable index, so SCAN or a temp b-tree means the same there.
+    """
+    if conn.dialect.name == "postgresql":
+        with conn.begin_nested() if conn.in_transaction() else conn.begin():
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            conn.exec_driver_sql("SET LOCAL enable_sort = off")
+            plan = conn.execute(_Explain(statement)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return [
+            f"{node['Node Type']} on {node.get('Relation Name', '?')}"
+            for node in _postgres_nodes(plan[0]["Plan"])
+            if node["Node Type"] in ("Seq Scan", "Sort", "Incremental Sort")
+        ]
+
+    details = [row[-1] for row in conn.execute(_Explain(statement))]
+    return [d for d in details if d.startswith("SCAN ") or "TEMP B-TREE" in d]
+
+
+def main() -> None:
+    from .db import engine
+
+    parser = argparse.ArgumentParser(description="EXPLAIN every hot query against the configured database.")
+    parser.parse_args()
+
+    failed = False
+    with engine.connect() as conn:
+        for name, build in HOT_QUERIES.items():
+            problems = plan_problems(conn, build())
+            failed = failed or bool(problems)
+            print(f"{name}: {'; '.join(problems) if problems else 'ok'}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
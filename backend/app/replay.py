@@ -0,0 +1,250 @@
+import argparse
+import json
+import sys
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from .archive import ARCHIVED_TABLES, read_archive
+from .db import Base
+from .eventstore import unpack_chunk_row
+from .llm import LLMProvider, MockLLMProvider, payload_text, payload_hash, use_provider
+from .models import Session as SessionModel, SessionState, Tab1Inputs
+from .rows import mapping_to_dict
+
+# Keys whose values are random per run (generated ids) and so never match a recording byte-for-byte.
+VOLATILE_KEYS = frozenset({"memory_version", "block_id", "memory_block_ids_used"})
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def normalized_hash(payload: dict) -> str:
+    return payload_hash(_normalize(payload))
+
+
+@dataclass
+class ReplayCall:
+    agent_id: str
+    match: str
+    artifact_id: str | None
+    recorded_input_chars: int | None
+    replayed_input_chars: int
+
+
+class ReplayProvider(LLMProvider):
+    """Answers generate() from recorded llm_artifacts instead of calling a model.
+
+    A call is matched to an unused artifact by exact input_hash, then by the
+    hash with VOLATILE_KEYS stripped, then by position among the same agent's
+    calls. The last case is a divergence: the replayed payload differs from the
+    recording. Calls with nothing left to match fall back to the mock provider.
+    """
+
+    provider_name = "replay"
+
+    def __init__(self, artifacts: list[dict]):
+        self.artifacts = artifacts
+        self.used = [False] * len(artifacts)
+        self.by_hash: dict[str, list[int]] = defaultdict(list)
+        self.by_normalized: dict[str, list[int]] = defaultdict(list)
+        self.by_agent: dict[str, list[int]] = defaultdict(list)
+        for i, artifact in enumerate(artifacts):
+            self.by_hash[artifact["input_hash"]].append(i)
+            self.by_normalized[normalized_hash(json.loads(artifact["raw_input_ref"]))].append(i)
+            self.by_agent[artifact["agent_id"]].append(i)
+        self.calls: list[ReplayCall] = []
+
+    def _take(self, candidates: list[int]) -> int | None:
+        for i in candidates:
+            if not self.used[i]:
+                self.used[i] = True
+                return i
+        return None
+
+    def generate(self, agent_id: str, model: str, payload: dict) -> str:
+        match = "exact"
+        i = self._take(self.by_hash.get(payload_hash(payload), []))
+        if i is None:
+            match = "normalized"
+            i = self._take(self.by_normalized.get(normalized_hash(payload), []))
+        if i is None:
+            match = "diverged"
+            i = self._take(self.by_agent.get(agent_id, []))
+
+        replayed_chars = len(payload_text(payload))
+        if i is None:
+            self.calls.append(ReplayCall(agent_id, "missing", None, None, replayed_chars))
+            return MockLLMProvider().generate(agent_id, model, payload)
+
+        artifact = self.artifacts[i]
+        self.calls.append(
+            ReplayCall(agent_id, match, artifact["artifact_id"], len(artifact["raw_input_ref"]), replayed_chars)
+        )
+        return artifact["raw_output_ref"]
+
+
+@dataclass
+class ReplayReport:
+    session_id: str
+    calls: list[ReplayCall] = field(default_factory=list)
+    unused_artifacts: int = 0
+    prompt_seconds: list[float] = field(default_factory=list)
+
+    @property
+    def divergences(self) -> list[ReplayCall]:
+        return [c for c in self.calls if c.match in ("diverged", "missing")]
+
+    def summary(self) -> dict:
+        payload_chars: dict[str, dict[str, int]] = defaultdict(lambda: {"recorded": 0, "replayed": 0})
+        for call in self.calls:
+            payload_chars[call.agent_id]["recorded"] += call.recorded_input_chars or 0
+            payload_chars[call.agent_id]["replayed"] += call.replayed_input_chars
+        timings = sorted(self.prompt_seconds)
+        return {
+            "session_id": self.session_id,
+            "calls": len(self.calls),
+            "matches": dict(Counter(c.match for c in self.calls)),
+            "unused_artifacts": self.unused_artifacts,
+            "divergences": [
+                {
+                    "call_index": i,
+                    "agent_id": c.agent_id,
+                    "match": c.match,
+                    "artifact_id": c.artifact_id,
+                    "recorded_input_chars": c.recorded_input_chars,
+                    "replayed_input_chars": c.replayed_input_chars,
+                }
+                for i, c in enumerate(self.calls)
+                if c.match in ("diverged", "missing")
+            ],
+            "payload_chars": dict(payload_chars),
+            "prompt_seconds": {
+                "count": len(timings),
+                "total": round(sum(timings), 4),
+                "mean": round(sum(timings) / len(timings), 6) if timings else 0.0,
+                "p95": round(timings[int(0.95 * (len(timings) - 1))], 6) if timings else 0.0,
+            },
+        }
+
+
+def load_recording(db: Session, session_id: str) -> dict:
+    session = db.get(SessionModel, session_id)
+    if not session:
+        raise ValueError("Session not found")
+    tab1 = db.get(Tab1Inputs, session_id)
+
+    if session.archived_at is not None:
+        tables = read_archive(session_id)
+    else:
+        tables = {
+            model.__tablename__: [
+                mapping_to_dict(row)
+                for row in db.execute(select(model.__table__).where(model.session_id == session_id)).mappings()
+            ]
+            for model in ARCHIVED_TABLES
+        }
+    tables["events"].extend(ev for chunk in tables.pop("event_chunks", []) for ev in unpack_chunk_row(chunk))
+    tables["events"].sort(key=lambda e: (e["prompt_index"], e["created_at"]))
+    tables["llm_artifacts"].sort(key=lambda a: a["created_at"])
+    tables["narrative_drafts"].sort(key=lambda d: d["created_at"])
+
+    return {
+        "state": session.state,
+        "selected_agent_slots": list(session.selected_agent_slots),
+        "agent_names": dict(session.agent_names),
+        "world_text": tab1.world_text if tab1 else "",
+        "chapter_text": tab1.chapter_text if tab1 else "",
+        "agent_identity_text_by_slot": dict(tab1.agent_identity_text_by_slot) if tab1 else {},
+        **tables,
+    }
+
+
+def _scratch_db() -> Session:
+    engine = create_engine("sqlite+pysqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+
+
+def replay_session(source_db: Session, session_id: str, target_db: Session | None = None) -> ReplayReport:
+    """Re-drive a recorded session through services.py against recorded LLM outputs.
+
+    The replay uses the same session_id in a scratch database (in-memory SQLite
+    unless target_db is given), so payloads match the recording byte-for-byte
+    when payload building has not changed.
+    """
+    from . import services
+
+    recording = load_recording(source_db, session_id)
+    target_db = target_db or _scratch_db()
+    provider = ReplayProvider(recording["llm_artifacts"])
+    report = ReplayReport(session_id=session_id)
+
+    agent_slot_by_prompt = {}
+    for ev in recording["events"]:
+        if ev["role"] == "agent":
+            agent_slot_by_prompt.setdefault(ev["prompt_index"], ev["agent_slot"])
+
+    with use_provider(provider):
+        target_db.add(SessionModel(session_id=session_id, state=SessionState.DRAFT_TAB1, prompt_index=0, last_summarized_prompt_index=0))
+        target_db.add(Tab1Inputs(session_id=session_id, world_text="", chapter_text="", agent_identity_text_by_slot={}))
+        target_db.commit()
+
+        services.save_tab1(
+            target_db,
+            session_id,
+            {
+                "world_text": recording["world_text"],
+                "chapter_text": recording["chapter_text"],
+                "selected_agent_slots": recording["selected_agent_slots"],
+                "agent_names": recording["agent_names"],
+                "agent_identity_text_by_slot": recording["agent_identity_text_by_slot"],
+            },
+        )
+        services.lock_tab1(target_db, session_id)
+
+        for ev in recording["events"]:
+            if ev["role"] != "user":
+                continue
+            slot = agent_slot_by_prompt.get(ev["prompt_index"], recording["selected_agent_slots"][0])
+            started = time.perf_counter()
+            services.prompt_agent(target_db, session_id, slot, ev["text"])
+            report.prompt_seconds.append(time.perf_counter() - started)
+
+        if recording["state"] in (SessionState.ENDED, SessionState.NARRATING) or recording["narrative_drafts"]:
+            services.end_chapter(target_db, session_id)
+        for draft in recording["narrative_drafts"]:
+            services.save_narrative_agent(target_db, session_id, draft["narrative_agent_definition_text"])
+            services.build_narrative(target_db, session_id)
+
+    report.calls = provider.calls
+    report.unused_artifacts = provider.used.count(False)
+    return report
+
+
+def main() -> None:
+    from .db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Replay a recorded session from its llm_artifacts.")
+    parser.add_argument("session_id")
+    parser.add_argument("--fail-on-divergence", action="store_true")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        report = replay_session(db, args.session_id)
+    print(json.dumps(report.summary(), indent=2))
+    if args.fail_on_divergence and (report.divergences or report.unused_artifacts):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
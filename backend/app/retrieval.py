@@ -0,0 +1,162 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from .eventstore import load_events
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its me my no not of on or our "
+    "she so that the their them then there they this to was we were what when where which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+@dataclass
+class Document:
+    prompt_index: int
+    role: str
+    agent_slot: int | None
+    text: str
+    length: int
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: list[Document] = []
+        self.postings: dict[str, dict[int, int]] = {}
+        self.total_length = 0
+
+    def add(self, doc: Document, terms: list[str]) -> None:
+        doc_id = len(self.docs)
+        self.docs.append(doc)
+        self.total_length += doc.length
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def search(self, query: str, top_k: int, keep: Callable[[Document], bool] | None = None) -> list[tuple[float, Document]]:
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avgdl = self.total_length / n or 1.0
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                if keep is not None and not keep(self.docs[doc_id]):
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self.docs[doc_id].length / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+        return [(score, self.docs[doc_id]) for doc_id, score in ranked]
+
+
+class SessionIndex(BM25Index):
+    """BM25 index over one session's transcript.
+
+    Events are added in prompt order as they fall out of the recent-context
+    window, so each turn only reads the events it has not seen yet. Memory
+    summaries are not indexed: every payload already carries them all in
+    structured_memory.
+    """
+
+    def __init__(self, generation: str):
+        super().__init__()
+        self.generation = generation
+        self.indexed_through_prompt = 0
+        self.lock = threading.Lock()
+
+    def catch_up(self, db: Session, session_id: str, before_prompt: int) -> None:
+        if before_prompt - 1 <= self.indexed_through_prompt:
+            return
+        for ev in load_events(db, session_id, self.indexed_through_prompt + 1, before_prompt - 1):
+            terms = tokenize(ev.text)
+            self.add(Document(ev.prompt_index, ev.role.value, ev.agent_slot, ev.text, len(terms)), terms)
+        self.indexed_through_prompt = before_prompt - 1
+
+
+class RetrievalIndex:
+    """Process-local, per-session BM25 indexes kept in an LRU.
+
+    An index is keyed by the session's world/chapter lock block id, so a reset
+    and re-lock starts a fresh index. A process that has not seen a session yet
+    rebuilds its index from the database on first use.
+    """
+
+    def __init__(self, max_sessions: int = 256):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._indexes: OrderedDict[str, SessionIndex] = OrderedDict()
+
+    def _index_for(self, session_id: str, generation: str) -> SessionIndex:
+        with self._lock:
+            index = self._indexes.get(session_id)
+            if index is None or index.generation != generation:
+                index = SessionIndex(generation)
+                self._indexes[session_id] = index
+            self._indexes.move_to_end(session_id)
+            while len(self._indexes) > self.max_sessions:
+                self._indexes.popitem(last=False)
+            return index
+
+    def recall(
+        self,
+        db: Session,
+        session_id: str,
+        generation: str,
+        before_prompt: int,
+        query: str,
+        top_k: int,
+        budget_chars: int,
+    ) -> list[dict]:
+        """Return up to top_k events older than before_prompt that match query, within budget_chars.
+
+        generation is the block id of the session's world/chapter lock block ("" before the lock).
+        """
+        index = self._index_for(session_id, generation)
+        with index.lock:
+            index.catch_up(db, session_id, before_prompt)
+            # The recent-context window can widen again after a trimmed turn; skip events it already shows.
+            hits = index.search(query, top_k, keep=lambda doc: doc.prompt_index < before_prompt)
+
+        snippets = []
+        remaining = budget_chars
+        for score, doc in hits:
+            if remaining <= 0:
+                break
+            text = doc.text[:remaining]
+            remaining -= len(text)
+            snippets.append(
+                {
+                    "prompt_index": doc.prompt_index,
+                    "role": doc.role,
+                    "agent_slot": doc.agent_slot,
+                    "score": round(score, 3),
+                    "text": text,
+                }
+            )
+        return snippets
+
+    def retain(self, keep: Callable[[str], bool]) -> None:
+        """Drop the indexes of sessions for which keep(session_id) is false."""
+        with self._lock:
+            for session_id in [sid for sid in self._indexes if not keep(sid)]:
+                del self._indexes[session_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._indexes), "documents": sum(len(i.docs) for i in self._indexes.values())}
@@ -0,0 +1,131 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+ROUTING_STRATEGIES = ("ewma", "least_outstanding")
+
+
+@dataclass
+class Endpoint:
+    name: str
+    base_url: str
+    api_key: str
+    weight: float = 1.0
+    models: dict[str, str] = field(default_factory=dict)
+    outstanding: int = 0
+    ewma_latency: float = 0.0
+    ewma_error_rate: float = 0.0
+    consecutive_failures: int = 0
+    cooldown_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+
+    def model_for(self, agent_id: str, model: str) -> str:
+        return self.models.get(agent_id, self.models.get(model, model))
+
+
+class EndpointPool:
+    """Tracks rolling latency/error stats per endpoint and ranks them for routing.
+
+    ``ewma`` scores an endpoint by its smoothed latency scaled by the requests
+    already in flight to it; ``least_outstanding`` only looks at in-flight
+    requests. Both divide by the endpoint weight. Endpoints that just failed are
+    put in an exponential cooldown and only tried after every healthy one.
+    """
+
+    def __init__(
+        self,
+        endpoints: list[Endpoint],
+        strategy: str = "ewma",
+        cooldown_seconds: float = 30.0,
+        alpha: float = 0.3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.cooldown_seconds = cooldown_seconds
+        self.alpha = alpha
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def _score(self, endpoint: Endpoint) -> tuple[float, float]:
+        weight = max(endpoint.weight, 1e-6)
+        load = (endpoint.outstanding + 1) / weight
+        if self.strategy == "least_outstanding":
+            return load, endpoint.ewma_latency
+        return endpoint.ewma_latency * load, load
+
+    def ranked(self) -> list[Endpoint]:
+        with self._lock:
+            now = self.clock()
+            healthy = [e for e in self.endpoints if e.cooldown_until <= now]
+            cooling = [e for e in self.endpoints if e.cooldown_until > now]
+            return sorted(healthy, key=self._score) + sorted(cooling, key=lambda e: e.cooldown_until)
+
+    def acquire(self, endpoint: Endpoint) -> float:
+        with self._lock:
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        return self.clock()
+
+    def abandon(self, endpoint: Endpoint) -> None:
+        """Release a call the caller cut short; its latency and outcome say nothing about the endpoint."""
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+
+    def release(self, endpoint: Endpoint, started: float, ok: bool) -> None:
+        with self._lock:
+            now = self.clock()
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            endpoint.ewma_error_rate += self.alpha * ((0.0 if ok else 1.0) - endpoint.ewma_error_rate)
+            if ok:
+                latency = now - started
+                if endpoint.ewma_latency == 0.0:
+                    endpoint.ewma_latency = latency
+                else:
+                    endpoint.ewma_latency += self.alpha * (latency - endpoint.ewma_latency)
+                endpoint.consecutive_failures = 0
+                endpoint.cooldown_until = 0.0
+            else:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                backoff = min(2 ** (endpoint.consecutive_failures - 1), 8)
+                endpoint.cooldown_until = now + self.cooldown_seconds * backoff
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            now = self.clock()
+            return [
+                {
+                    "name": e.name,
+                    "base_url": e.base_url,
+                    "weight": e.weight,
+                    "outstanding": e.outstanding,
+                    "ewma_latency_seconds": round(e.ewma_latency, 4),
+                    "ewma_error_rate": round(e.ewma_error_rate, 4),
+                    "healthy": e.cooldown_until <= now,
+                    "requests": e.requests,
+                    "failures": e.failures,
+                }
+                for e in self.endpoints
+            ]
+
+
+def build_endpoints(configs: list[dict], default_api_key: str) -> list[Endpoint]:
+    endpoints = []
+    for i, cfg in enumerate(configs):
+        if not cfg.get("base_url"):
+            raise ValueError(f"OPENAI_ENDPOINTS[{i}] is missing base_url")
+        endpoints.append(
+            Endpoint(
+                name=cfg.get("name") or f"endpoint{i}",
+                base_url=cfg["base_url"].rstrip("/"),
+                api_key=cfg.get("api_key") or default_api_key,
+                weight=float(cfg.get("weight", 1.0)),
+                models=dict(cfg.get("models", {})),
+            )
+        )
+    return endpoints
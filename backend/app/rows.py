@@ -0,0 +1,47 @@
+import base64
+import enum
+from datetime import datetime
+
+from sqlalchemy import DateTime, Enum, LargeBinary
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def row_to_dict(row) -> dict:
+    """Plain JSON-safe dict of an ORM row's columns (datetimes as ISO strings, enums as values, bytes as base64)."""
+    return {column.key: _jsonable(getattr(row, column.key)) for column in row.__table__.columns}
+
+
+def mapping_to_dict(mapping) -> dict:
+    """Same as row_to_dict for a Core result row mapping."""
+    return {key: _jsonable(value) for key, value in mapping.items()}
+
+
+def row_values(model, data: dict) -> dict:
+    """Inverse of row_to_dict: column values typed for ``model``, ignoring unknown keys."""
+    values = {}
+    for column in model.__table__.columns:
+        if column.key not in data:
+            continue
+        value = data[column.key]
+        if value is not None:
+            if isinstance(column.type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif isinstance(column.type, Enum) and column.type.enum_class is not None:
+                value = column.type.enum_class(value)
+            elif isinstance(column.type, LargeBinary) and isinstance(value, str):
+                value = base64.b64decode(value)
+        values[column.key] = value
+    return values
+
+
+def row_from_dict(model, data: dict):
+    return model(**row_values(model, data))
@@ -80,3 +80,20 @@ class SessionDetailResponse(BaseModel):
     events: list[EventOut]
     memory_blocks: list[MemoryBlockOut]
     narrative_drafts: list[NarrativeBuildResponse]
+
+
+class SearchHit(BaseModel):
+    kind: Literal["event", "memory", "draft"]
+    source_id: str
+    prompt_index: int
+    text: str
+    created_at: datetime
+    rank: float
+
+
+class SearchResponse(BaseModel):
+    query: str
+    results: list[SearchHit]
+    limit: int
+    offset: int
+    has_more: bool
@@ -0,0 +1,58 @@
+import argparse
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from . import queries
+from .eventstore import load_events, unpack_chunk_row
+from .models import Event, SearchDocument, Session as SessionModel, search_document_values
+from .rows import row_from_dict
+
+# search_documents rows are written by the after_insert listeners in models.py as
+# events, memory blocks and drafts are added through the ORM. The helpers here
+# cover rows that arrive another way: bulk imports and archived chunks.
+
+
+def _insert_documents(db: Session, sources) -> int:
+    documents = [values for source in sources if (values := search_document_values(source)) is not None]
+    if documents:
+        db.execute(insert(SearchDocument.__table__), documents)
+    return len(documents)
+
+
+def index_session(db: Session, session_id: str) -> int:
+    """Rebuild a session's search documents from its events, chunks, memory blocks and drafts. The caller commits."""
+    db.execute(delete(SearchDocument).where(SearchDocument.session_id == session_id))
+    sources = [
+        *load_events(db, session_id),
+        *db.execute(queries.session_memory_blocks(session_id)).scalars(),
+        *db.execute(queries.session_drafts(session_id)).scalars(),
+    ]
+    return _insert_documents(db, sources)
+
+
+def index_packed_events(db: Session, chunk_rows: list[dict]) -> int:
+    """Index the events inside event_chunks rows in row_to_dict form (e.g. restored from an archive). The caller commits."""
+    return _insert_documents(db, (row_from_dict(Event, data) for chunk in chunk_rows for data in unpack_chunk_row(chunk)))
+
+
+def main() -> None:
+    from .db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild full-text search documents, e.g. after migration 008.")
+    parser.add_argument("--session-id", action="append", dest="session_ids")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        query = select(SessionModel.session_id).where(SessionModel.archived_at.is_(None))
+        if args.session_ids:
+            query = query.where(SessionModel.session_id.in_(args.session_ids))
+        documents = 0
+        for session_id in db.execute(query).scalars().all():
+            documents += index_session(db, session_id)
+            db.commit()
+    print(f"indexed {documents} document(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from .models import Event, Session as SessionModel, Tab1Inputs
+
+# Response bodies built straight from rows as plain dicts, rendered by ORJSONResponse.
+# Shapes match the pydantic models in schemas.py, which stay as the response_model
+# for the OpenAPI docs but are not used to validate these responses again.
+
+
+def session_summary(session: SessionModel) -> dict:
+    return {
+        "session_id": session.session_id,
+        "state": session.state,
+        "prompt_index": session.prompt_index,
+        "last_summarized_prompt_index": session.last_summarized_prompt_index,
+        "tab1_locked": session.tab1_locked,
+    }
+
+
+def tab1_view(session: SessionModel, tab1: Tab1Inputs) -> dict:
+    # Slot keys are stored as strings, which is what JSON object keys are anyway.
+    return {
+        "world_text": tab1.world_text,
+        "chapter_text": tab1.chapter_text,
+        "selected_agent_slots": session.selected_agent_slots,
+        "agent_names": session.agent_names,
+        "agent_identity_text_by_slot": tab1.agent_identity_text_by_slot,
+        "tab1_locked": session.tab1_locked,
+    }
+
+
+def event_view(event: Event) -> dict:
+    return {
+        "event_id": event.event_id,
+        "prompt_index": event.prompt_index,
+        "role": event.role,
+        "agent_slot": event.agent_slot,
+        "text": event.text,
+        "created_at": event.created_at,
+    }
+
+
+def prompt_view(session: SessionModel, user_event: Event, agent_event: Event, summary_triggered: bool) -> dict:
+    return {
+        "session": session_summary(session),
+        "user_event": event_view(user_event),
+        "agent_event": event_view(agent_event),
+        "summary_triggered": summary_triggered,
+    }
+
+
+def session_detail_view(detail: dict) -> dict:
+    """Body for GET /session/{id} from services.get_session_detail, whose lists are already projected dicts."""
+    return {
+        "session": session_summary(detail["session"]),
+        "tab1": tab1_view(detail["session"], detail["tab1"]),
+        "events": detail["events"],
+        "memory_blocks": detail["memory_blocks"],
+        "narrative_drafts": detail["narrative_drafts"],
+    }
+
+
+def search_view(terms: str, hits: list[dict], limit: int, offset: int, has_more: bool) -> dict:
+    return {"query": terms, "results": hits, "limit": limit, "offset": offset, "has_more": has_more}
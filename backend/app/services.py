@@ -1,9 +1,30 @@
-from sqlalchemy import delete, select
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from sqlalchemy import delete
 from sqlalchemy.orm import Session
 
+from . import metrics, queries
+from .archive import rehydrate_session
+from .batching import enqueue_summary, flush_session_jobs, should_batch, summary_block
 from .config import settings
-from .llm import get_provider, log_artifact
-from .models import Event, EventRole, MemoryBlock, MemoryBlockType, NarrativeDraft, Session as SessionModel, SessionState, Tab1Inputs
+from .db import SessionLocal
+from .eventstore import load_event_views, load_events
+from .llm import generate, get_provider, log_artifact
+from .models import (
+    Event,
+    EventChunk,
+    EventRole,
+    MemoryBlock,
+    NarrativeDraft,
+    SearchDocument,
+    Session as SessionModel,
+    SessionState,
+    SummaryJob,
+    Tab1Inputs,
+)
+from .retrieval import RetrievalIndex
 
 AGENT_COLOR_NAMES = {
     1: "Agent Red",
@@ -15,6 +36,17 @@ AGENT_COLOR_NAMES = {
     7: "Agent Violet",
 }
 
+# Recent context looks back at most this many prompts, trimmed further to recent_context_budget_chars.
+RECENT_CONTEXT_PROMPTS = 7
+
+retrieval_index = RetrievalIndex(settings.retrieval_max_sessions)
+metrics.register_collector("retrieval", retrieval_index.stats)
+
+# (session_id, agent_slot) -> (prompt_index, memory stamp, character context) built ahead of the next prompt.
+_speculative_contexts: OrderedDict[tuple[str, int], tuple[int, tuple, dict]] = OrderedDict()
+_speculative_lock = threading.Lock()
+metrics.register_collector("speculative", lambda: {"entries": len(_speculative_contexts)})
+
 
 def _default_name(slot: int) -> str:
     return AGENT_COLOR_NAMES.get(slot, f"Agent {slot}")
@@ -89,8 +121,8 @@ def lock_tab1(db: Session, session_id: str) -> SessionModel:
     if session.state != SessionState.DRAFT_TAB1:
         raise ValueError("Session cannot be locked from current state")
 
+    # Not flushed: nothing is written until after the model call (see prompt_agent).
     session.state = SessionState.LOCKING
-    db.flush()
 
     tab1 = get_tab1_or_create(db, session_id)
     payload = {
@@ -100,28 +132,17 @@ def lock_tab1(db: Session, session_id: str) -> SessionModel:
         "agent_names": session.agent_names,
         "agent_identity_text_by_slot": tab1.agent_identity_text_by_slot,
     }
-    text = provider.generate("agent0", settings.llm_model_summary, payload)
-    log_artifact(db, session_id, "agent0", settings.llm_model_summary, payload, text, provider.provider_name)
-
-    db.add(
-        MemoryBlock(
-            session_id=session_id,
-            type=MemoryBlockType.WORLD_CHAPTER_LOCK,
-            from_prompt_index=0,
-            to_prompt_index=0,
-            json_payload={
-                "summary": text,
-                "world_text": tab1.world_text,
-                "chapter_text": tab1.chapter_text,
-                "selected_agent_slots": session.selected_agent_slots,
-                "agent_names": session.agent_names,
-            },
-        )
-    )
+    if should_batch("agent0"):
+        enqueue_summary(db, session_id, "agent0", settings.llm_model_summary, payload)
+    else:
+        text = generate(provider, "agent0", settings.llm_model_summary, payload)
+        log_artifact(db, session_id, "agent0", settings.llm_model_summary, payload, text, provider.provider_name)
+        db.add(summary_block(session_id, "agent0", payload, text))
 
     session.tab1_locked = True
     session.prompt_index = 0
     session.last_summarized_prompt_index = 0
+    session.unsummarized_chars = 0
     session.state = SessionState.ACTIVE
 
     db.commit()
@@ -129,20 +150,15 @@ def lock_tab1(db: Session, session_id: str) -> SessionModel:
     return session
 
 
-def _run_summarization(db: Session, session: SessionModel, to_prompt_index: int) -> bool:
+def _run_summarization(
+    db: Session, session: SessionModel, to_prompt_index: int, urgent: bool = False, unflushed_events: tuple[Event, ...] = ()
+) -> bool:
+    """Summarize the unsummarized range. unflushed_events are added but not yet flushed events of that range."""
     if to_prompt_index <= session.last_summarized_prompt_index:
         return False
     provider = get_provider()
     from_idx = session.last_summarized_prompt_index + 1
-    events = db.execute(
-        select(Event)
-        .where(
-            Event.session_id == session.session_id,
-            Event.prompt_index >= from_idx,
-            Event.prompt_index <= to_prompt_index,
-        )
-        .order_by(Event.prompt_index.asc(), Event.created_at.asc())
-    ).scalars().all()
+    events = [*load_events(db, session.session_id, from_idx, to_prompt_index), *unflushed_events]
 
     payload = {
         "from_prompt_index": from_idx,
@@ -157,45 +173,73 @@ def _run_summarization(db: Session, session: SessionModel, to_prompt_index: int)
             for e in events
         ],
     }
-    output = provider.generate("agent8", settings.llm_model_summary, payload)
-    log_artifact(db, session.session_id, "agent8", settings.llm_model_summary, payload, output, provider.provider_name)
-
-    db.add(
-        MemoryBlock(
-            session_id=session.session_id,
-            type=MemoryBlockType.TURN_DELTA,
-            from_prompt_index=from_idx,
-            to_prompt_index=to_prompt_index,
-            json_payload={"summary": output, "event_count": len(events)},
-        )
-    )
+    if not urgent and should_batch("agent8"):
+        # The block is written by the batch worker; the range counts as summarized so it is not queued twice.
+        enqueue_summary(db, session.session_id, "agent8", settings.llm_model_summary, payload)
+    else:
+        output = generate(provider, "agent8", settings.llm_model_summary, payload)
+        log_artifact(db, session.session_id, "agent8", settings.llm_model_summary, payload, output, provider.provider_name)
+        db.add(summary_block(session.session_id, "agent8", payload, output))
     session.last_summarized_prompt_index = to_prompt_index
+    session.unsummarized_chars = 0
     return True
 
 
-def _build_character_payload(db: Session, session: SessionModel, agent_slot: int, user_text: str) -> dict:
+def _should_summarize(session: SessionModel) -> bool:
+    """Summarize once the unsummarized range holds chunk_size_prompts prompts, or
+    summary_budget_chars characters spread over at least summary_min_prompts prompts."""
+    pending_prompts = session.prompt_index - session.last_summarized_prompt_index
+    if pending_prompts >= settings.chunk_size_prompts:
+        return True
+    return (
+        settings.summary_budget_chars > 0
+        and pending_prompts >= settings.summary_min_prompts
+        and session.unsummarized_chars >= settings.summary_budget_chars
+    )
+
+
+def _trim_recent_events(events: list[Event], budget_chars: int) -> list[Event]:
+    """Drop whole prompts, oldest first, until the window fits budget_chars; the newest prompt is always kept."""
+    total = sum(len(ev.text) for ev in events)
+    while events and total > budget_chars and events[0].prompt_index != events[-1].prompt_index:
+        oldest = events[0].prompt_index
+        total -= sum(len(ev.text) for ev in events if ev.prompt_index == oldest)
+        events = [ev for ev in events if ev.prompt_index != oldest]
+    return events
+
+
+def _memory_version(memory_blocks: list[MemoryBlock]) -> str:
+    # Blocks are append-only and a reset/re-lock creates a new first block, so (first id, count) identifies the memory.
+    if not memory_blocks:
+        return ""
+    return f"{memory_blocks[0].block_id}:{len(memory_blocks)}"
+
+
+def _load_context_rows(db: Session, session: SessionModel, prompt_index: int) -> tuple[Tab1Inputs, list[MemoryBlock], list[Event]]:
     tab1 = get_tab1_or_create(db, session.session_id)
 
-    memory_blocks = db.execute(
-        select(MemoryBlock)
-        .where(MemoryBlock.session_id == session.session_id)
-        .order_by(MemoryBlock.created_at.asc())
-    ).scalars().all()
+    memory_blocks = db.execute(queries.session_memory_blocks(session.session_id)).scalars().all()
 
-    from_prompt = max(1, session.prompt_index - 7)
-    to_prompt = max(0, session.prompt_index - 1)
+    from_prompt = max(1, prompt_index - RECENT_CONTEXT_PROMPTS)
+    to_prompt = max(0, prompt_index - 1)
     recent_events = []
     if to_prompt >= from_prompt:
-        recent_events = db.execute(
-            select(Event)
-            .where(
-                Event.session_id == session.session_id,
-                Event.prompt_index >= from_prompt,
-                Event.prompt_index <= to_prompt,
-            )
-            .order_by(Event.prompt_index.asc(), Event.created_at.asc())
-        ).scalars().all()
-
+        recent_events = load_events(db, session.session_id, from_prompt, to_prompt)
+    return tab1, memory_blocks, recent_events
+
+
+def _character_context(
+    session: SessionModel,
+    tab1: Tab1Inputs,
+    memory_blocks: list[MemoryBlock],
+    recent_events: list[Event],
+    agent_slot: int,
+    prompt_index: int,
+) -> dict:
+    """Everything in a character payload that does not depend on the user's text."""
+    recent_events = _trim_recent_events(recent_events, settings.recent_context_budget_chars)
+    from_prompt = recent_events[0].prompt_index if recent_events else max(1, prompt_index - RECENT_CONTEXT_PROMPTS)
+    to_prompt = max(0, prompt_index - 1)
     return {
         "agent_identity": {
             "slot": agent_slot,
@@ -222,15 +266,105 @@ def _build_character_payload(db: Session, session: SessionModel, agent_slot: int
             }
             for ev in recent_events
         ],
+        "context_prompt_range": [from_prompt, to_prompt] if recent_events else [],
+        "memory_version": _memory_version(memory_blocks),
+        # Keys the retrieval index (the world/chapter lock block, so a reset starts afresh); not sent to the model.
+        "retrieval_generation": memory_blocks[0].block_id if memory_blocks else "",
+    }
+
+
+def _build_character_payload(db: Session, session: SessionModel, agent_slot: int, user_text: str, context: dict | None = None) -> dict:
+    if context is None:
+        tab1, memory_blocks, recent_events = _load_context_rows(db, session, session.prompt_index)
+        context = _character_context(session, tab1, memory_blocks, recent_events, agent_slot, session.prompt_index)
+
+    recalled = []
+    if settings.retrieval_enabled and user_text.strip():
+        recalled = retrieval_index.recall(
+            db,
+            session.session_id,
+            context["retrieval_generation"],
+            # Prompts trimmed out of recent_context become recallable.
+            before_prompt=context["context_prompt_range"][0] if context["context_prompt_range"] else session.prompt_index,
+            query=user_text,
+            top_k=settings.retrieval_top_k,
+            budget_chars=settings.retrieval_budget_chars,
+        )
+
+    return {
+        "agent_identity": context["agent_identity"],
+        "structured_memory": context["structured_memory"],
+        "recent_context": context["recent_context"],
+        "recalled_context": [
+            {**snippet, "agent_name": session.agent_names.get(str(snippet["agent_slot"]))}
+            if snippet.get("agent_slot")
+            else snippet
+            for snippet in recalled
+        ],
         "user_prompt": user_text,
         "meta": {
             "session_id": session.session_id,
             "prompt_index": session.prompt_index,
-            "context_prompt_range": [from_prompt, to_prompt] if recent_events else [],
+            "context_prompt_range": context["context_prompt_range"],
+            "memory_version": context["memory_version"],
         },
     }
 
 
+def _memory_stamp(db: Session, session_id: str) -> tuple:
+    # Cheap fingerprint of the append-only memory: any added block or reset changes count or newest timestamp.
+    return tuple(db.execute(queries.memory_stamp(session_id)).one())
+
+
+def _take_speculative_context(db: Session, session: SessionModel, agent_slot: int) -> dict | None:
+    with _speculative_lock:
+        entry = _speculative_contexts.pop((session.session_id, agent_slot), None)
+    if entry is None:
+        metrics.increment("speculative.miss")
+        return None
+    prompt_index, stamp, context = entry
+    if prompt_index != session.prompt_index or stamp != _memory_stamp(db, session.session_id):
+        metrics.increment("speculative.stale")
+        return None
+    metrics.increment("speculative.hit")
+    return context
+
+
+def retain_session_state(keep: Callable[[str], bool]) -> None:
+    """Drop process-local per-session state (retrieval indexes, speculative contexts) for sessions keep() rejects."""
+    retrieval_index.retain(keep)
+    with _speculative_lock:
+        for key in [key for key in _speculative_contexts if not keep(key[0])]:
+            del _speculative_contexts[key]
+
+
+def precompute_next_payloads(session_id: str) -> None:
+    """Pre-build the static part of the next turn's character payload for every selected slot.
+
+    Runs after a committed turn (as a background task, on its own DB session).
+    The next prompt_agent call for the same prompt index and unchanged memory
+    only adds recall and the user text.
+    """
+    with SessionLocal() as db:
+        session = db.get(SessionModel, session_id)
+        if not session or session.state != SessionState.ACTIVE:
+            return
+        next_index = session.prompt_index + 1
+        stamp = _memory_stamp(db, session_id)
+        tab1, memory_blocks, recent_events = _load_context_rows(db, session, next_index)
+        contexts = {
+            slot: _character_context(session, tab1, memory_blocks, recent_events, slot, next_index)
+            for slot in session.selected_agent_slots
+        }
+
+    with _speculative_lock:
+        for slot, context in contexts.items():
+            _speculative_contexts[(session_id, slot)] = (next_index, stamp, context)
+            _speculative_contexts.move_to_end((session_id, slot))
+        while len(_speculative_contexts) > settings.speculative_max_entries:
+            _speculative_contexts.popitem(last=False)
+
+
 def prompt_agent(db: Session, session_id: str, agent_slot: int, user_text: str) -> tuple[SessionModel, Event, Event, bool]:
     provider = get_provider()
     session = get_session_or_404(db, session_id)
@@ -249,10 +383,10 @@ def prompt_agent(db: Session, session_id: str, agent_slot: int, user_text: str)
         text=user_text,
     )
     db.add(user_event)
-    db.flush()
 
-    agent_payload = _build_character_payload(db, session, agent_slot, user_text)
-    agent_text = provider.generate("agent_character", settings.llm_model_character, agent_payload)
+    context = _take_speculative_context(db, session, agent_slot) if settings.speculative_payloads else None
+    agent_payload = _build_character_payload(db, session, agent_slot, user_text, context)
+    agent_text = generate(provider, "agent_character", settings.llm_model_character, agent_payload)
     log_artifact(db, session_id, "agent_character", settings.llm_model_character, agent_payload, agent_text, provider.provider_name)
 
     agent_event = Event(
@@ -265,11 +399,13 @@ def prompt_agent(db: Session, session_id: str, agent_slot: int, user_text: str)
     db.add(agent_event)
 
     summary_triggered = False
-    if session.prompt_index % settings.chunk_size_prompts == 0:
+    session.unsummarized_chars += len(user_text) + len(agent_text)
+    if _should_summarize(session):
         session.state = SessionState.SUMMARIZING
-        summary_triggered = _run_summarization(db, session, session.prompt_index)
+        summary_triggered = _run_summarization(db, session, session.prompt_index, unflushed_events=(user_event,))
         session.state = SessionState.ACTIVE
 
+    # Nothing is flushed before this commit, so no write lock (SQLite) or row lock is held during either model call.
     db.commit()
     db.refresh(session)
     db.refresh(user_event)
@@ -284,7 +420,10 @@ def end_chapter(db: Session, session_id: str) -> SessionModel:
 
     if session.last_summarized_prompt_index < session.prompt_index:
         session.state = SessionState.SUMMARIZING
-        _run_summarization(db, session, session.prompt_index)
+        _run_summarization(db, session, session.prompt_index, urgent=True)
+    # The narrative needs every summary now, so queued ones become direct calls. Last, because
+    # it ends by locking the job rows, and no model call should run while they are locked.
+    flush_session_jobs(db, session_id, get_provider())
 
     session.state = SessionState.ENDED
     db.commit()
@@ -305,11 +444,12 @@ def build_narrative(db: Session, session_id: str) -> NarrativeDraft:
     session = get_session_or_404(db, session_id)
     if session.state != SessionState.ENDED:
         raise ValueError("Build narrative allowed only in ENDED state")
+    rehydrate_session(db, session)
 
     session.state = SessionState.NARRATING
 
-    events = db.execute(select(Event).where(Event.session_id == session_id).order_by(Event.prompt_index.asc(), Event.created_at.asc())).scalars().all()
-    blocks = db.execute(select(MemoryBlock).where(MemoryBlock.session_id == session_id).order_by(MemoryBlock.created_at.asc())).scalars().all()
+    events = load_events(db, session_id)
+    blocks = db.execute(queries.session_memory_blocks(session_id)).scalars().all()
 
     payload = {
         "narrative_agent_definition_text": session.narrative_agent_definition_text,
@@ -328,7 +468,7 @@ def build_narrative(db: Session, session_id: str) -> NarrativeDraft:
             for b in blocks
         ],
     }
-    output = provider.generate("agent9", settings.llm_model_narrative, payload)
+    output = generate(provider, "agent9", settings.llm_model_narrative, payload)
     log_artifact(db, session_id, "agent9", settings.llm_model_narrative, payload, output, provider.provider_name)
 
     draft = NarrativeDraft(
@@ -350,12 +490,16 @@ def build_narrative(db: Session, session_id: str) -> NarrativeDraft:
 
 def reset_session(db: Session, session_id: str) -> SessionModel:
     session = get_session_or_404(db, session_id)
+    rehydrate_session(db, session)
     session.state = SessionState.RESETTING
     db.flush()
 
     db.execute(delete(Event).where(Event.session_id == session_id))
+    db.execute(delete(EventChunk).where(EventChunk.session_id == session_id))
+    db.execute(delete(SummaryJob).where(SummaryJob.session_id == session_id))
     db.execute(delete(MemoryBlock).where(MemoryBlock.session_id == session_id))
     db.execute(delete(NarrativeDraft).where(NarrativeDraft.session_id == session_id))
+    db.execute(delete(SearchDocument).where(SearchDocument.session_id == session_id))
 
     tab1 = get_tab1_or_create(db, session_id)
     tab1.world_text = ""
@@ -365,6 +509,7 @@ def reset_session(db: Session, session_id: str) -> SessionModel:
     session.state = SessionState.DRAFT_TAB1
     session.prompt_index = 0
     session.last_summarized_prompt_index = 0
+    session.unsummarized_chars = 0
     session.tab1_locked = False
     session.selected_agent_slots = [1]
     session.agent_names = {"1": _default_name(1)}
@@ -375,12 +520,19 @@ def reset_session(db: Session, session_id: str) -> SessionModel:
     return session
 
 
+def get_tab1(db: Session, session_id: str) -> tuple[SessionModel, Tab1Inputs]:
+    session = get_session_or_404(db, session_id)
+    return session, get_tab1_or_create(db, session_id)
+
+
 def get_session_detail(db: Session, session_id: str) -> dict:
+    """Session and tab1 rows plus events, memory blocks and drafts as column-projected dicts."""
     session = get_session_or_404(db, session_id)
+    rehydrate_session(db, session)
     tab1 = get_tab1_or_create(db, session_id)
-    events = db.execute(select(Event).where(Event.session_id == session_id).order_by(Event.prompt_index.asc(), Event.created_at.asc())).scalars().all()
-    memory_blocks = db.execute(select(MemoryBlock).where(MemoryBlock.session_id == session_id).order_by(MemoryBlock.created_at.asc())).scalars().all()
-    drafts = db.execute(select(NarrativeDraft).where(NarrativeDraft.session_id == session_id).order_by(NarrativeDraft.created_at.asc())).scalars().all()
+    events = load_event_views(db, session_id)
+    memory_blocks = [dict(row) for row in db.execute(queries.session_memory_block_views(session_id)).mappings()]
+    drafts = [dict(row) for row in db.execute(queries.session_draft_views(session_id)).mappings()]
 
     return {
         "session": session,
@@ -389,3 +541,16 @@ def get_session_detail(db: Session, session_id: str) -> dict:
         "memory_blocks": memory_blocks,
         "narrative_drafts": drafts,
     }
+
+
+def search_session(db: Session, session_id: str, terms: str, limit: int, offset: int) -> tuple[list[dict], bool]:
+    """One page of ranked full-text matches in a session, and whether another page follows."""
+    session = get_session_or_404(db, session_id)
+    if not terms.strip():
+        return [], False
+    rehydrate_session(db, session)
+    query = queries.session_search(session_id, terms, db.get_bind().dialect.name)
+    # One extra row tells whether there is a next page without counting every match.
+    hits = [dict(row) for row in db.execute(query.limit(limit + 1).offset(offset)).mappings()]
+    metrics.increment("search.queries")
+    return hits[:limit], len(hits) > limit
@@ -0,0 +1,267 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable
+
+from . import metrics
+
+# Set on forwarded requests so the receiving node serves them even if its view of the ring differs.
+FORWARDED_HEADER = "x-shard-forwarded"
+OWNER_HEADER = "x-shard-owner"
+
+_SESSION_PATH_RE = re.compile(r"^/session/([^/]+)")
+
+# Hop-by-hop headers (RFC 9110 7.6.1) plus ones httpx recomputes.
+_DROP_HEADERS = {b"host", b"connection", b"keep-alive", b"transfer-encoding", b"te", b"upgrade", b"content-length"}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring: adding or removing a node moves only ~1/N of the keys."""
+
+    def __init__(self, nodes: list[str], vnodes: int = 64):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str | None:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+class Membership:
+    """The current node list, from a static list or a file re-read when it changes.
+
+    The file holds a JSON list of node base URLs or one URL per line. Listeners
+    run with the new ring after every change, so nodes can drop session-local
+    state for sessions they no longer own.
+    """
+
+    def __init__(self, self_url: str, nodes: list[str] | None = None, path: str = "", refresh_seconds: float = 5.0):
+        self.self_url = self_url.rstrip("/")
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[HashRing], None]] = []
+        self._mtime: float | None = None
+        self._checked_at = 0.0
+        self._ring = HashRing([n.rstrip("/") for n in nodes or []])
+
+    def on_change(self, listener: Callable[[HashRing], None]) -> None:
+        self._listeners.append(listener)
+
+    def _read_file(self) -> list[str]:
+        with open(self.path, encoding="utf-8") as fh:
+            content = fh.read().strip()
+        nodes = json.loads(content) if content.startswith("[") else content.splitlines()
+        return [n.strip().rstrip("/") for n in nodes if n.strip()]
+
+    def ring(self) -> HashRing:
+        if not self.path:
+            return self._ring
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.refresh_seconds:
+                return self._ring
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                # Keep the last known ring if the file is briefly missing (e.g. mid-rewrite).
+                return self._ring
+            if mtime == self._mtime:
+                return self._ring
+            self._mtime = mtime
+            ring = HashRing(self._read_file())
+            changed = ring.nodes != self._ring.nodes
+            self._ring = ring
+        if changed:
+            metrics.increment("shard.membership_changes")
+            for listener in self._listeners:
+                listener(ring)
+        return ring
+
+    def owns(self, session_id: str) -> bool:
+        owner = self.ring().owner(session_id)
+        return owner is None or owner == self.self_url
+
+    def snapshot(self) -> dict:
+        return {"self": self.self_url, "nodes": self.ring().nodes}
+
+
+class ShardRouterMiddleware:
+    """Pure ASGI middleware that sends /session/{id}/... requests to the node owning that id.
+
+    Requests for sessions this node owns, requests already forwarded once, and
+    requests without a session id are served locally. If the owner cannot be
+    connected to, the request is served locally too: the database is shared, so
+    any node gives the right answer, only without the owner's warm caches. Any
+    later failure (e.g. a read timeout) is a 502, since the owner may already
+    have applied a non-idempotent /prompt or /end.
+    """
+
+    def __init__(self, app, membership: Membership, transport=None, timeout: float = 120.0):
+        self.app = app
+        self.membership = membership
+        self.transport = transport
+        self.timeout = timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        match = _SESSION_PATH_RE.match(scope["path"])
+        headers = dict(scope["headers"])
+        if not match or FORWARDED_HEADER.encode() in headers:
+            await self.app(scope, receive, send)
+            return
+        owner = self.membership.ring().owner(match.group(1))
+        if owner is None or owner == self.membership.self_url:
+            metrics.increment("shard.local")
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        import httpx
+
+        try:
+            response = await _unless_disconnected(self._forward(scope, owner, body), receive)
+        except ClientDisconnected:
+            # Cancelling the forward closes the connection to the owner, which sees its own disconnect.
+            metrics.increment("shard.forward_cancelled")
+            return
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # Nothing reached the owner, so serving it here cannot run the request twice.
+            metrics.increment("shard.forward_fallback")
+            await self.app(scope, _replay_body(body, receive), send)
+            return
+        except httpx.HTTPError:
+            # The owner may have run it (e.g. a read timeout mid /prompt); replaying could repeat a turn.
+            metrics.increment("shard.forward_failed")
+            await _send_bad_gateway(send, owner)
+            return
+
+        metrics.increment("shard.forwarded")
+        response_headers = [
+            (k.encode("latin-1"), v.encode("latin-1"))
+            for k, v in response.headers.multi_items()
+            if k.encode("latin-1") not in _DROP_HEADERS
+        ]
+        response_headers.append((OWNER_HEADER.encode(), owner.encode()))
+        await send({"type": "http.response.start", "status": response.status_code, "headers": response_headers})
+        await send({"type": "http.response.body", "body": response.content})
+
+    async def _forward(self, scope, owner: str, body: bytes):
+        import httpx
+
+        headers = [
+            (k.decode("latin-1"), v.decode("latin-1"))
+            for k, v in scope["headers"]
+            if k.lower() not in _DROP_HEADERS and k.lower() != b"x-forwarded-for"
+        ]
+        headers.append((FORWARDED_HEADER, self.membership.self_url))
+        headers.append(("x-forwarded-for", _forwarded_for(scope)))
+        url = owner + scope["path"]
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode("latin-1")
+        async with httpx.AsyncClient(transport=self.transport, timeout=self.timeout) as client:
+            return await client.request(scope["method"], url, headers=headers, content=body)
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the owner answered."""
+
+
+async def _unless_disconnected(coro, receive):
+    """Await coro, cancelling it if receive() reports the client disconnected first."""
+    import asyncio
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    work = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not work.done():
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+    if work.cancelled():
+        raise ClientDisconnected
+    return work.result()
+
+
+def _forwarded_for(scope) -> str:
+    """The request's X-Forwarded-For with its immediate peer appended, as a proxy would."""
+    hops = [v.decode("latin-1") for k, v in scope["headers"] if k.lower() == b"x-forwarded-for"]
+    client = scope.get("client")
+    hops.append(client[0] if client else "unknown")
+    return ", ".join(hops)
+
+
+async def _send_bad_gateway(send, owner: str) -> None:
+    body = json.dumps({"detail": f"Owner node {owner} failed to answer; the request may have been applied"}).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 502,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (OWNER_HEADER.encode(), owner.encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def _replay_body(body: bytes, receive):
+    """receive() for serving a buffered request locally: the body once, then the client's own messages.
+
+    Later calls must reach the real receive, so the app's disconnect checks see
+    real disconnects only, not one invented as soon as the body is consumed.
+    """
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if sent:
+            return await receive()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return replay
+
+
+def membership_from_settings() -> Membership | None:
+    from .config import settings
+
+    if not settings.shard_nodes and not settings.shard_membership_file:
+        return None
+    if not settings.shard_self_url:
+        raise RuntimeError("SHARD_SELF_URL is required when SHARD_NODES or SHARD_MEMBERSHIP_FILE is set")
+    return Membership(
+        settings.shard_self_url,
+        nodes=settings.shard_nodes,
+        path=settings.shard_membership_file,
+        refresh_seconds=settings.shard_membership_refresh_seconds,
+    )
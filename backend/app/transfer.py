@@ -0,0 +1,180 @@
+import argparse
+import json
+import sys
+from typing import Iterable, Iterator
+
+from sqlalchemy import Enum, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.types import JSON
+
+from .archive import ARCHIVED_TABLES, read_archive
+from .models import Event, EventChunk, LLMArtifact, MemoryBlock, NarrativeDraft, Session as SessionModel, SessionState, Tab1Inputs
+from .rows import mapping_to_dict, row_values
+from .search import index_session
+
+# Parents before children, so an import can insert lines in the order they were exported.
+EXPORT_TABLES = [SessionModel, Tab1Inputs, Event, EventChunk, MemoryBlock, NarrativeDraft, LLMArtifact]
+MODELS_BY_TABLE = {model.__tablename__: model for model in EXPORT_TABLES}
+
+_ORDER_BY = {
+    Event: (Event.prompt_index.asc(), Event.created_at.asc()),
+    EventChunk: (EventChunk.from_prompt_index.asc(),),
+    MemoryBlock: (MemoryBlock.created_at.asc(),),
+    NarrativeDraft: (NarrativeDraft.created_at.asc(),),
+    LLMArtifact: (LLMArtifact.created_at.asc(),),
+}
+
+
+def _line(table: str, row: dict) -> str:
+    return json.dumps({"table": table, "row": row}, separators=(",", ":")) + "\n"
+
+
+def export_ndjson(
+    db: Session,
+    session_ids: list[str] | None = None,
+    state: SessionState | None = None,
+    include_artifacts: bool = False,
+    batch_size: int = 1000,
+) -> Iterator[str]:
+    """Yield one NDJSON line per row for the selected sessions.
+
+    Rows are streamed with ``yield_per`` (a server-side cursor on Postgres), so
+    memory use stays flat regardless of session size. Archived sessions are
+    exported from their blob and marked as not archived, since the blob does
+    not travel with the export.
+    """
+    query = select(SessionModel.session_id).order_by(SessionModel.created_at.asc())
+    if session_ids:
+        query = query.where(SessionModel.session_id.in_(session_ids))
+    if state is not None:
+        query = query.where(SessionModel.state == state)
+    ids = list(db.execute(query).scalars())
+
+    child_tables = [m for m in EXPORT_TABLES[2:] if include_artifacts or m is not LLMArtifact]
+    for session_id in ids:
+        session_row = mapping_to_dict(
+            db.execute(select(SessionModel.__table__).where(SessionModel.session_id == session_id)).mappings().one()
+        )
+        archived = session_row["archived_at"] is not None
+        session_row["archived_at"] = None
+        yield _line(SessionModel.__tablename__, session_row)
+
+        tab1 = db.execute(select(Tab1Inputs.__table__).where(Tab1Inputs.session_id == session_id)).mappings().first()
+        if tab1 is not None:
+            yield _line(Tab1Inputs.__tablename__, mapping_to_dict(tab1))
+
+        archived_tables = read_archive(session_id) if archived else {}
+        for model in child_tables:
+            if archived and model in ARCHIVED_TABLES:
+                for row in archived_tables.get(model.__tablename__, []):
+                    yield _line(model.__tablename__, row)
+                continue
+            result = db.execute(
+                select(model.__table__)
+                .where(model.session_id == session_id)
+                .order_by(*_ORDER_BY.get(model, ()))
+                .execution_options(yield_per=batch_size)
+            )
+            for row in result.mappings():
+                yield _line(model.__tablename__, mapping_to_dict(row))
+
+
+def _copy_value(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, Enum):
+        # SQLAlchemy persists enum members by name.
+        return value.name
+    if isinstance(column.type, JSON):
+        from psycopg.types.json import Jsonb
+
+        return Jsonb(value)
+    return value
+
+
+def _insert_batch(db: Session, model, rows: list[dict]) -> None:
+    if db.get_bind().dialect.name == "postgresql":
+        columns = list(model.__table__.columns)
+        cursor = db.connection().connection.cursor()
+        try:
+            with cursor.copy(f"COPY {model.__tablename__} ({', '.join(c.name for c in columns)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row([_copy_value(c, row.get(c.key)) for c in columns])
+        finally:
+            cursor.close()
+        return
+    db.execute(insert(model.__table__), rows)
+
+
+def import_ndjson(db: Session, lines: Iterable[str], batch_size: int = 5000) -> dict[str, int]:
+    """Bulk-load lines produced by export_ndjson in one transaction; returns row counts per table.
+
+    Rows are buffered per table and written in batches (COPY on Postgres,
+    executemany elsewhere). Buffers are always flushed parents-first so foreign
+    keys hold.
+    """
+    buffers: dict[str, list[dict]] = {model.__tablename__: [] for model in EXPORT_TABLES}
+    counts = {name: 0 for name in buffers}
+
+    def flush() -> None:
+        for model in EXPORT_TABLES:
+            rows = buffers[model.__tablename__]
+            if rows:
+                _insert_batch(db, model, rows)
+                counts[model.__tablename__] += len(rows)
+                rows.clear()
+
+    imported_sessions: list[str] = []
+    pending = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        model = MODELS_BY_TABLE.get(record["table"])
+        if model is None:
+            raise ValueError(f"Unknown table in import: {record['table']}")
+        buffers[model.__tablename__].append(row_values(model, record["row"]))
+        if model is SessionModel:
+            imported_sessions.append(record["row"]["session_id"])
+        pending += 1
+        if pending >= batch_size:
+            flush()
+            pending = 0
+    flush()
+    # Core inserts skip the ORM listeners that maintain search_documents; build them per imported session.
+    for session_id in imported_sessions:
+        index_session(db, session_id)
+    db.commit()
+    return counts
+
+
+def main() -> None:
+    from .db import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Export or import sessions as NDJSON.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="write NDJSON to stdout")
+    export_cmd.add_argument("--session-id", action="append", dest="session_ids")
+    export_cmd.add_argument("--state", choices=[s.value for s in SessionState])
+    export_cmd.add_argument("--include-artifacts", action="store_true")
+    import_cmd = sub.add_parser("import", help="load NDJSON from a file or '-' for stdin")
+    import_cmd.add_argument("path")
+    import_cmd.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == "export":
+            state = SessionState(args.state) if args.state else None
+            for line in export_ndjson(db, args.session_ids, state, args.include_artifacts):
+                sys.stdout.write(line)
+            return
+        if args.path == "-":
+            counts = import_ndjson(db, sys.stdin, args.batch_size)
+        else:
+            with open(args.path, encoding="utf-8") as fh:
+                counts = import_ndjson(db, fh, args.batch_size)
+    print(json.dumps(counts), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
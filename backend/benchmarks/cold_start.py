@@ -0,0 +1,100 @@
+"""Measure worker cold start: importing app.main and running the startup hook.
+
+Target: importing app.main costs under 200 ms more than importing its
+third-party dependencies (FastAPI, SQLAlchemy, pydantic-settings, the DB
+driver), and the startup hook (schema version check) stays under 50 ms,
+whatever the number of tables. The old create_all hook issued a catalogue
+lookup per table on every worker boot.
+
+Those dependencies alone take most of a second to import on a small box, and
+the app cannot import less than them, so the import target is the app's own
+share on top of that floor.
+
+Run from backend/:  python benchmarks/cold_start.py [--runs 5]
+Uses DATABASE_URL if set, otherwise a temporary SQLite file.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+# What app.main cannot avoid importing: its frameworks and the driver create_engine loads for DATABASE_URL.
+DEPENDENCIES = (
+    "import os, fastapi.responses, pydantic_settings, sqlalchemy.orm; "
+    "from sqlalchemy import create_engine; create_engine(os.environ['DATABASE_URL'])"
+)
+
+
+def time_import(statement: str, env: dict) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(out.stdout.strip())
+
+
+def time_imports(runs: int, env: dict) -> tuple[list[float], list[float]]:
+    """Import times of the dependencies alone and of app.main, measured in alternation so drift hits both."""
+    dependencies, app_main = [], []
+    for _ in range(runs):
+        dependencies.append(time_import(DEPENDENCIES, env))
+        app_main.append(time_import("import app.main", env))
+    return dependencies, app_main
+
+
+def time_startup(runs: int) -> tuple[list[float], list[float]]:
+    sys.path.insert(0, str(BACKEND_DIR))
+    from app.db import Base, engine
+    from app.migrate import migrate, verify_schema
+
+    migrate(engine)
+    verify, create_all = [], []
+    for _ in range(runs):
+        engine.dispose()
+        t = time.perf_counter()
+        verify_schema(engine)
+        verify.append(time.perf_counter() - t)
+
+        engine.dispose()
+        t = time.perf_counter()
+        Base.metadata.create_all(bind=engine)
+        create_all.append(time.perf_counter() - t)
+    return verify, create_all
+
+
+def fmt(samples: list[float]) -> str:
+    return f"median {statistics.median(samples) * 1000:.1f} ms (min {min(samples) * 1000:.1f}, max {max(samples) * 1000:.1f})"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite+pysqlite:///{tempfile.mkdtemp()}/cold_start.db"
+    env = dict(os.environ)
+
+    dependencies, app_main = time_imports(args.runs, env)
+    print(f"import dependencies:    {fmt(dependencies)}")
+    print(f"import app.main:        {fmt(app_main)}")
+    print(f"  app.main's own share: {fmt([a - d for a, d in zip(app_main, dependencies)])}")
+    verify, create_all = time_startup(args.runs)
+    print(f"startup verify_schema:  {fmt(verify)}")
+    print(f"startup create_all:     {fmt(create_all)}  (previous behaviour)")
+
+
+if __name__ == "__main__":
+    main()
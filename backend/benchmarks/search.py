@@ -0,0 +1,99 @@
+"""Measure GET /session/{id}/search on a session with 100k events.
+
+Seeds one session (plus a few smaller ones sharing the vocabulary), builds its
+search documents and times one page of ranked results for rare, common and
+multi-word queries. Target: a page in single-digit milliseconds.
+
+Run from backend/:  python benchmarks/search.py [--events 100000] [--runs 20]
+Uses DATABASE_URL if set (Postgres needs migration 008), otherwise a temporary SQLite file.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+VOCABULARY = (
+    "lighthouse harbor storm lantern compass anchor tide gull keeper ship rope sail reef fog bell "
+    "captain map island cove wreck signal beacon shore wave cliff rain night dawn letter secret"
+).split()
+
+
+def seed(db, session_id: str, events: int, rng: random.Random) -> None:
+    from sqlalchemy import insert
+
+    from app.models import Event, EventRole, Session as SessionModel, SessionState
+    from app.search import index_session
+
+    db.add(SessionModel(session_id=session_id, state=SessionState.ACTIVE, prompt_index=events // 2))
+    db.flush()
+    start = datetime(2024, 1, 1)
+    rows = [
+        {
+            "event_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "prompt_index": i // 2 + 1,
+            "role": EventRole.USER.name if i % 2 == 0 else EventRole.AGENT.name,
+            "agent_slot": None if i % 2 == 0 else 1,
+            "text": " ".join(rng.choices(VOCABULARY, k=24)) + (" zephyr" if i % 5000 == 0 else ""),
+            "created_at": start + timedelta(seconds=i),
+        }
+        for i in range(events)
+    ]
+    for offset in range(0, len(rows), 10_000):
+        db.execute(insert(Event.__table__), rows[offset : offset + 10_000])
+    index_session(db, session_id)
+    db.commit()
+
+
+def fmt(samples: list[float]) -> str:
+    return f"median {statistics.median(samples) * 1000:.2f} ms (max {max(samples) * 1000:.2f})"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite+pysqlite:///{tempfile.mkdtemp()}/search.db")
+    sys.path.insert(0, str(BACKEND_DIR))
+    from app.db import SessionLocal, engine
+    from app.migrate import migrate
+    from app.services import search_session
+
+    migrate(engine)
+    rng = random.Random(7)
+    session_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        t = time.perf_counter()
+        seed(db, session_id, args.events, rng)
+        for _ in range(3):
+            seed(db, str(uuid.uuid4()), args.events // 10, rng)
+        print(f"seeded {args.events} events + 3 x {args.events // 10} in {time.perf_counter() - t:.1f}s ({engine.dialect.name})")
+
+    for label, terms, offset in (
+        ("rare word", "zephyr", 0),
+        ("common word", "lighthouse", 0),
+        ("two words", "storm lantern", 0),
+        ("common word, page 50", "lighthouse", 1000),
+    ):
+        samples = []
+        with SessionLocal() as db:
+            for _ in range(args.runs):
+                t = time.perf_counter()
+                hits, _ = search_session(db, session_id, terms, 20, offset)
+                samples.append(time.perf_counter() - t)
+        print(f"{label:<22} {len(hits):>3} hits  {fmt(samples)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Measure GET /session/{id} serialization on a 10k-event session.
+
+Compares the previous path (ORM rows -> SessionDetailResponse validation ->
+JSONResponse) with the current one (column projections -> plain dicts ->
+ORJSONResponse). Both start from the same database and produce the same JSON.
+
+Run from backend/:  python benchmarks/serialization.py [--events 10000] [--runs 5]
+Uses a temporary SQLite file.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def seed(db, events: int) -> str:
+    from app.models import Event, EventRole, MemoryBlock, MemoryBlockType, Session as SessionModel, SessionState, Tab1Inputs
+
+    session = SessionModel(state=SessionState.ACTIVE, prompt_index=events // 2, tab1_locked=True, agent_names={"1": "Agent Red"})
+    db.add(session)
+    db.flush()
+    db.add(Tab1Inputs(session_id=session.session_id, world_text="w", chapter_text="c", agent_identity_text_by_slot={"1": "x"}))
+    start = datetime(2024, 1, 1)
+    db.add_all(
+        Event(
+            session_id=session.session_id,
+            prompt_index=i // 2 + 1,
+            role=EventRole.USER if i % 2 == 0 else EventRole.AGENT,
+            agent_slot=None if i % 2 == 0 else 1,
+            text=f"turn {i} " + "lorem ipsum dolor sit amet " * 8,
+            created_at=start + timedelta(seconds=i),
+        )
+        for i in range(events)
+    )
+    db.add_all(
+        MemoryBlock(
+            session_id=session.session_id,
+            type=MemoryBlockType.TURN_DELTA,
+            from_prompt_index=p,
+            to_prompt_index=p + 6,
+            json_payload={"summary": f"summary {p}", "event_count": 14},
+            created_at=start + timedelta(seconds=p),
+        )
+        for p in range(1, events // 2, 7)
+    )
+    db.commit()
+    return session.session_id
+
+
+def previous_path(db, session_id: str) -> bytes:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from app import queries
+    from app.eventstore import load_events
+    from app.schemas import NarrativeBuildResponse, SessionDetailResponse, SessionSummary, Tab1InputResponse
+    from app.services import get_session_or_404, get_tab1_or_create
+
+    session = get_session_or_404(db, session_id)
+    tab1 = get_tab1_or_create(db, session_id)
+    body = SessionDetailResponse(
+        session=SessionSummary(
+            session_id=session.session_id,
+            state=session.state,
+            prompt_index=session.prompt_index,
+            last_summarized_prompt_index=session.last_summarized_prompt_index,
+            tab1_locked=session.tab1_locked,
+        ),
+        tab1=Tab1InputResponse(
+            world_text=tab1.world_text,
+            chapter_text=tab1.chapter_text,
+            selected_agent_slots=session.selected_agent_slots,
+            agent_names={int(k): v for k, v in session.agent_names.items()},
+            agent_identity_text_by_slot={int(k): v for k, v in tab1.agent_identity_text_by_slot.items()},
+            tab1_locked=session.tab1_locked,
+        ),
+        events=load_events(db, session_id),
+        memory_blocks=db.execute(queries.session_memory_blocks(session_id)).scalars().all(),
+        narrative_drafts=[
+            NarrativeBuildResponse(draft_id=d.draft_id, chapter_text=d.chapter_text)
+            for d in db.execute(queries.session_drafts(session_id)).scalars().all()
+        ],
+    )
+    # FastAPI validated the returned model against response_model a second time before encoding.
+    validated = SessionDetailResponse.model_validate(body.model_dump())
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def current_path(db, session_id: str) -> bytes:
+    from fastapi.responses import ORJSONResponse
+
+    from app import serializers
+    from app.services import get_session_detail
+
+    return ORJSONResponse(serializers.session_detail_view(get_session_detail(db, session_id))).body
+
+
+def timed(fn, runs: int, make_db, session_id: str) -> tuple[list[float], bytes]:
+    samples, body = [], b""
+    for _ in range(runs):
+        with make_db() as db:
+            t = time.perf_counter()
+            body = fn(db, session_id)
+            samples.append(time.perf_counter() - t)
+    return samples, body
+
+
+def fmt(samples: list[float]) -> str:
+    return f"median {statistics.median(samples) * 1000:.1f} ms (min {min(samples) * 1000:.1f}, max {max(samples) * 1000:.1f})"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite+pysqlite:///{tempfile.mkdtemp()}/serialization.db"
+    sys.path.insert(0, str(BACKEND_DIR))
+    import json
+
+    from app.db import SessionLocal, engine
+    from app.migrate import migrate
+
+    migrate(engine)
+    with SessionLocal() as db:
+        session_id = seed(db, args.events)
+
+    previous, previous_body = timed(previous_path, args.runs, SessionLocal, session_id)
+    current, current_body = timed(current_path, args.runs, SessionLocal, session_id)
+    assert json.loads(previous_body) == json.loads(current_body), "paths produced different JSON"
+
+    print(f"events: {args.events}, body: {len(current_body) / 1024:.0f} KiB")
+    print(f"ORM + pydantic + JSONResponse:   {fmt(previous)}  (previous behaviour)")
+    print(f"projection + ORJSONResponse:     {fmt(current)}")
+    print(f"speedup: {statistics.median(previous) / statistics.median(current):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Measure concurrent turn throughput on SQLite, tuned mode against pysqlite defaults.
+
+Each mode runs in a fresh process on a fresh database file: --writers threads
+play turns (prompt_agent with a model call simulated by --llm-ms of sleep) on
+their own sessions while --readers threads load session detail in a loop.
+Reports turns/s, reads/s and requests that failed (e.g. "database is locked").
+
+Run from backend/:  python benchmarks/sqlite_throughput.py [--writers 16] [--readers 4] [--turns 40] [--llm-ms 20]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def run_worker(args) -> dict:
+    sys.path.insert(0, str(BACKEND_DIR))
+    from app.db import SessionLocal, engine
+    from app.llm import MockLLMProvider, use_provider
+    from app.migrate import migrate
+    from app.services import create_session, get_session_detail, lock_tab1, prompt_agent, save_tab1
+
+    class SleepingProvider(MockLLMProvider):
+        def generate(self, agent_id: str, model: str, payload: dict) -> str:
+            time.sleep(args.llm_ms / 1000)
+            return super().generate(agent_id, model, payload)
+
+    migrate(engine)
+    with SessionLocal() as db:
+        session_ids = [create_session(db).session_id for _ in range(args.writers)]
+        for session_id in session_ids:
+            save_tab1(db, session_id, {"selected_agent_slots": [1]})
+            lock_tab1(db, session_id)
+
+    errors = {"writes": 0, "reads": 0}
+    counts = {"turns": 0, "reads": 0}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def play(session_id: str) -> None:
+        with use_provider(SleepingProvider()):
+            for i in range(args.turns):
+                try:
+                    with SessionLocal() as db:
+                        prompt_agent(db, session_id, 1, f"turn {i} " + "lorem ipsum " * 20)
+                    with lock:
+                        counts["turns"] += 1
+                except Exception:
+                    with lock:
+                        errors["writes"] += 1
+
+    def read(n: int) -> None:
+        while not done.is_set():
+            try:
+                with SessionLocal() as db:
+                    get_session_detail(db, session_ids[n % len(session_ids)])
+                with lock:
+                    counts["reads"] += 1
+            except Exception:
+                with lock:
+                    errors["reads"] += 1
+            n += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.writers + args.readers) as pool:
+        readers = [pool.submit(read, n) for n in range(args.readers)]
+        list(pool.map(play, session_ids))
+        elapsed = time.perf_counter() - started
+        done.set()
+        for future in readers:
+            future.result()
+    return {
+        "turns_per_s": counts["turns"] / elapsed,
+        "reads_per_s": counts["reads"] / elapsed,
+        "failed_writes": errors["writes"],
+        "failed_reads": errors["reads"],
+    }
+
+
+def run_mode(tuned: bool, args) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite+pysqlite:///{tempfile.mkdtemp()}/throughput.db"
+    env["SQLITE_TUNED"] = "true" if tuned else "false"
+    out = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--worker",
+            f"--writers={args.writers}",
+            f"--readers={args.readers}",
+            f"--turns={args.turns}",
+            f"--llm-ms={args.llm_ms}",
+        ],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def fmt(result: dict) -> str:
+    return (
+        f"{result['turns_per_s']:7.1f} turns/s  {result['reads_per_s']:7.1f} reads/s  "
+        f"failed: {result['failed_writes']} writes, {result['failed_reads']} reads"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--llm-ms", type=int, default=20)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+    print(f"{args.writers} writers x {args.turns} turns, {args.readers} readers, {args.llm_ms} ms per model call")
+    print(f"pysqlite defaults:  {fmt(run_mode(False, args))}  (SQLITE_TUNED=false, the default)")
+    print(f"SQLITE_TUNED=true:  {fmt(run_mode(True, args))}")
+
+
+if __name__ == "__main__":
+    main()
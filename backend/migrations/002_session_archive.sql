@@ -0,0 +1 @@
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP NULL;
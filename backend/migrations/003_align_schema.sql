@@ -0,0 +1,24 @@
+-- Databases created by the old create_all startup hook used native enum types and
+-- single-column indexes; bring them in line with 001_init.sql.
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_type WHERE typname = 'sessionstate') THEN
+    ALTER TABLE sessions ALTER COLUMN state TYPE VARCHAR(32) USING state::text;
+    DROP TYPE sessionstate;
+  END IF;
+  IF EXISTS (SELECT 1 FROM pg_type WHERE typname = 'eventrole') THEN
+    ALTER TABLE events ALTER COLUMN role TYPE VARCHAR(16) USING role::text;
+    DROP TYPE eventrole;
+  END IF;
+  IF EXISTS (SELECT 1 FROM pg_type WHERE typname = 'memoryblocktype') THEN
+    ALTER TABLE memory_blocks ALTER COLUMN type TYPE VARCHAR(32) USING type::text;
+    DROP TYPE memoryblocktype;
+  END IF;
+END $$;
+
+DROP INDEX IF EXISTS ix_events_session_id;
+DROP INDEX IF EXISTS ix_events_prompt_index;
+DROP INDEX IF EXISTS ix_events_created_at;
+DROP INDEX IF EXISTS ix_memory_blocks_session_id;
+DROP INDEX IF EXISTS ix_narrative_drafts_session_id;
+DROP INDEX IF EXISTS ix_llm_artifacts_session_id;
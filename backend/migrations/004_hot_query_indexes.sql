@@ -0,0 +1,6 @@
+-- Composite indexes so every query in app/queries.py is served in index order
+-- (no seq scan, no sort).
+CREATE INDEX IF NOT EXISTS idx_narrative_drafts_session_created ON narrative_drafts(session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_artifacts_session_created ON llm_artifacts(session_id, created_at);
+-- Partial: with archived_at in the key, "archived_at IS NULL" would still leave a sort on updated_at.
+CREATE INDEX IF NOT EXISTS idx_sessions_unarchived_state_updated ON sessions(state, updated_at) WHERE archived_at IS NULL;
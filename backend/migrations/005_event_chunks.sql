@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS event_chunks (
+  chunk_id VARCHAR(36) PRIMARY KEY,
+  session_id VARCHAR(36) NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+  from_prompt_index INTEGER NOT NULL,
+  to_prompt_index INTEGER NOT NULL,
+  event_count INTEGER NOT NULL,
+  payload BYTEA NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+-- Unique so that two compactions racing on one session cannot both pack a range.
+CREATE UNIQUE INDEX IF NOT EXISTS idx_event_chunks_session_range ON event_chunks(session_id, from_prompt_index, to_prompt_index);
@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS summary_jobs (
+  job_id VARCHAR(36) PRIMARY KEY,
+  session_id VARCHAR(36) NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+  agent_id VARCHAR(32) NOT NULL,
+  model VARCHAR(128) NOT NULL,
+  payload JSONB NOT NULL,
+  status VARCHAR(16) NOT NULL,
+  batch_id VARCHAR(128) NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_summary_jobs_status_created ON summary_jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_summary_jobs_session_created ON summary_jobs(session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_summary_jobs_batch ON summary_jobs(batch_id);
@@ -0,0 +1 @@
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS unsummarized_chars INTEGER NOT NULL DEFAULT 0;
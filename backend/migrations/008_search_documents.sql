@@ -0,0 +1,15 @@
+-- btree_gin lets one GIN index serve "session_id = ? AND tsv @@ ?" (trusted extension since Postgres 13).
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+CREATE TABLE IF NOT EXISTS search_documents (
+  doc_id BIGSERIAL PRIMARY KEY,
+  session_id VARCHAR(36) NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+  kind VARCHAR(16) NOT NULL,
+  source_id VARCHAR(36) NOT NULL,
+  prompt_index INTEGER NOT NULL,
+  text TEXT NOT NULL,
+  created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+  tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', text)) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_search_documents_session_prompt ON search_documents(session_id, prompt_index);
+CREATE INDEX IF NOT EXISTS idx_search_documents_session_tsv ON search_documents USING GIN (session_id, tsv);
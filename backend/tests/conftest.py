@@ -0,0 +1,55 @@
+import os
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+# A throwaway SQLite file, so runs never leave a database in the working tree. Set
+# TEST_DATABASE_URL to a scratch Postgres database to run the suite on the migrated schema.
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or (
+    f"sqlite+pysqlite:///{tempfile.mkdtemp(prefix='story_engine_test_')}/test_story_engine.db"
+)
+os.environ["DB_AUTO_MIGRATE"] = "true"
+# The concurrency tests rely on SELECT ... FOR UPDATE excluding other writers, which SQLite only gets in tuned mode.
+os.environ["SQLITE_TUNED"] = "true"
+
+from app import main as main_module  # noqa: E402
+from app.db import Base, engine  # noqa: E402
+from app.migrate import migrate  # noqa: E402
+
+
+def empty_database() -> None:
+    """SQLite: rebuild the ORM schema. Postgres: keep the migrated schema and truncate every table."""
+    if engine.dialect.name == "sqlite":
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        return
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables if table.name != "schema_migrations")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_schema():
+    if engine.dialect.name != "sqlite":
+        migrate(engine)
+
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    empty_database()
+    yield
+    if engine.dialect.name == "sqlite":
+        Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture()
+def empty_db():
+    """Call it to empty the database mid-test, e.g. before importing sessions into a fresh one."""
+    return empty_database
+
+
+@pytest.fixture()
+def client():
+    with TestClient(main_module.app) as c:
+        yield c
@@ -0,0 +1,103 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main as main_module
+from app.admission import AdmissionController, AdmissionMiddleware, _client_id, parse_networks
+
+# httpx.ASGITransport connects as 127.0.0.1, standing in for the load balancer.
+LOAD_BALANCER = ["127.0.0.1"]
+
+
+def _blocking_app(release: asyncio.Event):
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    return app
+
+
+async def _post(client: httpx.AsyncClient, session_id: str, client_ip: str = "10.0.0.1") -> httpx.Response:
+    return await client.post(f"/session/{session_id}/prompt", headers={"x-forwarded-for": client_ip})
+
+
+def test_session_and_client_caps_reject_with_429():
+    async def scenario():
+        release = asyncio.Event()
+        controller = AdmissionController(max_concurrent=10, max_per_session=1, max_per_client=2)
+        transport = httpx.ASGITransport(app=AdmissionMiddleware(_blocking_app(release), controller, LOAD_BALANCER))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.create_task(_post(client, "s1"))
+            second = asyncio.create_task(_post(client, "s2"))
+            await asyncio.sleep(0.05)
+            same_session = await _post(client, "s1", client_ip="10.0.0.2")
+            same_client = await _post(client, "s3")
+            release.set()
+            return await first, await second, same_session, same_client, controller.snapshot()
+
+    first, second, same_session, same_client, snapshot = asyncio.run(scenario())
+    assert first.status_code == second.status_code == 200
+    assert same_session.status_code == same_client.status_code == 429
+    assert int(same_session.headers["retry-after"]) >= 1
+    assert snapshot["in_flight"] == 0
+
+
+def test_bounded_queue_times_out_and_sheds_with_503():
+    async def scenario():
+        release = asyncio.Event()
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.2, initial_latency=0.01)
+        transport = httpx.ASGITransport(app=AdmissionMiddleware(_blocking_app(release), controller, LOAD_BALANCER))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            running = asyncio.create_task(_post(client, "s1", "10.0.0.1"))
+            await asyncio.sleep(0.05)
+            queued = asyncio.create_task(_post(client, "s2", "10.0.0.2"))
+            await asyncio.sleep(0.05)
+            queue_full = await _post(client, "s3", "10.0.0.3")
+            timed_out = await queued
+            release.set()
+            return await running, queue_full, timed_out, await _post(client, "s4"), controller.snapshot()
+
+    running, queue_full, timed_out, after, snapshot = asyncio.run(scenario())
+    assert running.status_code == 200
+    assert queue_full.status_code == 503
+    assert timed_out.status_code == 503
+    assert "retry-after" in timed_out.headers
+    assert after.status_code == 200
+    assert snapshot == {**snapshot, "in_flight": 0, "queued": 0}
+
+
+def test_only_llm_bound_posts_are_admission_controlled():
+    controller = AdmissionController(max_per_session=0)
+
+    async def scenario():
+        release = asyncio.Event()
+        release.set()
+        transport = httpx.ASGITransport(app=AdmissionMiddleware(_blocking_app(release), controller))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/session/s1/prompt"), await client.get("/session/s1"), await client.put("/session/s1/tab1")
+
+    prompt, detail, tab1 = asyncio.run(scenario())
+    assert prompt.status_code == 429
+    assert detail.status_code == tab1.status_code == 200
+
+
+def test_forwarded_for_is_only_believed_from_trusted_proxies():
+    def scope(peer: str, *forwarded: str) -> dict:
+        return {"client": (peer, 1234), "headers": [(b"x-forwarded-for", value.encode()) for value in forwarded]}
+
+    trusted = parse_networks(["10.0.0.0/8", "192.168.1.5"])
+    assert _client_id(scope("203.0.113.9", "1.2.3.4"), trusted) == "203.0.113.9"
+    assert _client_id(scope("10.1.1.1", "1.2.3.4"), trusted) == "1.2.3.4"
+    # A client-supplied first hop does not win over the address the trusted proxy saw.
+    assert _client_id(scope("10.1.1.1", "6.6.6.6, 5.6.7.8", "192.168.1.5"), trusted) == "5.6.7.8"
+    assert _client_id(scope("10.1.1.1"), trusted) == "10.1.1.1"
+
+
+def test_refusals_carry_cors_headers(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(main_module.admission_controller, "max_per_session", 0)
+    resp = client.post("/session/s1/prompt", json={}, headers={"origin": "http://frontend.test"})
+    assert resp.status_code == 429
+    assert "access-control-allow-origin" in resp.headers
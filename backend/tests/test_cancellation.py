@@ -0,0 +1,264 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main as main_module
+from app import metrics
+from app.config import settings
+from app.llm import (
+    GenerationCancelled,
+    LLMProvider,
+    MockLLMProvider,
+    OpenAIProvider,
+    cancel_on,
+    generate,
+    raise_if_cancelled,
+    use_provider,
+)
+
+
+class StreamingProvider(LLMProvider):
+    """Stands in for a streamed upstream call: checks for cancellation between chunks."""
+
+    provider_name = "streaming"
+
+    def __init__(self, chunks: int = 200):
+        self.chunks = chunks
+        self.calls = 0
+        self.started = threading.Event()
+
+    def generate(self, agent_id: str, model: str, payload: dict) -> str:
+        if agent_id != "agent_character":
+            return MockLLMProvider().generate(agent_id, model, payload)
+        self.calls += 1
+        self.started.set()
+        for _ in range(self.chunks):
+            raise_if_cancelled()
+            time.sleep(0.01)
+        return "finished"
+
+
+async def post_then_disconnect(path: str, body: dict, disconnect_when: threading.Event, app=None) -> int | None:
+    """POST through the ASGI app, with the client going away once ``disconnect_when`` is set."""
+    sent = False
+    statuses = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}
+        while not disconnect_when.is_set():
+            await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 5000),
+        "server": ("testserver", 80),
+    }
+    await (app or main_module.app)(scope, receive, send)
+    return statuses[0] if statuses else None
+
+
+def test_disconnect_cancels_generation_and_rolls_back_the_prompt(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "disconnect_poll_seconds", 0.02)
+    session_id = client.post("/session").json()["session_id"]
+    client.put(f"/session/{session_id}/tab1", json={"selected_agent_slots": [1]})
+    client.post(f"/session/{session_id}/lock")
+    client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "first"})
+    metrics.reset()
+
+    provider = StreamingProvider()
+    started = time.monotonic()
+    with use_provider(provider):
+        status = asyncio.run(
+            post_then_disconnect(f"/session/{session_id}/prompt", {"agent_slot": 1, "user_text": "second"}, provider.started)
+        )
+    assert status == main_module.CLIENT_CLOSED_REQUEST
+    assert time.monotonic() - started < 1.0
+    assert metrics.snapshot()["counters"]["cancelled.prompt"] == 1
+
+    detail = client.get(f"/session/{session_id}").json()
+    assert detail["session"]["prompt_index"] == 1
+    assert [e["text"] for e in detail["events"] if e["role"] == "user"] == ["first"]
+    assert len(client.get(f"/session/{session_id}/search", params={"q": "second"}).json()["results"]) == 0
+
+    response = client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "second"})
+    assert response.status_code == 200
+    assert response.json()["session"]["prompt_index"] == 2
+
+
+class ServerTransport(httpx.AsyncBaseTransport):
+    """Serves an ASGI app like a real server: the app sees http.disconnect once the caller drops the connection."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        closed = asyncio.Event()
+        sent = False
+        start: dict = {}
+        chunks: list[bytes] = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await closed.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "scheme": request.url.scheme,
+            "path": request.url.path,
+            "raw_path": request.url.raw_path,
+            "query_string": request.url.query,
+            "headers": [(k.lower(), v) for k, v in request.headers.raw],
+            "client": ("10.0.0.1", 5000),
+            "server": (request.url.host, request.url.port or 80),
+        }
+        app_task = asyncio.ensure_future(self.app(scope, receive, send))
+        try:
+            await asyncio.shield(app_task)
+        except asyncio.CancelledError:
+            closed.set()
+            await app_task
+            raise
+        return httpx.Response(start["status"], headers=start["headers"], content=b"".join(chunks))
+
+
+def test_disconnect_cancels_generation_on_the_owner_node(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    from app.sharding import Membership, ShardRouterMiddleware
+
+    monkeypatch.setattr(settings, "disconnect_poll_seconds", 0.02)
+    session_id = client.post("/session").json()["session_id"]
+    client.put(f"/session/{session_id}/tab1", json={"selected_agent_slots": [1]})
+    client.post(f"/session/{session_id}/lock")
+    client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "first"})
+    metrics.reset()
+
+    node_a = ShardRouterMiddleware(
+        main_module.app, Membership("http://a", nodes=["http://b"]), transport=ServerTransport(main_module.app)
+    )
+    provider = StreamingProvider()
+    started = time.monotonic()
+    with use_provider(provider):
+        status = asyncio.run(
+            post_then_disconnect(
+                f"/session/{session_id}/prompt", {"agent_slot": 1, "user_text": "second"}, provider.started, app=node_a
+            )
+        )
+    assert status is None
+    assert time.monotonic() - started < 1.0
+    counters = metrics.snapshot()["counters"]
+    assert counters["shard.forward_cancelled"] == 1
+    assert counters["cancelled.prompt"] == 1
+
+    detail = client.get(f"/session/{session_id}").json()
+    assert detail["session"]["prompt_index"] == 1
+    assert [e["text"] for e in detail["events"] if e["role"] == "user"] == ["first"]
+
+
+def test_cancelled_leader_does_not_fail_coalesced_followers():
+    metrics.reset()
+    provider = StreamingProvider(chunks=500)
+    cancel = threading.Event()
+    payload = {"agent_identity": {"slot": 1}}
+    results: dict[str, object] = {}
+
+    def leader():
+        with cancel_on(cancel):
+            try:
+                generate(provider, "agent_character", "gpt-4o-mini", payload)
+            except GenerationCancelled as e:
+                results["leader"] = e
+
+    def follower():
+        results["follower"] = generate(provider, "agent_character", "gpt-4o-mini", payload)
+
+    threads = [threading.Thread(target=leader), threading.Thread(target=follower)]
+    threads[0].start()
+    assert provider.started.wait(timeout=5)
+    threads[1].start()
+    deadline = time.monotonic() + 5
+    while metrics.snapshot()["counters"].get("llm.singleflight.shared", 0) < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    provider.chunks = 1
+    cancel.set()
+    for t in threads:
+        t.join(timeout=10)
+
+    assert isinstance(results["leader"], GenerationCancelled)
+    assert results["follower"] == "finished"
+    assert provider.calls == 2
+
+
+def test_streamed_completion_stops_reading_once_cancelled():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert json.loads(request.content)["stream"] is True
+        lines = [f'data: {{"choices": [{{"delta": {{"content": "w{i} "}}}}]}}' for i in range(3)]
+        lines += ['data: {"choices": [], "usage": {"prompt_tokens": 12}}', "data: [DONE]"]
+        return httpx.Response(200, content="\n\n".join(lines).encode())
+
+    provider = OpenAIProvider("k", "http://llm")
+    with httpx.Client(transport=httpx.MockTransport(handler)) as client, cancel_on(threading.Event()) as cancel:
+        assert provider._stream_completion(client, "http://llm/chat/completions", {}, {"model": "m"}) == "w0 w1 w2"
+        cancel.set()
+        with pytest.raises(GenerationCancelled):
+            provider._stream_completion(client, "http://llm/chat/completions", {}, {"model": "m"})
+    assert metrics.snapshot()["counters"]["llm.cancelled_upstream"] >= 1
+
+
+def test_streamed_completion_stops_waiting_on_a_stalled_upstream(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "disconnect_poll_seconds", 0.02)
+    server = socket.create_server(("127.0.0.1", 0))
+    port = server.getsockname()[1]
+
+    def stall_after_first_chunk():
+        conn, _ = server.accept()
+        conn.recv(65536)
+        line = b'data: {"choices": [{"delta": {"content": "w0"}}]}\n\n'
+        conn.sendall(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ntransfer-encoding: chunked\r\n\r\n")
+        conn.sendall(b"%x\r\n%s\r\n" % (len(line), line))
+        time.sleep(5)
+        conn.close()
+
+    threading.Thread(target=stall_after_first_chunk, daemon=True).start()
+    provider = OpenAIProvider("k", f"http://127.0.0.1:{port}")
+    with httpx.Client(timeout=30.0) as client, cancel_on(threading.Event()) as cancel:
+        threading.Timer(0.2, cancel.set).start()
+        started = time.monotonic()
+        with pytest.raises(GenerationCancelled):
+            provider._stream_completion(client, f"http://127.0.0.1:{port}/chat/completions", {}, {"model": "m"})
+    assert time.monotonic() - started < 2.0
+    server.close()
@@ -0,0 +1,215 @@
+import threading
+import time
+
+import httpx
+import pytest
+from sqlalchemy.orm import Session
+
+from app import metrics
+from app.llm import LLMProvider, MockLLMProvider, RoutedOpenAIProvider, chat_messages, generate, log_artifact, prompt_renderer
+from app.prompts import PromptRenderer
+from app.routing import Endpoint, EndpointPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_pool(strategy: str = "ewma") -> tuple[EndpointPool, FakeClock]:
+    clock = FakeClock()
+    endpoints = [
+        Endpoint(name="local", base_url="http://local", api_key="k", models={"agent_character": "llama-3-8b"}),
+        Endpoint(name="hosted", base_url="http://hosted", api_key="k"),
+    ]
+    return EndpointPool(endpoints, strategy=strategy, cooldown_seconds=10.0, clock=clock), clock
+
+
+def test_pool_prefers_lower_ewma_latency():
+    pool, clock = make_pool()
+    local, hosted = pool.endpoints
+
+    started = pool.acquire(local)
+    clock.now += 2.0
+    pool.release(local, started, ok=True)
+
+    started = pool.acquire(hosted)
+    clock.now += 0.5
+    pool.release(hosted, started, ok=True)
+
+    assert [e.name for e in pool.ranked()] == ["hosted", "local"]
+
+
+def test_pool_least_outstanding_respects_weight():
+    pool, _ = make_pool("least_outstanding")
+    local, hosted = pool.endpoints
+    local.weight = 4.0
+    pool.acquire(local)
+    pool.acquire(local)
+
+    assert pool.ranked()[0].name == "local"
+    pool.acquire(local)
+    pool.acquire(local)
+    assert pool.ranked()[0].name == "hosted"
+
+
+def test_routed_provider_fails_over_and_cools_down(monkeypatch: pytest.MonkeyPatch):
+    pool, clock = make_pool()
+    provider = RoutedOpenAIProvider(pool)
+    calls = []
+
+    def fake_completion(base_url, api_key, model, messages):
+        calls.append((base_url, model))
+        if base_url == "http://local":
+            raise httpx.ConnectError("connection refused")
+        return "ok"
+
+    monkeypatch.setattr(provider, "_chat_completion", fake_completion)
+
+    assert provider.generate("agent_character", "gpt-4o-mini", {"user_prompt": "hi"}) == "ok"
+    assert calls == [("http://local", "llama-3-8b"), ("http://hosted", "gpt-4o-mini")]
+    assert [e.name for e in pool.ranked()] == ["hosted", "local"]
+
+    clock.now += 11.0
+    assert {s["name"]: s["healthy"] for s in pool.snapshot()} == {"local": True, "hosted": True}
+
+
+def test_routed_provider_does_not_fail_over_on_bad_request(monkeypatch: pytest.MonkeyPatch):
+    pool, _ = make_pool()
+    provider = RoutedOpenAIProvider(pool)
+    request = httpx.Request("POST", "http://local/chat/completions")
+
+    def fake_completion(base_url, api_key, model, messages):
+        raise httpx.HTTPStatusError("bad request", request=request, response=httpx.Response(400, request=request))
+
+    monkeypatch.setattr(provider, "_chat_completion", fake_completion)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        provider.generate("agent8", "gpt-4o-mini", {})
+    assert all(s["healthy"] for s in pool.snapshot())
+
+
+class BlockingProvider(LLMProvider):
+    provider_name = "blocking"
+
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def generate(self, agent_id: str, model: str, payload: dict) -> str:
+        self.calls += 1
+        self.started.set()
+        self.release.wait(timeout=5)
+        return f"summary {self.calls}"
+
+
+def test_identical_inflight_requests_share_one_generation():
+    metrics.reset()
+    provider = BlockingProvider()
+    payload = {"from_prompt_index": 1, "to_prompt_index": 7, "events": []}
+    results = []
+
+    def call():
+        results.append(generate(provider, "agent8", "gpt-4o-mini", payload))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    assert provider.started.wait(timeout=5)
+    followers = [threading.Thread(target=call) for _ in range(3)]
+    for t in followers:
+        t.start()
+    deadline = time.monotonic() + 5
+    while metrics.snapshot()["counters"].get("llm.singleflight.shared", 0) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    provider.release.set()
+    for t in [leader, *followers]:
+        t.join(timeout=5)
+
+    assert provider.calls == 1
+    assert results == ["summary 1"] * 4
+
+    assert generate(provider, "agent8", "gpt-4o-mini", payload) == "summary 2"
+
+
+def test_followers_of_a_failed_call_get_their_own_exception():
+    provider = BlockingProvider()
+    payload = {"from_prompt_index": 1, "to_prompt_index": 7, "events": []}
+    request = httpx.Request("POST", "http://hosted/chat/completions")
+
+    def fail(agent_id: str, model: str, payload: dict) -> str:
+        provider.started.set()
+        provider.release.wait(timeout=5)
+        raise httpx.HTTPStatusError("upstream 500", request=request, response=httpx.Response(500, request=request))
+
+    provider.generate = fail
+    errors = []
+
+    def call():
+        try:
+            generate(provider, "agent8", "gpt-4o-mini", payload)
+        except httpx.HTTPStatusError as e:
+            errors.append(e)
+
+    metrics.reset()
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    threads[0].start()
+    assert provider.started.wait(timeout=5)
+    for t in threads[1:]:
+        t.start()
+    deadline = time.monotonic() + 5
+    while metrics.snapshot()["counters"].get("llm.singleflight.shared", 0) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    provider.release.set()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert len(errors) == 3 and len({id(e) for e in errors}) == 3
+    (leader_error,) = [e for e in errors if e.__cause__ is None]
+    assert all(e.__cause__ is leader_error and e.response.status_code == 500 for e in errors if e is not leader_error)
+
+
+def character_payload(prompt_index: int, memory: list[dict], memory_version: str) -> dict:
+    return {
+        "agent_identity": {"slot": 1, "name": "Agent Red", "identity_text": "Warrior", "all_agent_names": {"1": "Agent Red"}},
+        "structured_memory": memory,
+        "recent_context": [{"prompt_index": prompt_index - 1, "role": "user", "agent_slot": None, "agent_name": None, "text": "hello"}],
+        "user_prompt": f"turn {prompt_index}",
+        "meta": {"session_id": "s1", "prompt_index": prompt_index, "memory_version": memory_version},
+    }
+
+
+def test_prompt_renderer_keeps_static_prefix_stable_across_turns():
+    renderer = PromptRenderer()
+    lock = {"type": "world_chapter_lock", "from_prompt_index": 0, "to_prompt_index": 0, "json_payload": {"summary": "World"}}
+    delta = {"type": "turn_delta", "from_prompt_index": 1, "to_prompt_index": 7, "json_payload": {"summary": "Delta"}}
+
+    first = renderer.render("agent_character", character_payload(2, [lock], "b1:1"))
+    second = renderer.render("agent_character", character_payload(3, [lock], "b1:1"))
+    assert first.user[: first.cacheable_prefix_chars - len(first.system)] == second.user[: second.cacheable_prefix_chars - len(second.system)]
+    assert "[User Prompt]\nturn 3" in second.user
+    assert renderer.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+    grown = renderer.render("agent_character", character_payload(8, [delta, lock], "b1:2"))
+    old_static = first.user[: first.cacheable_prefix_chars - len(first.system)]
+    assert grown.user.startswith(old_static.rstrip("\n"))
+    assert grown.cacheable_prefix_chars > first.cacheable_prefix_chars
+
+
+def test_only_prompts_sent_upstream_count_towards_cache_metrics():
+    payload = character_payload(2, [], "b1:1")
+    metrics.reset()
+    before = prompt_renderer.stats()
+    output = generate(MockLLMProvider(), "agent_character", "gpt-4o-mini", payload)
+    with Session() as db:
+        log_artifact(db, "s1", "agent_character", "gpt-4o-mini", payload, output, "mock")
+    assert prompt_renderer.stats() == before
+    assert "llm.cacheable_prefix_chars" not in metrics.snapshot()["counters"]
+
+    system, user = chat_messages("agent_character", payload)
+    counters = metrics.snapshot()["counters"]
+    assert counters["llm.prompt_chars"] == len(system["content"]) + len(user["content"])
+    assert len(system["content"]) < counters["llm.cacheable_prefix_chars"] < counters["llm.prompt_chars"]
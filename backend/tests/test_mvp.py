@@ -1,26 +1,20 @@
-﻿import os
+﻿import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import select, update
 
-os.environ["DATABASE_URL"] = "sqlite+pysqlite:///./test_story_engine.db"
-
-from app import main as main_module  # noqa: E402
-from app.db import Base, engine  # noqa: E402
-
-
-@pytest.fixture(autouse=True)
-def clean_db():
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
-    yield
-    Base.metadata.drop_all(bind=engine)
-
-
-@pytest.fixture()
-def client():
-    with TestClient(main_module.app) as c:
-        yield c
+from app import metrics, services
+from app.batching import CLAIM_TIMEOUT, LocalBatchClient, get_batch_client, run_batch_cycle
+from app.config import settings
+from app.db import SessionLocal
+from app.llm import MockLLMProvider
+from app.models import EventChunk, LLMArtifact, MemoryBlock, MemoryBlockType, SummaryJob, SummaryJobStatus
+from app.schemas import PromptResponse, SessionDetailResponse, Tab1InputResponse
 
 
 def create_and_lock_session(client: TestClient) -> str:
@@ -132,3 +126,286 @@ def test_state_transitions_match_spec(client: TestClient):
     assert detail2["session"]["prompt_index"] == 0
     assert detail2["events"] == []
     assert detail2["memory_blocks"] == []
+
+
+def test_character_payload_recalls_relevant_older_prompts(client: TestClient):
+    session_id = create_and_lock_session(client)
+    client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "A dragon named Vexmor circles the tower"})
+    for i in range(9):
+        client.post(f"/session/{session_id}/prompt", json={"agent_slot": 2, "user_text": f"filler {i}"})
+    client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "Where did Vexmor go?"})
+
+    with SessionLocal() as db:
+        artifact = db.execute(
+            select(LLMArtifact)
+            .where(LLMArtifact.session_id == session_id, LLMArtifact.agent_id == "agent_character")
+            .order_by(LLMArtifact.created_at.desc())
+        ).scalars().first()
+    payload = json.loads(artifact.raw_input_ref)
+
+    assert payload["meta"]["context_prompt_range"] == [4, 10]
+    recalled = payload["recalled_context"]
+    assert recalled[0]["prompt_index"] == 1
+    # Only transcript events are recalled; memory summaries are already in structured_memory.
+    assert payload["structured_memory"] and all(s["role"] in ("user", "agent") for s in recalled)
+    assert "Vexmor" in recalled[0]["text"]
+
+
+def test_speculative_payloads_are_used_until_memory_changes(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "speculative_payloads", True)
+    metrics.reset()
+    session_id = create_and_lock_session(client)
+
+    for i in range(8):
+        resp = client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1 + i % 2, "user_text": f"turn {i}"})
+        assert resp.status_code == 200
+    counters = metrics.snapshot()["counters"]
+    # The first turn had nothing precomputed; the summary after turn 7 is committed before the next precompute.
+    assert counters["speculative.miss"] == 1
+    assert counters["speculative.hit"] == 7
+
+    with SessionLocal() as db:
+        db.add(
+            MemoryBlock(
+                session_id=session_id,
+                type=MemoryBlockType.TURN_DELTA,
+                from_prompt_index=8,
+                to_prompt_index=8,
+                json_payload={"summary": "out of band"},
+            )
+        )
+        db.commit()
+    resp = client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "after change"})
+    assert resp.status_code == 200
+    assert metrics.snapshot()["counters"]["speculative.stale"] == 1
+    services._speculative_contexts.clear()
+
+
+def test_batched_summaries_are_written_by_worker_and_flushed_at_end(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "summary_batching", True)
+    monkeypatch.setattr(settings, "summary_batch_agents", ["agent0", "agent8"])
+    session_id = create_and_lock_session(client)
+    for i in range(8):
+        client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": f"p{i}"})
+
+    detail = client.get(f"/session/{session_id}").json()
+    assert detail["session"]["last_summarized_prompt_index"] == 7
+    assert detail["memory_blocks"] == []
+
+    with SessionLocal() as db:
+        assert run_batch_cycle(db, LocalBatchClient(), MockLLMProvider()) == {"submitted": 2, "completed": 2, "fallback": 0}
+    blocks = client.get(f"/session/{session_id}").json()["memory_blocks"]
+    assert [(b["type"], b["from_prompt_index"], b["to_prompt_index"]) for b in blocks] == [
+        ("world_chapter_lock", 0, 0),
+        ("turn_delta", 1, 7),
+    ]
+
+    for i in range(6):
+        client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": f"q{i}"})
+    assert client.post(f"/session/{session_id}/end").status_code == 200
+    blocks = client.get(f"/session/{session_id}").json()["memory_blocks"]
+    assert [(b["from_prompt_index"], b["to_prompt_index"]) for b in blocks] == [(0, 0), (1, 7), (8, 14)]
+
+    with SessionLocal() as db:
+        assert db.execute(select(SummaryJob)).scalars().all() == []
+        providers = db.execute(
+            select(LLMArtifact.provider).where(LLMArtifact.agent_id != "agent_character").order_by(LLMArtifact.created_at)
+        ).scalars().all()
+    assert providers == ["batch-local", "batch-local", "mock"]
+
+
+class UnansweredBatchClient(LocalBatchClient):
+    """A batch that completes without answering anything, so every job falls back to a direct call."""
+
+    def poll(self, batch_id: str) -> dict[str, str] | None:
+        return {}
+
+
+def test_batch_fallback_calls_run_without_job_locks_and_pack_the_range(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "summary_batching", True)
+    monkeypatch.setattr(settings, "pack_summarized_events", True)
+    monkeypatch.setattr(settings, "sqlite_busy_timeout_ms", 1000)
+    # Both sessions have the same transcript; coalescing would make end_chapter wait on the worker's call.
+    monkeypatch.setattr(settings, "llm_coalesce_inflight", False)
+    fallback_started, release_fallback = threading.Event(), threading.Event()
+
+    class SlowProvider(MockLLMProvider):
+        def generate(self, agent_id: str, model: str, payload: dict) -> str:
+            fallback_started.set()
+            release_fallback.wait(5)
+            return super().generate(agent_id, model, payload)
+
+    ended_id, worked_id = create_and_lock_session(client), create_and_lock_session(client)
+    for session_id in (ended_id, worked_id):
+        for i in range(7):
+            client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": f"p{i}"})
+
+    def cycle() -> dict[str, int]:
+        with SessionLocal() as db:
+            return run_batch_cycle(db, UnansweredBatchClient(), SlowProvider())
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        worker = pool.submit(cycle)
+        assert fallback_started.wait(5)
+        # end_chapter flushes the same jobs while the worker's model call is running.
+        started = time.monotonic()
+        assert client.post(f"/session/{ended_id}/end").status_code == 200
+        assert time.monotonic() - started < 0.5
+        release_fallback.set()
+        counts = worker.result()
+
+    assert counts == {"submitted": 2, "completed": 0, "fallback": 1}
+    with SessionLocal() as db:
+        assert db.execute(select(SummaryJob)).scalars().all() == []
+        deltas = db.execute(select(MemoryBlock.session_id).where(MemoryBlock.type == MemoryBlockType.TURN_DELTA)).scalars().all()
+        assert sorted(deltas) == sorted([ended_id, worked_id])
+        chunks = db.execute(select(EventChunk.from_prompt_index, EventChunk.to_prompt_index).where(EventChunk.session_id == worked_id)).all()
+    # The worker wrote the block, so it compacted the range too.
+    assert [tuple(c) for c in chunks] == [(1, 7)]
+
+
+def test_jobs_claimed_by_a_dead_worker_are_taken_over(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "summary_batching", True)
+    session_id = create_and_lock_session(client)
+    for i in range(7):
+        client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": f"p{i}"})
+
+    with SessionLocal() as db:
+        db.execute(update(SummaryJob).values(status=SummaryJobStatus.CLAIMED, updated_at=datetime.utcnow() - CLAIM_TIMEOUT / 2))
+        db.commit()
+        assert run_batch_cycle(db, LocalBatchClient(), MockLLMProvider())["fallback"] == 0
+        db.execute(update(SummaryJob).values(updated_at=datetime.utcnow() - CLAIM_TIMEOUT * 2))
+        db.commit()
+        assert run_batch_cycle(db, LocalBatchClient(), MockLLMProvider())["fallback"] == 1
+        assert db.execute(select(SummaryJob)).scalars().all() == []
+
+
+def test_batch_upload_runs_without_job_locks(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "summary_batching", True)
+    monkeypatch.setattr(settings, "sqlite_busy_timeout_ms", 1000)
+    upload_started, release_upload = threading.Event(), threading.Event()
+
+    class SlowUploadClient(LocalBatchClient):
+        def submit(self, jobs: list[SummaryJob]) -> str:
+            upload_started.set()
+            release_upload.wait(5)
+            return super().submit(jobs)
+
+    ended_id, worked_id = create_and_lock_session(client), create_and_lock_session(client)
+    for session_id in (ended_id, worked_id):
+        for i in range(7):
+            client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": f"{session_id} p{i}"})
+
+    def cycle() -> dict[str, int]:
+        with SessionLocal() as db:
+            return run_batch_cycle(db, SlowUploadClient(), MockLLMProvider())
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        worker = pool.submit(cycle)
+        assert upload_started.wait(5)
+        with SessionLocal() as db:
+            statuses = db.execute(select(SummaryJob.status)).scalars().all()
+        assert statuses == [SummaryJobStatus.SUBMITTING] * 2
+        # end_chapter flushes one of the claimed jobs while the upload is running.
+        started = time.monotonic()
+        assert client.post(f"/session/{ended_id}/end").status_code == 200
+        assert time.monotonic() - started < 0.5
+        release_upload.set()
+        counts = worker.result()
+
+    assert counts == {"submitted": 1, "completed": 1, "fallback": 0}
+    with SessionLocal() as db:
+        assert db.execute(select(SummaryJob)).scalars().all() == []
+        deltas = db.execute(select(MemoryBlock.session_id).where(MemoryBlock.type == MemoryBlockType.TURN_DELTA)).scalars().all()
+    assert sorted(deltas) == sorted([ended_id, worked_id])
+
+
+def test_failed_and_abandoned_uploads_go_back_to_pending(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "summary_batching", True)
+    session_id = create_and_lock_session(client)
+    for i in range(7):
+        client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": f"p{i}"})
+
+    class FailingUploadClient(LocalBatchClient):
+        def submit(self, jobs: list[SummaryJob]) -> str:
+            raise RuntimeError("upload failed")
+
+    with SessionLocal() as db:
+        with pytest.raises(RuntimeError):
+            run_batch_cycle(db, FailingUploadClient(), MockLLMProvider())
+        assert db.execute(select(SummaryJob.status)).scalars().all() == [SummaryJobStatus.PENDING]
+
+        # A worker that died mid-upload leaves SUBMITTING rows; they are resubmitted after CLAIM_TIMEOUT.
+        db.execute(update(SummaryJob).values(status=SummaryJobStatus.SUBMITTING, updated_at=datetime.utcnow() - CLAIM_TIMEOUT / 2))
+        db.commit()
+        assert run_batch_cycle(db, LocalBatchClient(), MockLLMProvider())["submitted"] == 0
+        db.execute(update(SummaryJob).values(updated_at=datetime.utcnow() - CLAIM_TIMEOUT * 2))
+        db.commit()
+        assert run_batch_cycle(db, LocalBatchClient(), MockLLMProvider()) == {"submitted": 1, "completed": 1, "fallback": 0}
+
+
+def test_batch_client_uses_the_configured_endpoint(monkeypatch):
+    monkeypatch.setattr(settings, "llm_provider", "openai")
+    monkeypatch.setattr(settings, "llm_external_enabled", True)
+    monkeypatch.setattr(settings, "openai_api_key", "default-key")
+    monkeypatch.setattr(
+        settings,
+        "openai_endpoints",
+        [
+            {"name": "local", "base_url": "http://gpu-box:8000/v1", "models": {"agent8": "llama-3-8b"}},
+            {"name": "hosted", "base_url": "https://api.example.com/v1/", "api_key": "hosted-key"},
+        ],
+    )
+    batch_client = get_batch_client()
+    assert (batch_client.base_url, batch_client.endpoint.api_key) == ("http://gpu-box:8000/v1", "default-key")
+    assert batch_client.endpoint.model_for("agent8", "gpt-4o-mini") == "llama-3-8b"
+
+    monkeypatch.setattr(settings, "summary_batch_endpoint", "hosted")
+    batch_client = get_batch_client()
+    assert (batch_client.base_url, batch_client.endpoint.api_key) == ("https://api.example.com/v1", "hosted-key")
+
+    monkeypatch.setattr(settings, "summary_batch_endpoint", "missing")
+    with pytest.raises(RuntimeError, match="SUMMARY_BATCH_ENDPOINT"):
+        get_batch_client()
+
+
+def test_long_prompts_trigger_summary_early_and_shrink_recent_context(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "summary_budget_chars", 2000)
+    monkeypatch.setattr(settings, "summary_min_prompts", 2)
+    monkeypatch.setattr(settings, "recent_context_budget_chars", 1500)
+    session_id = create_and_lock_session(client)
+
+    first = client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "x" * 1200}).json()
+    second = client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "y" * 1200}).json()
+    assert first["summary_triggered"] is False
+    assert second["summary_triggered"] is True
+    assert second["session"]["last_summarized_prompt_index"] == 2
+
+    client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "short"})
+    with SessionLocal() as db:
+        artifact = db.execute(
+            select(LLMArtifact)
+            .where(LLMArtifact.session_id == session_id, LLMArtifact.agent_id == "agent_character")
+            .order_by(LLMArtifact.created_at.desc())
+        ).scalars().first()
+    payload = json.loads(artifact.raw_input_ref)
+    # Prompt 1 no longer fits next to prompt 2 in the window.
+    assert payload["meta"]["context_prompt_range"] == [2, 2]
+    assert {ev["prompt_index"] for ev in payload["recent_context"]} == {2}
+
+
+def test_fast_serialized_responses_match_response_models(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "pack_summarized_events", True)
+    session_id = create_and_lock_session(client)
+    for i in range(9):
+        prompt = client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1 + i % 2, "user_text": f"p{i}"}).json()
+    client.post(f"/session/{session_id}/end")
+    client.post(f"/session/{session_id}/build-narrative")
+
+    # Packed and loose events, memory blocks and drafts all render exactly as the pydantic models would.
+    detail = client.get(f"/session/{session_id}").json()
+    assert len(detail["events"]) == 18 and detail["narrative_drafts"]
+    assert SessionDetailResponse.model_validate(detail).model_dump(mode="json") == detail
+    assert PromptResponse.model_validate(prompt).model_dump(mode="json") == prompt
+    tab1 = client.get(f"/session/{session_id}/tab1").json()
+    assert Tab1InputResponse.model_validate(tab1).model_dump(mode="json") == tab1
@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy import select
+
+from app.db import engine
+from app.models import LLMArtifact
+from app.queries import HOT_QUERIES, plan_problems
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(name):
+    # With TEST_DATABASE_URL on Postgres this checks the schema the migrations build, not create_all.
+    with engine.connect() as conn:
+        assert plan_problems(conn, HOT_QUERIES[name]()) == []
+
+
+def test_plan_problems_flags_an_unindexed_sort():
+    with engine.connect() as conn:
+        problems = plan_problems(conn, select(LLMArtifact).order_by(LLMArtifact.model))
+    assert problems and problems[0].startswith(("SCAN ", "Sort on "))
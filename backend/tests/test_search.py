@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select, update
+
+from app.archive import archive_ended_sessions
+from app.config import settings
+from app.db import SessionLocal, engine
+from app.models import SearchDocument, Session as SessionModel
+from app.queries import _Explain, session_search
+from app.transfer import export_ndjson, import_ndjson
+
+sqlite_only = pytest.mark.skipif(engine.dialect.name != "sqlite", reason="SQLite FTS5 index")
+
+WORDS = ["lighthouse", "harbor", "storm", "lantern", "compass", "anchor", "tide", "gull"]
+
+
+def play_session(client: TestClient, prompts: int, end: bool = True) -> str:
+    session_id = client.post("/session").json()["session_id"]
+    client.put(
+        f"/session/{session_id}/tab1",
+        json={"world_text": "w", "chapter_text": "c", "selected_agent_slots": [1], "agent_identity_text_by_slot": {"1": "x"}},
+    )
+    client.post(f"/session/{session_id}/lock")
+    for i in range(prompts):
+        client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": f"the {WORDS[i % len(WORDS)]} at dusk"})
+    if end:
+        client.post(f"/session/{session_id}/end")
+    return session_id
+
+
+def search(client: TestClient, session_id: str, q: str, **params) -> dict:
+    response = client.get(f"/session/{session_id}/search", params={"q": q, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_search_ranks_and_pages_events_memory_and_drafts(client: TestClient):
+    session_id = play_session(client, prompts=16)
+    other_id = play_session(client, prompts=2)
+    assert client.post(f"/session/{session_id}/build-narrative").status_code == 200
+
+    body = search(client, session_id, "lighthouse")
+    # Prompts 1 and 9 use the word; each has a user event and an agent reply echoing it.
+    assert sorted((hit["kind"], hit["prompt_index"]) for hit in body["results"]) == [("event", 1), ("event", 1), ("event", 9), ("event", 9)]
+    assert body["has_more"] is False
+
+    assert {hit["kind"] for hit in search(client, session_id, "turn delta summary")["results"]} == {"memory"}
+    assert [hit["kind"] for hit in search(client, session_id, "narrative draft")["results"]] == ["draft"]
+    # Stemming, several words ANDed, punctuation taken literally.
+    assert len(search(client, session_id, "Lighthouses dusk")["results"]) == 4
+    assert search(client, session_id, 'storm "OR" -harbor:')["results"] == []
+    assert all(hit["prompt_index"] <= 2 for hit in search(client, other_id, "dusk", limit=100)["results"])
+
+    first = search(client, session_id, "dusk", limit=10)
+    second = search(client, session_id, "dusk", limit=10, offset=10)
+    ranks = [hit["rank"] for hit in first["results"] + second["results"]]
+    assert first["has_more"] is True and ranks == sorted(ranks, reverse=True)
+    assert len({hit["source_id"] for hit in first["results"] + second["results"]}) == 20
+
+    assert client.get(f"/session/{session_id}/search", params={"q": ""}).status_code == 422
+    assert client.get("/session/missing/search", params={"q": "storm"}).status_code == 404
+
+
+def test_search_documents_survive_packing_archive_and_transfer(client: TestClient, monkeypatch: pytest.MonkeyPatch, tmp_path, empty_db):
+    monkeypatch.setattr(settings, "pack_summarized_events", True)
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+    session_id = play_session(client, prompts=16)
+    expected = search(client, session_id, "harbor")["results"]
+    assert len(expected) == 4
+
+    with SessionLocal() as db:
+        db.execute(update(SessionModel).values(updated_at=datetime.utcnow() - timedelta(days=40)))
+        db.commit()
+        assert archive_ended_sessions(db, older_than_days=30) == 1
+        assert db.scalar(select(func.count()).select_from(SearchDocument)) == 0
+    assert search(client, session_id, "harbor")["results"] == expected
+
+    with SessionLocal() as db:
+        lines = list(export_ndjson(db, [session_id]))
+    # Import into an empty database, as when moving a session between environments.
+    empty_db()
+    with SessionLocal() as db:
+        import_ndjson(db, lines)
+    assert [hit["source_id"] for hit in search(client, session_id, "harbor")["results"]] == [hit["source_id"] for hit in expected]
+
+
+@sqlite_only
+def test_sqlite_search_reads_through_the_fts_index():
+    with engine.connect() as conn:
+        plan = [row[-1] for row in conn.execute(_Explain(session_search("s", "storm", "sqlite")))]
+    assert any("VIRTUAL TABLE INDEX" in step for step in plan)
+    assert any(step.startswith("SEARCH search_documents USING INTEGER PRIMARY KEY") for step in plan)
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app import main as main_module
+from app.config import settings
+from app.llm import MockLLMProvider, raise_if_cancelled, use_provider
+from app.sharding import FORWARDED_HEADER, OWNER_HEADER, HashRing, Membership, ShardRouterMiddleware
+
+
+def test_ring_moves_only_the_removed_nodes_keys():
+    keys = [f"session-{i}" for i in range(2000)]
+    before = HashRing(["http://a", "http://b", "http://c"])
+    after = HashRing(["http://a", "http://b"])
+
+    owners = {key: before.owner(key) for key in keys}
+    assert set(owners.values()) == {"http://a", "http://b", "http://c"}
+    moved = [key for key in keys if after.owner(key) != owners[key]]
+    assert moved and all(owners[key] == "http://c" for key in moved)
+
+
+def _node(name: str) -> FastAPI:
+    node = FastAPI()
+
+    @node.post("/session/{session_id}/prompt")
+    async def prompt(session_id: str, request: Request):
+        return {
+            "node": name,
+            "forwarded_by": request.headers.get(FORWARDED_HEADER),
+            "forwarded_for": request.headers.get("x-forwarded-for"),
+            "body": await request.json(),
+        }
+
+    return node
+
+
+def test_router_forwards_misrouted_sessions_to_the_owner():
+    ring = HashRing(["http://a", "http://b"])
+    owned_by_b = next(f"s{i}" for i in range(100) if ring.owner(f"s{i}") == "http://b")
+    owned_by_a = next(f"s{i}" for i in range(100) if ring.owner(f"s{i}") == "http://a")
+
+    membership = Membership("http://a", nodes=["http://a", "http://b"])
+    transport = httpx.ASGITransport(app=_node("b"))
+    node_a = ShardRouterMiddleware(_node("a"), membership, transport=transport)
+
+    with TestClient(node_a) as client:
+        forwarded = client.post(f"/session/{owned_by_b}/prompt", json={"user_text": "hi"})
+        local = client.post(f"/session/{owned_by_a}/prompt", json={"user_text": "hi"})
+        pinned = client.post(f"/session/{owned_by_b}/prompt", json={}, headers={FORWARDED_HEADER: "http://c"})
+
+    assert forwarded.json() == {
+        "node": "b",
+        "forwarded_by": "http://a",
+        "forwarded_for": "testclient",
+        "body": {"user_text": "hi"},
+    }
+    assert forwarded.headers[OWNER_HEADER] == "http://b"
+    assert local.json()["node"] == "a"
+    assert pinned.json()["node"] == "a"
+
+
+def failing(error: type[httpx.HTTPError]) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise error("boom", request=request)
+
+    return httpx.MockTransport(handler)
+
+
+def test_router_only_serves_locally_when_the_owner_was_never_reached():
+    ring = HashRing(["http://a", "http://b"])
+    owned_by_b = next(f"s{i}" for i in range(100) if ring.owner(f"s{i}") == "http://b")
+    membership = Membership("http://a", nodes=["http://a", "http://b"])
+
+    with TestClient(ShardRouterMiddleware(_node("a"), membership, transport=failing(httpx.ConnectError))) as client:
+        refused = client.post(f"/session/{owned_by_b}/prompt", json={"user_text": "hi"})
+    with TestClient(ShardRouterMiddleware(_node("a"), membership, transport=failing(httpx.ReadTimeout))) as client:
+        timed_out = client.post(f"/session/{owned_by_b}/prompt", json={"user_text": "hi"})
+
+    assert refused.json()["node"] == "a"
+    # The owner may have run the turn already, so it is not replayed here.
+    assert timed_out.status_code == 502
+    assert timed_out.headers[OWNER_HEADER] == "http://b"
+
+
+class SlowProvider(MockLLMProvider):
+    """Takes several disconnect polls per call, checking for cancellation like a streamed call does."""
+
+    def generate(self, agent_id: str, model: str, payload: dict) -> str:
+        for _ in range(20):
+            raise_if_cancelled()
+            time.sleep(0.01)
+        return super().generate(agent_id, model, payload)
+
+
+def test_local_fallback_through_the_app_is_not_cancelled(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "disconnect_poll_seconds", 0.02)
+    session_id = client.post("/session").json()["session_id"]
+    client.put(f"/session/{session_id}/tab1", json={"selected_agent_slots": [1]})
+    client.post(f"/session/{session_id}/lock")
+    # Every session belongs to the unreachable node b, so node a serves them itself.
+    node_a = ShardRouterMiddleware(main_module.app, Membership("http://a", nodes=["http://b"]), transport=failing(httpx.ConnectError))
+
+    async def prompt() -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=node_a), base_url="http://a") as node:
+            return await node.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": "hello"})
+
+    with use_provider(SlowProvider()):
+        response = asyncio.run(prompt())
+    assert response.status_code == 200
+    assert response.json()["session"]["prompt_index"] == 1
+
+
+def test_membership_file_change_notifies_listeners(tmp_path):
+    path = tmp_path / "nodes.txt"
+    path.write_text("http://a\nhttp://b\n")
+    membership = Membership("http://a", path=str(path), refresh_seconds=0)
+    changes = []
+    membership.on_change(lambda ring: changes.append(ring.nodes))
+
+    assert membership.ring().nodes == ["http://a", "http://b"]
+    path.write_text('["http://a"]')
+    os.utime(path, (1, 1))
+    assert membership.ring().nodes == ["http://a"]
+    assert changes == [["http://a", "http://b"], ["http://a"]]
+    assert membership.owns("anything")
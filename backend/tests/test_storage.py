@@ -0,0 +1,305 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.archive import archive_ended_sessions, archive_path, archive_session
+from app.config import settings
+from app.db import SessionLocal, engine
+from app.eventstore import compact_session, compact_session_by_id
+from app.llm import MockLLMProvider, use_provider
+from app.migrate import current_version, latest_version, migrate, verify_schema
+from app.models import Event, EventChunk, LLMArtifact, Session as SessionModel, SessionState
+from app.queries import archivable_sessions
+from app.replay import replay_session
+from app.services import prompt_agent
+from app.transfer import import_ndjson
+
+sqlite_only = pytest.mark.skipif(engine.dialect.name != "sqlite", reason="SQLite-specific")
+
+
+def play_and_end_session(client: TestClient, prompts: int = 3) -> str:
+    session_id = client.post("/session").json()["session_id"]
+    client.put(
+        f"/session/{session_id}/tab1",
+        json={"world_text": "w", "chapter_text": "c", "selected_agent_slots": [1], "agent_identity_text_by_slot": {"1": "x"}},
+    )
+    client.post(f"/session/{session_id}/lock")
+    for i in range(prompts):
+        client.post(f"/session/{session_id}/prompt", json={"agent_slot": 1, "user_text": f"u{i}"})
+    client.post(f"/session/{session_id}/end")
+    return session_id
+
+
+@pytest.fixture()
+def archive_dir(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "archive_dir", str(tmp_path))
+    return tmp_path
+
+
+def test_archived_session_rehydrates_on_access(client: TestClient, archive_dir):
+    session_id = play_and_end_session(client)
+    before = client.get(f"/session/{session_id}").json()
+
+    with SessionLocal() as db:
+        db.execute(update(SessionModel).values(updated_at=datetime.utcnow() - timedelta(days=40)))
+        db.commit()
+        assert archive_ended_sessions(db, older_than_days=30) == 1
+        assert db.scalar(select(func.count()).select_from(Event)) == 0
+        assert db.scalar(select(func.count()).select_from(LLMArtifact)) == 0
+    assert archive_path(session_id).exists()
+
+    after = client.get(f"/session/{session_id}").json()
+    assert after["events"] == before["events"]
+    assert after["memory_blocks"] == before["memory_blocks"]
+    assert not archive_path(session_id).exists()
+
+    assert client.post(f"/session/{session_id}/build-narrative").status_code == 200
+
+
+def test_recent_and_active_sessions_are_not_archived(client: TestClient, archive_dir):
+    play_and_end_session(client)
+    active_id = client.post("/session").json()["session_id"]
+
+    with SessionLocal() as db:
+        db.execute(update(SessionModel).where(SessionModel.session_id == active_id).values(updated_at=datetime.utcnow() - timedelta(days=40)))
+        db.commit()
+        assert archive_ended_sessions(db, older_than_days=30) == 0
+
+
+def test_archiver_skips_a_session_that_changed_after_it_was_listed(client: TestClient, archive_dir):
+    session_id = play_and_end_session(client)
+
+    with SessionLocal() as db:
+        (candidate,) = db.scalars(archivable_sessions(datetime.utcnow() + timedelta(seconds=1))).all()
+        # A narrative build starts on another connection before the archiver gets to it.
+        with SessionLocal() as other:
+            other.execute(update(SessionModel).values(state=SessionState.NARRATING))
+            other.commit()
+        assert archive_session(db, candidate) is False
+        db.commit()
+        assert db.scalar(select(func.count()).select_from(Event)) > 0
+    assert not archive_path(session_id).exists()
+
+
+def test_export_then_import_round_trips_sessions(client: TestClient, empty_db):
+    session_id = play_and_end_session(client, prompts=8)
+    client.post(f"/session/{session_id}/build-narrative")
+    before = client.get(f"/session/{session_id}").json()
+
+    resp = client.get("/sessions/export", params={"session_id": session_id, "include_artifacts": "true"})
+    assert resp.status_code == 200
+    lines = resp.text.splitlines()
+    assert [json.loads(line)["table"] for line in lines[:2]] == ["sessions", "tab1_inputs"]
+
+    empty_db()
+    with SessionLocal() as db:
+        counts = import_ndjson(db, lines, batch_size=5)
+    assert counts["sessions"] == 1
+    assert counts["events"] == 16
+    assert counts["llm_artifacts"] == 12
+
+    assert client.get(f"/session/{session_id}").json() == before
+
+
+def test_replay_reproduces_recorded_session(client: TestClient):
+    session_id = play_and_end_session(client, prompts=10)
+    client.post(f"/session/{session_id}/build-narrative")
+
+    with SessionLocal() as db:
+        report = replay_session(db, session_id)
+    summary = report.summary()
+    assert summary["calls"] == 14
+    assert set(summary["matches"]) <= {"exact", "normalized"}
+    assert summary["divergences"] == []
+    assert summary["unused_artifacts"] == 0
+    assert summary["prompt_seconds"]["count"] == 10
+
+
+def test_replay_flags_payload_divergence(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    session_id = play_and_end_session(client, prompts=10)
+    monkeypatch.setattr(settings, "chunk_size_prompts", 5)
+
+    with SessionLocal() as db:
+        report = replay_session(db, session_id)
+    assert {d["agent_id"] for d in report.summary()["divergences"]} >= {"agent8"}
+
+
+def test_packed_event_chunks_read_back_like_rows(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    def transcript(session_id: str) -> list[tuple]:
+        events = client.get(f"/session/{session_id}").json()["events"]
+        return [(e["prompt_index"], e["role"], e["agent_slot"], e["text"]) for e in events]
+
+    loose_id = play_and_end_session(client, prompts=16)
+    monkeypatch.setattr(settings, "pack_summarized_events", True)
+    packed_id = play_and_end_session(client, prompts=16)
+
+    with SessionLocal() as db:
+        chunks = db.execute(select(EventChunk).where(EventChunk.session_id == packed_id)).scalars().all()
+        assert [(c.from_prompt_index, c.to_prompt_index, c.event_count) for c in chunks] == [(1, 7, 14), (8, 14, 14), (15, 16, 4)]
+        assert db.scalar(select(func.count()).select_from(Event).where(Event.session_id == packed_id)) == 0
+
+    assert transcript(packed_id) == transcript(loose_id)
+    assert client.post(f"/session/{packed_id}/build-narrative").status_code == 200
+    with SessionLocal() as db:
+        assert replay_session(db, packed_id).summary()["divergences"] == []
+
+
+def test_concurrent_compactions_pack_each_range_once(client: TestClient):
+    session_id = play_and_end_session(client, prompts=8)
+
+    first = SessionLocal()
+    assert compact_session(first, first.get(SessionModel, session_id)) == 2
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        second = pool.submit(compact_session_by_id, session_id)
+        # Waits on the session row lock until the first compaction commits, then finds nothing left to pack.
+        time.sleep(0.2)
+        assert not second.done()
+        first.commit()
+        first.close()
+        assert second.result() == 0
+
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count()).select_from(EventChunk)) == 2
+        db.add(EventChunk(session_id=session_id, from_prompt_index=1, to_prompt_index=7, event_count=0, payload=b""))
+        with pytest.raises(IntegrityError):
+            db.commit()
+
+
+@sqlite_only
+def test_migrate_stamps_latest_version_and_startup_verifies():
+    assert current_version(engine) is None
+    with pytest.raises(RuntimeError):
+        verify_schema(engine)
+
+    assert migrate(engine)[-1] == latest_version()
+    assert current_version(engine) == latest_version()
+    verify_schema(engine)
+    assert migrate(engine) == []
+
+
+@sqlite_only
+def test_migrate_adds_columns_an_older_sqlite_database_lacks(tmp_path):
+    old = create_engine(f"sqlite+pysqlite:///{tmp_path}/old.db")
+    with old.begin() as conn:
+        # sessions as the pre-migration create_all hook made it: no archived_at (002) or unsummarized_chars (007).
+        conn.exec_driver_sql(
+            "CREATE TABLE sessions (session_id VARCHAR(36) PRIMARY KEY, state VARCHAR(32) NOT NULL, "
+            "prompt_index INTEGER NOT NULL, selected_agent_slots JSON NOT NULL, agent_names JSON NOT NULL, "
+            "tab1_locked BOOLEAN NOT NULL, last_summarized_prompt_index INTEGER NOT NULL, "
+            "narrative_agent_definition_text TEXT NOT NULL, created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)"
+        )
+        conn.exec_driver_sql("INSERT INTO sessions VALUES ('s1', 'ENDED', 3, '[]', '{}', 1, 0, '', '2024-01-01', '2024-01-01')")
+    try:
+        assert migrate(old)[-1] == latest_version()
+        with Session(old) as db:
+            session = db.get(SessionModel, "s1")
+            assert session.archived_at is None and session.unsummarized_chars == 0
+            assert db.scalars(archivable_sessions(datetime(2025, 1, 1))).all() == [session]
+        assert "idx_sessions_unarchived_state_updated" in {index["name"] for index in inspect(old).get_indexes("sessions")}
+    finally:
+        old.dispose()
+
+
+@sqlite_only
+def test_tuned_sqlite_applies_pragmas_and_queues_writers():
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == settings.sqlite_busy_timeout_ms
+
+    first, second = SessionLocal(), SessionLocal()
+    first.add(SessionModel())
+    first.flush()
+    committed = threading.Event()
+
+    def write():
+        second.add(SessionModel())
+        second.commit()
+        committed.set()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    # The second writer waits for the first transaction instead of failing with "database is locked".
+    assert not committed.wait(0.2)
+    # Readers are not queued behind it.
+    with SessionLocal() as reader:
+        assert reader.scalar(select(func.count()).select_from(SessionModel)) == 0
+    first.commit()
+    assert committed.wait(5)
+    writer.join()
+    first.close()
+    second.close()
+    with SessionLocal() as reader:
+        assert reader.scalar(select(func.count()).select_from(SessionModel)) == 2
+
+
+def test_concurrent_turns_do_not_hold_the_write_lock_during_generation(client: TestClient):
+    class SlowProvider(MockLLMProvider):
+        def generate(self, agent_id: str, model: str, payload: dict) -> str:
+            time.sleep(0.1)
+            return super().generate(agent_id, model, payload)
+
+    session_ids = []
+    for _ in range(8):
+        session_id = client.post("/session").json()["session_id"]
+        client.put(f"/session/{session_id}/tab1", json={"selected_agent_slots": [1]})
+        client.post(f"/session/{session_id}/lock")
+        session_ids.append(session_id)
+
+    def turn(session_id: str) -> int:
+        with use_provider(SlowProvider()), SessionLocal() as db:
+            return prompt_agent(db, session_id, 1, "hello")[0].prompt_index
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(pool.map(turn, session_ids)) == [1] * 8
+    # Generation overlaps; serialized it would take at least 0.8s.
+    assert time.monotonic() - started < 0.6
+
+
+def test_summary_generation_does_not_hold_the_write_lock(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(settings, "chunk_size_prompts", 2)
+    monkeypatch.setattr(settings, "sqlite_busy_timeout_ms", 1000)
+    summary_started, release_summary = threading.Event(), threading.Event()
+
+    class SlowSummaryProvider(MockLLMProvider):
+        def generate(self, agent_id: str, model: str, payload: dict) -> str:
+            if agent_id == "agent8":
+                summary_started.set()
+                release_summary.wait(5)
+            return super().generate(agent_id, model, payload)
+
+    session_ids = []
+    for _ in range(2):
+        session_id = client.post("/session").json()["session_id"]
+        client.put(f"/session/{session_id}/tab1", json={"selected_agent_slots": [1]})
+        client.post(f"/session/{session_id}/lock")
+        session_ids.append(session_id)
+    summarized_id, other_id = session_ids
+    client.post(f"/session/{summarized_id}/prompt", json={"agent_slot": 1, "user_text": "first"})
+
+    def summarizing_turn() -> list:
+        with use_provider(SlowSummaryProvider()), SessionLocal() as db:
+            prompt_agent(db, summarized_id, 1, "second")
+            return db.execute(select(LLMArtifact.raw_input_ref).where(LLMArtifact.agent_id == "agent8")).scalars().all()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        summary = pool.submit(summarizing_turn)
+        assert summary_started.wait(5)
+        # Another session's turn commits while the summary call is still waiting.
+        started = time.monotonic()
+        with SessionLocal() as db:
+            assert prompt_agent(db, other_id, 1, "meanwhile")[0].prompt_index == 1
+        assert time.monotonic() - started < 0.5
+        release_summary.set()
+        (summary_input,) = summary.result()
+    # The summary still covers the current turn's user prompt.
+    assert [e["text"] for e in json.loads(summary_input)["events"] if e["role"] == "user"] == ["first", "second"]